@@ -1,7 +1,9 @@
 #!/usr/bin/python3
 import os
 import json
+import time
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 os.environ['MAKEHUMAN2TOOL'] = str(True)
 
@@ -38,26 +40,137 @@ def getNumVerts(basename, systemspace, userspace):
                 return baselines["numverts"]
     return -1
 
-def compressFile(glob, eqtype, path, source):
-    filename = os.path.join(path, source)
-    asset =  attachedAsset(glob, eqtype, glob.env.numverts)
-    asset.mhcloToMHBin(filename)
+def assetSources(path):
+    """
+    get the ASCII files a binary is compiled from (the asset itself and the obj-file it references)
+    """
+    sources = [path]
+    if path.endswith(".obj"):
+        return sources
+    with open(path, "r", encoding="utf-8", errors='ignore') as fp:
+        for line in fp:
+            words = line.split()
+            if len(words) > 1 and words[0].rstrip(":") == "obj_file":
+                sources.append(os.path.join(os.path.dirname(path), words[1]))
+                break
+    return sources
+
+def isStale(path):
+    """
+    true when binary is missing or older than one of its sources
+    """
+    binary = path[:-4] if path.endswith(".obj") else path[:-6]
+    binary += ".mhbin"
+    if not os.path.isfile(binary):
+        return True
+    bindate = os.stat(binary).st_mtime
+    return any(os.path.isfile(source) and os.stat(source).st_mtime > bindate for source in assetSources(path))
+
+def collectJobs(space, basename, filename=None, stale=False):
+    """
+    collect base mesh and assets to compile as list of (type, path)
+    """
+    jobs = []
+    base =  os.path.join(space, "base", basename, "base.obj")
+    if os.path.isfile (base):
+        if filename is None or "base" in filename:
+            jobs.append(("base", base))
+
+    for folder in ["clothes", "eyebrows", "eyelashes", "eyes", "hair", "proxy", "teeth", "tongue"]:
+        absfolder = os.path.join(space, folder, basename)
+        if os.path.isdir(absfolder):
+            for root, dirs, files in os.walk(absfolder, topdown=True):
+                for name in files:
+                    if name.endswith(".mhclo") or name.endswith(".proxy"):
+                        if filename is None or filename in name:
+                            jobs.append((folder, os.path.join(root, name)))
+
+    if stale:
+        jobs = [job for job in jobs if isStale(job[1])]
+    return jobs
+
+# glob of the worker process, set by initWorker
+#
+workerGlob = None
+
+def initWorker(env, quiet=False, storage="float32"):
+    global workerGlob
+    if quiet:
+        env.logLine = quietLogLine
+    workerGlob = globalObjects(env)
+    workerGlob.storage = storage
 
-def compressSingleFile(glob, name):
+def quietLogLine(level, line):
+    pass
+
+def compileJob(job):
+    """
+    compile one base mesh or asset to mhbin (runs in worker process)
+
+    :param job: tuple of (type, path)
+    :return: path, success, error-text, time in seconds
+    """
+    eqtype, path = job
+    start = time.perf_counter()
+    try:
+        if eqtype == "base":
+            basemesh = object3d(workerGlob, None, "base")
+            (res, err) = basemesh.load(path, True)
+            if res > 0:
+                (res, err) = basemesh.exportBinary()
+        else:
+            asset =  attachedAsset(workerGlob, eqtype, workerGlob.env.numverts)
+            (res, err) = asset.mhcloToMHBin(path, workerGlob.storage)
+    except Exception as error:
+        (res, err) = (0, str(error))
+    return path, bool(res), err, time.perf_counter() - start
+
+def compileJobs(env, jobs, numjobs, storage="float32"):
+    """
+    compile all jobs, in a process pool when more than one job is used, print a summary
+
+    :return: number of failed jobs
+    """
+    start = time.perf_counter()
+    results = []
+    if numjobs > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(numjobs, len(jobs)), initializer=initWorker, initargs=(env, True, storage)) as pool:
+            futures = [pool.submit(compileJob, job) for job in jobs]
+            for future in as_completed(futures):
+                result = future.result()
+                print ("Compiled: " + result[0] if result[1] else "Failed:   " + result[0])
+                results.append(result)
+    else:
+        initWorker(env, storage=storage)
+        for job in jobs:
+            results.append(compileJob(job))
+
+    failed = [result for result in results if not result[1]]
+    print ("\nTime (s)  Asset")
+    for path, ok, err, seconds in sorted(results, key=lambda x: x[3], reverse=True):
+        print ("%8.3f  %s%s" % (seconds, path, "" if ok else "  [failed]"))
+    for path, ok, err, seconds in failed:
+        print ("Error: " + path + ": " + str(err))
+
+    print ("\n" + str(len(results) - len(failed)) + " mesh(es) compiled, " + str(len(failed)) + " failed, "
+            + "%.2f s (%.2f s in total for all assets)" % (time.perf_counter() - start, sum(result[3] for result in results)))
+    return len(failed)
+
+def compressSingleFile(glob, name, storage="float32"):
     if name.endswith(".obj"):
-        basemesh = object3d(glob, None, "base")
-        (res, err) = basemesh.load(name, True)
-        if res == 0:
-            print (err)
-            exit(10)
-        basemesh.exportBinary()
+        eqtype = "base"
     elif name.endswith(".mhclo") or name.endswith(".proxy"):
         p, f = os.path.split(name)
         p, sd = os.path.split(p)
         p, m = os.path.split(p)
         p, eqtype = os.path.split(p)
-        asset =  attachedAsset(glob, eqtype, glob.env.numverts)
-        asset.mhcloToMHBin(name)
+    else:
+        return True
+    initWorker(glob.env, storage=storage)
+    (path, ok, err, seconds) = compileJob((eqtype, name))
+    if not ok:
+        print (err)
+    return ok
 
 if __name__ == '__main__':
     # get predefined environment parameters (standardmesh)
@@ -98,6 +211,10 @@ if __name__ == '__main__':
         parser.add_argument("-u", action="store_true", help="compile user space instead of system space")
 
     parser.add_argument("-n", action="store_true", help="compile non interactive")
+    parser.add_argument("-c", "--changed", action="store_true", help="compile only assets where ASCII files are newer than the binary")
+    parser.add_argument("-q", "--storage", type=str, choices=["float32", "float16", "int16"], default="float32",
+            help="storage of asset fitting data, float16 or int16 (quantized with a scale per array) halve the size")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="number of parallel processes (default: number of CPUs)")
     parser.add_argument("filename", nargs="?", type=str, help="compile only assets which are similar to this filename")
 
     args = parser.parse_args()
@@ -115,8 +232,7 @@ if __name__ == '__main__':
     #
     if args.file:
         glob = globalObjects(uenv)
-        compressSingleFile(glob, args.file)
-        exit(0)
+        exit(0 if compressSingleFile(glob, args.file, args.storage) else 10)
 
 
     space = None
@@ -157,36 +273,12 @@ if __name__ == '__main__':
             if line == "c":
                 okay = True
 
-    glob = globalObjects(uenv)
-
-    # first compile base if added to user space or system space
+    # first compile base if added to user space or system space, then all assets
     #
-    num = 0
-    base =  os.path.join(space, "base", args.base, "base.obj")
-    if os.path.isfile (base):
-        if args.filename is None or "base" in args.filename:
-            print ("Found: " + base)
-            basemesh = object3d(glob, None, "base")
-            (res, err) = basemesh.load(base, True)
-            if res == 0:
-                print (err)
-                exit(10)
-            basemesh.exportBinary()
-            num += 1
+    jobs = collectJobs(space, args.base, args.filename, args.changed)
+    if len(jobs) == 0:
+        print ("Nothing to compile.")
+        exit(0)
 
-    for folder in ["clothes", "eyebrows", "eyelashes", "eyes", "hair", "proxy", "teeth", "tongue"]:
-        absfolder = os.path.join(space, folder, args.base)
-        if os.path.isdir(absfolder):
-            for root, dirs, files in os.walk(absfolder, topdown=True):
-                for name in files:
-                    if name.endswith(".mhclo") or name.endswith(".proxy"):
-                        if args.filename:
-                            if args.filename in name:
-                                compressFile (glob, folder, root, name)
-                                num += 1
-                        else:
-                            compressFile (glob, folder, root, name)
-                            num += 1
-
-    print (str(num) + " mesh(es) compiled.")
-    exit(0)
+    failed = compileJobs(uenv, jobs, args.jobs, args.storage)
+    exit(10 if failed > 0 else 0)
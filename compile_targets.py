@@ -39,13 +39,15 @@ if __name__ == '__main__':
         parser.add_argument("-u", action="store_true", help="compile user space instead of system space")
 
     parser.add_argument("-n", action="store_true", help="compile non interactive")
+    parser.add_argument("-q", "--storage", type=str, choices=["float32", "float16", "int16"], default="float32",
+            help="storage of deltas, float16 or int16 (quantized with a scale per target) halve the size")
 
     args = parser.parse_args()
 
     if args.file:
         at = TargetASCII()
         dest = os.path.join(args.file, "compressedtargets.npz")
-        at.compressAllTargets(args.file, dest, 1)
+        at.compressAllTargets(args.file, dest, 1, storage=args.storage)
         exit(0)
 
     space = None
@@ -105,5 +107,5 @@ if __name__ == '__main__':
     for elem in space:
         at = TargetASCII()
         dest = os.path.join(elem, "compressedtargets.npz")
-        at.compressAllTargets(elem, dest, 1)
+        at.compressAllTargets(elem, dest, 1, storage=args.storage)
 
@@ -117,6 +117,22 @@ class apiSocket(QThread):
                 self.jsonparam = {}
                 self.viewRedisplay.emit(1)
                 return True
+            elif f == "fitmeasures":
+                if "params" not in js or "measures" not in js["params"]:
+                    self.error =  "Missing measures"
+                    self.errcode = 5
+                    return False
+                p = js["params"]
+                groups = p["groups"] if "groups" in p else None
+                values, reached = baseclass.measuresolver.solve(p["measures"], groups)
+                if values is None:
+                    self.error =  "No measurements or modifiers to solve"
+                    self.errcode = 6
+                    return False
+                baseclass.measuresolver.apply(values, True)
+                self.jsonparam = {"modifiers": values, "measures": reached }
+                self.viewRedisplay.emit(1)
+                return True
 
         self.error =  "Unknown command"
         self.errcode = 3
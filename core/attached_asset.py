@@ -3,8 +3,10 @@
     Author: black-punkduck
 
     Classes:
-    * referenceVerts
     * attachedAsset
+
+    Functions:
+    * parseReferenceVerts
 """
 
 import os
@@ -12,60 +14,42 @@ import numpy as np
 from core.debug import dumper
 from obj3d.fops_binary import exportObj3dBinary, importObjValues
 from obj3d.object3d  import object3d
+from obj3d.topology import topologyKey
 from obj3d.bone import boneWeights
+from core.quantize import compactIndices, quantize, dequantize
 
-class referenceVerts:
-    def __init__(self):
-        pass
-
-    def __str__(self):
-        return "N:"+ str(self._verts) + " W:" + str(self._weights) + " O:" + str(self._offset)
-
-    def identicalValue(self, words, vnum, vertWeights):
-        v0 = int(words[0])
-        self._verts = (v0,v0,v0)
-        self._weights = (1.0,0.0,0.0)
-        self._offset = np.zeros(3, float)
-        if v0 in vertWeights:
-            vertWeights[v0].append((vnum, 1))
-        else:
-            vertWeights[v0] = [(vnum,1)]
-        return self
-
-    def fromTriple(self, words, vnum, vertWeights):
-        v0 = int(words[0])
-        v1 = int(words[1])
-        v2 = int(words[2])
-        w0 = float(words[3])
-        w1 = float(words[4])
-        w2 = float(words[5])
-        if len(words) > 6:
-            d0 = float(words[6])
-            d1 = float(words[7])
-            d2 = float(words[8])
-        else:
-            (d0,d1,d2) = (0,0,0)
-
-        self._verts = (v0,v1,v2)
-        self._weights = (w0,w1,w2)
-        self._offset = np.array((d0,d1,d2), float)
-
-        if v0 in vertWeights:
-            vertWeights[v0].append((vnum, w0))
-        else:
-            vertWeights[v0] = [(vnum,w0)]
-
-        if v1 in vertWeights:
-            vertWeights[v1].append((vnum, w1))
-        else:
-            vertWeights[v1] = [(vnum,w1)]
+def parseReferenceVerts(lines):
+    """
+    bulk parse the reference vertex block of an mhclo/proxy file, lines are grouped by
+    number of columns, each group is converted with one array operation
 
-        if v2 in vertWeights:
-            vertWeights[v2].append((vnum, w2))
+    :param lines: list of lines (strings) of the verts section
+    :return: ref_vIdxs (n,3), weights (n,3), offsets (n,3) or None if malformed
+    """
+    num = len(lines)
+    ref_vIdxs = np.zeros((num, 3), dtype=np.uint32)
+    weights = np.zeros((num, 3), dtype=np.float32)
+    offsets = np.zeros((num, 3), dtype=np.float32)
+    if num == 0:
+        return ref_vIdxs, weights, offsets
+
+    sizes = np.fromiter((line.count(" ") for line in lines), dtype=np.int32, count=num)
+    for size in np.unique(sizes):
+        rows = np.flatnonzero(sizes == size)
+        values = np.array(" ".join([lines[i] for i in rows]).split(), dtype=np.float64)
+        columns = len(values) // len(rows)
+        if columns * len(rows) != len(values) or columns not in (1, 6) and columns < 9:
+            return None
+        values = values.reshape(-1, columns)
+        if columns == 1:
+            ref_vIdxs[rows] = values.astype(np.uint32)
+            weights[rows, 0] = 1.0
         else:
-            vertWeights[v2] = [(vnum,w2)]
-
-        return self
+            ref_vIdxs[rows] = values[:, 0:3].astype(np.uint32)
+            weights[rows] = values[:, 3:6]
+            if columns > 6:
+                offsets[rows] = values[:, 6:9]
+    return ref_vIdxs, weights, offsets
 
 
 class attachedAsset:
@@ -81,7 +65,6 @@ class attachedAsset:
         self.version = 110
         self.z_depth = 1 if eqtype == "proxy" else 50
         self.obj = None             # will contain the object3d class
-        self.vertWeights = {}       # will contain the parent weight
         self.description = ""
         self.license = ""
         self.author = ""
@@ -102,6 +85,7 @@ class attachedAsset:
         self.standard_material = None # path material, fully qualified
         self.vertexboneweights_file = None # path to vbone file
         self.bWeights = None        # bone weights
+        self.cachedWeights = None   # bone weights saved in binary (arrays, see boneWeights.packWeights)
         self.materialsource = None    # path material, relative
         if num_base_verts is None:
             self.base_verts = self.glob.baseClass.baseMesh.n_origverts
@@ -130,8 +114,7 @@ class attachedAsset:
         #          2, read delete_verts
         #
         status = 0
-        refVerts = [] # local reference for vertices
-        vnum   = 0    # will contain the vertex number (counting from 0 to x)
+        refVerts = [] # lines of reference vertices, parsed in the end
         self.deleteVerts = np.zeros(self.base_verts, bool)
 
         for line in fp:
@@ -164,13 +147,7 @@ class attachedAsset:
 
             if status == 1:
                 if key.isnumeric():
-                    refVert = referenceVerts()
-                    refVerts.append(refVert)
-                    if len(words) == 1:
-                        value = refVert.identicalValue(words, vnum, self.vertWeights)
-                    else:
-                        refVert.fromTriple(words, vnum, self.vertWeights)
-                    vnum += 1
+                    refVerts.append(" ".join(words))
                     continue
 
             elif status == 2:
@@ -231,9 +208,10 @@ class attachedAsset:
 
         # finally create the numpy arrays here
         #
-        self.weights = np.asarray([v._weights for v in refVerts], dtype=np.float32)
-        self.ref_vIdxs = np.asarray([v._verts for v in refVerts], dtype=np.uint32)
-        self.offsets = np.asarray([v._offset for v in refVerts], dtype=np.float32)
+        refs = parseReferenceVerts(refVerts)
+        if refs is None:
+            return False, "Malformed reference vertices in " + filename
+        (self.ref_vIdxs, self.weights, self.offsets) = refs
         if self.type == "proxy":
             self.z_depth = 1
 
@@ -302,17 +280,28 @@ class attachedAsset:
         else:
             self.vertexboneweights_file = vwfile
 
+        # compact storage: float16 is used directly, int16 is dequantized
+        #
+        wscale = npzfile["weights_scale"].item() if "weights_scale" in npzfile else None
+        oscale = npzfile["offsets_scale"].item() if "offsets_scale" in npzfile else None
         if nrefverts == 3:
             self.ref_vIdxs = npzfile["ref_vIdxs"]
             self.offsets   = npzfile["offsets"]
             self.weights   = npzfile["weights"]
+            if oscale is not None:
+                self.offsets = dequantize(self.offsets, oscale)
+            if wscale is not None:
+                self.weights = dequantize(self.weights, wscale)
         else:
             num_refs = npzfile['ref_vIdxs'].shape[0]
             self.ref_vIdxs = np.zeros((num_refs,3), dtype=np.uint32)
             self.ref_vIdxs[:,0] = npzfile['ref_vIdxs']
             self.offsets = np.zeros((num_refs,3), dtype=np.float32)
             self.weights = np.zeros((num_refs,3), dtype=np.float32)
-            self.weights[:,0] = npzfile['weights']
+            self.weights[:,0] = dequantize(npzfile['weights'], wscale)
+
+        if "bw_key" in npzfile:
+            self.cachedWeights = {key: npzfile[key] for key in ["bw_key", "bw_bones", "bw_counts", "bw_verts", "bw_weights"]}
 
         if "deleteVerts" in npzfile:
             self.deleteVerts = npzfile["deleteVerts"]
@@ -329,7 +318,9 @@ class attachedAsset:
         else:
             self.standard_material = ""
 
-        return importObjValues(npzfile, self.obj)
+        # mesh is only read when not already loaded by another asset
+        #
+        return self.obj.loadShared(topologyKey(path), importObjValues, npzfile, self.obj)
 
     def calculateBoneWeights(self):
         """
@@ -359,12 +350,13 @@ class attachedAsset:
             self.bWeights.approxWeights(self, self.glob.baseClass.pose_skeleton.bWeights)
         return True, None
 
-    def load(self, filename: str, use_ascii=False) -> int:
+    def load(self, filename: str, use_ascii=False, storage=None) -> int:
         """
         load mhclo or mhbin
         if not ASCII must be use and .mhbin is newer than .mhclo load .mhbin
         :param str filename: name of the file to read from
         :param bool use_ascii: determines if ASCII must be used
+        :param str storage: storage of written binary (see exportBinary)
         :return: int 0 = error, 1 = bad geometry, 2 = okay
         """
         if use_ascii is False:
@@ -425,7 +417,7 @@ class attachedAsset:
 
                 # now export binary file
                 #
-                (expok, err2) = self.exportBinary()
+                (expok, err2) = self.exportBinary(storage=storage)
                 if expok is False:
                     return 0, err2
                 return res, err
@@ -433,7 +425,10 @@ class attachedAsset:
         self.env.logLine(1, err )
         return 0, err
 
-    def exportBinary(self, filename=None):
+    def exportBinary(self, filename=None, storage=None):
+        """
+        :param str storage: "float32", "float16" or "int16" for fitting data, default is config "binary_storage"
+        """
 
         filename = self.filename if filename is None  else filename
         if filename.endswith(".mhclo") or filename.endswith(".proxy"):
@@ -482,27 +477,48 @@ class attachedAsset:
         if self.scale is not None:
             content["scale"] = self.scale
 
+        # compact storage of fitting data (and indices), tools (mesh compiler) have no configuration
+        #
+        if storage is None:
+            conf = getattr(self.env, "config", {})
+            storage = conf["binary_storage"] if "binary_storage" in conf else "float32"
+        index = compactIndices if storage != "float32" else np.asarray
         if nrefverts == 3:
-            content["ref_vIdxs"] = self.ref_vIdxs
-            content["offsets"] = self.offsets
-            content["weights"] = self.weights
+            content["ref_vIdxs"] = index(self.ref_vIdxs)
+            content["offsets"], oscale = quantize(self.offsets, storage)
+            content["weights"], wscale = quantize(self.weights, storage)
+            if oscale is not None:
+                content["offsets_scale"] = np.array(oscale)
+            err = max(float(np.abs(dequantize(content["offsets"], oscale) - self.offsets).max()),
+                    float(np.abs(dequantize(content["weights"], wscale) - self.weights).max()))
         else:
-            content["ref_vIdxs"] = self.ref_vIdxs[:,0]
-            content["weights"] = self.weights[:,0]
+            content["ref_vIdxs"] = index(self.ref_vIdxs[:,0])
+            content["weights"], wscale = quantize(self.weights[:,0], storage)
+            err = float(np.abs(dequantize(content["weights"], wscale) - self.weights[:,0]).max())
+        if wscale is not None:
+            content["weights_scale"] = np.array(wscale)
+        if storage != "float32":
+            self.env.logLine(8, "Asset " + self.name + " stored as " + storage + ", maximum error " + str(err))
 
         if np.any(self.deleteVerts):
             content["deleteVerts"] = self.deleteVerts
 
+        # save calculated bone weights together with the key of the weights used
+        #
+        if self.bWeights is not None and self.bWeights.sourcekey is not None:
+            content.update(self.bWeights.packWeights(self.bWeights.sourcekey))
+
         return exportObj3dBinary(filename, self.obj, content)
 
-    def mhcloToMHBin(self, path):
+    def mhcloToMHBin(self, path, storage=None):
         """
         convert mhclo/proxy file to binary, also avoids to create mhbin if no source file is there
 
         :param path: file to covert
+        :param str storage: storage of fitting data (see exportBinary)
         :return: err-code, error-text
         """
         if not os.path.isfile(path):
-            return 0, err
-        return self.load(path, True)
+            return 0, "File not found: " + path
+        return self.load(path, True, storage)
 
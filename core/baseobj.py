@@ -16,6 +16,8 @@ from obj3d.skeleton import skeleton
 from obj3d.animation import BVH, MHPose, PosePrims, MHPoseFaceConverter
 from core.debug import memInfo, dumper
 from core.target import Modelling
+from core.measurement import Measurements, MeasureSolver
+from core.meshcache import MeshCache
 from gui.common import WorkerThread, ErrorBox, WarningBox
 
 class MakeHumanModel():
@@ -68,6 +70,9 @@ class baseClass():
         self.baseMesh = None
         self.baseInfo = None
         self.attachedAssets = []
+        self.measurements = None        # compiled measurements of the base mesh
+        self.measuresolver = None       # fits modifiers to measurements
+        self.meshcache = None           # cached results of applyAllTargets
         self.env.logLine(2, "New baseClass: " + name)
         self.env.basename = name
         self.name = name                # will hold the character name
@@ -691,10 +696,10 @@ class baseClass():
         self.glob.openGLWindow.Tweak()
 
     def showExpression(self):
-        self.pose_skeleton.posebyBlends(self.expression.blends, self.faceunits.bonemask )
+        self.pose_skeleton.posebyBlends(self.expression.blends, self.faceunits.bonemask, units=self.faceunits)
 
     def showPoseModifiers(self):
-        self.pose_skeleton.posebyBlends(self.posemodifier.blends, self.bodyunits.bonemask )
+        self.pose_skeleton.posebyBlends(self.posemodifier.blends, self.bodyunits.bonemask, units=self.bodyunits)
 
     def showPoseAndExpression(self):
         if self.bvh:
@@ -863,6 +868,9 @@ class baseClass():
         self.baseMesh.precalculateDimension()
         target = Targets(self.glob)
         target.loadTargets()
+        self.measurements = Measurements(self.glob)
+        self.measuresolver = MeasureSolver(self.glob, self.measurements)
+        self.meshcache = MeshCache(self.glob)
         self.attachedAssets = []
 
         # load preselected skeleton as pose-skeleton only
@@ -914,10 +922,10 @@ class baseClass():
         for asset in self.attachedAssets:
             asset.obj.precalculateApproxInRestPose(asset, self.baseMesh)
 
-    def poseAttachedAssets(self):
+    def poseAttachedAssets(self, bones=None):
         for asset in self.attachedAssets:
             if asset.bWeights is not None:
-                self.pose_skeleton.skinMesh(asset.obj, asset.bWeights)
+                self.pose_skeleton.skinMesh(asset.obj, asset.bWeights, bones)
             else:
                 asset.obj.approxToBasemesh(asset, self.baseMesh)
 
@@ -930,8 +938,11 @@ class baseClass():
 
     def applyAllTargets(self, bckproc=None, args=None):
         """
-        applies all targets and corrects attached assets
+        applies all targets and corrects attached assets, identical states are served by the mesh cache
         """
+        if self.meshcache is not None and self.meshcache.restore():
+            return
+
         targets = self.glob.Targets.modelling_targets
         self.baseMesh.resetToNonMacroTargets()
 
@@ -942,6 +953,8 @@ class baseClass():
             mo = Modelling(self.glob, "dummy", None)
             mo.macroCalculationLoad()
         self.updateAttachedAssets()
+        if self.meshcache is not None:
+            self.meshcache.store()
 
 
     def finishApply(self):
@@ -0,0 +1,265 @@
+"""
+    License information: data/licenses/makehuman_license.txt
+    Author: black-punkduck
+
+    Classes:
+    * MeshBatch
+"""
+import numpy as np
+from core.targetbasis import TargetBasis
+
+class MeshBatch():
+    """
+    evaluates many characters at once, neither the base mesh, attached assets nor sliders are changed.
+
+    Input is a matrix (characters x keys) with values as used by setTargetByName, e.g. created by
+    TargetRandomizer.doBatch, missing keys use the current value. Each character is a weighted sum of all
+    morph targets: modifiers use increment or decrement, macros are resolved per character.
+    Characters are calculated in chunks, size is limited by the memory budget "batch_budget" (MB).
+
+    * evaluate      returns complete tensors (characters x vertices x 3) for base mesh and attached assets
+    * chunks        generator for chunks, used when the complete result does not fit into memory
+    * statistics    mean and variance per vertex, without keeping the meshes
+    * buildBasis    use a low-rank basis of the targets instead of the targets (see TargetBasis)
+
+    :param glob: handle to global object to access base object etc
+    :type glob: class: globalObjects
+    """
+    def __init__(self, glob):
+        self.glob = glob
+        self.env = glob.env
+        conf = self.env.config
+        self.budget = (conf["batch_budget"] if "batch_budget" in conf else 256) * 1048576
+        self.morphs = []        # morph targets in order of the weight columns
+        self.modifiers = []     # (modelling target, column of increment or -1, column of decrement or -1)
+        self.macrocols = {}     # name of macro target: column
+        self.regions = []       # region of each morph target (macro folder or group of modifier)
+        self.basis = None       # low-rank basis, if used
+
+    def compile(self):
+        """
+        collect all morph targets (modifiers and macros), each gets a column in the weight matrix
+        """
+        self.morphs = []
+        self.modifiers = []
+        self.macrocols = {}
+        self.regions = []
+        self.basis = None
+        for target in self.glob.Targets.modelling_targets:
+            if target.macro is not None or target.barycentric is not None:
+                continue
+            cols = []
+            for mt in (target.incr, target.decr):
+                if mt is not None and mt.raw is not None:
+                    cols.append(len(self.morphs))
+                    self.morphs.append(mt)
+                    self.regions.append(target.group.split("|")[0] or "modifier")
+                else:
+                    cols.append(-1)
+            if cols != [-1, -1]:
+                self.modifiers.append((target, cols[0], cols[1]))
+
+        for name, mt in self.glob.macroRepo.items():
+            if mt.raw is not None:
+                self.macrocols[name] = len(self.morphs)
+                self.morphs.append(mt)
+                self.regions.append(name.split("/")[0])
+
+    def buildBasis(self, tolerance=None):
+        """
+        calculate a low-rank basis, it will be used by all following evaluations
+
+        :param float tolerance: maximum difference of a reconstructed target, default is config "basis_tolerance"
+        """
+        if len(self.morphs) == 0:
+            self.compile()
+        self.basis = TargetBasis(self.glob, self.morphs, self.regions, tolerance)
+        self.basis.build()
+
+    def weights(self, keys, matrix):
+        """
+        weight matrix (characters x morph targets)
+
+        :param keys: keys (columns of matrix)
+        :param matrix: values (characters, keys)
+        """
+        if len(self.morphs) == 0:
+            self.compile()
+
+        matrix = np.atleast_2d(np.asarray(matrix, dtype=np.float64))
+        count = len(matrix)
+        columns = { key: i for i, key in enumerate(keys) }
+        current = self.glob.Targets.currentValues()
+        weights = np.zeros((count, len(self.morphs)), dtype=np.float32)
+
+        for target, incr, decr in self.modifiers:
+            if target.pattern in columns:
+                val = matrix[:, columns[target.pattern]]
+            else:
+                val = np.full(count, target.value / 100)
+            if incr >= 0:
+                weights[:, incr] = np.maximum(val, 0.0)
+            if decr >= 0:
+                weights[:, decr] = np.maximum(-val, 0.0)
+
+        # macros are calculated per character
+        #
+        if self.glob.targetMacros is not None:
+            targets = self.glob.Targets
+            m_influence = list(range(0, len(self.glob.targetMacros["macrodef"])))
+            used = [ key for key in keys if key in current ]
+            cols = [ columns[key] for key in used ]
+            for row in range(count):
+                values = current.copy()
+                values.update(zip(used, matrix[row, cols].tolist()))
+                for name, factor in targets.macroFactors(values, m_influence).items():
+                    if name in self.macrocols:
+                        weights[row, self.macrocols[name]] = factor
+        return weights
+
+    def _assets(self):
+        return [asset for asset in self.glob.baseClass.attachedAssets if asset.obj is not None]
+
+    def _chunksize(self):
+        """
+        number of characters per chunk, depends on number of vertices of base mesh and assets
+        """
+        verts = self.glob.baseClass.baseMesh.n_verts
+        for asset in self._assets():
+            verts += asset.obj.n_verts
+        return max(1, int(self.budget // (verts * 12)))
+
+    def _overflow(self, mesh, coords):
+        if mesh.overflow is not None and len(mesh.overflow) > 0:
+            coords[:, mesh.overflow[:, 1]] = coords[:, mesh.overflow[:, 0]]
+
+    def baseCoords(self, weights):
+        """
+        coordinates of base mesh for a chunk of characters, one indexed add per morph target
+
+        :param weights: weights (characters, morph targets)
+        :return: coordinates (characters, vertices, 3)
+        """
+        mesh = self.glob.baseClass.baseMesh
+        orig = mesh.gl_coord_o.reshape(-1, 3)
+        coords = np.repeat(orig[np.newaxis], len(weights), axis=0)
+        if self.basis is not None:
+            self.basis.addDeltas(coords, weights)
+            self._overflow(mesh, coords)
+            return coords
+
+        for col in np.flatnonzero(np.any(weights != 0.0, axis=0)):
+            mt = self.morphs[col]
+            coords[:, mt.indices()] += weights[:, col, np.newaxis, np.newaxis] * mt.vectors()[np.newaxis]
+        self._overflow(mesh, coords)
+        return coords
+
+    def assetCoords(self, asset, base):
+        """
+        barycentric approximation of an asset for a chunk of characters (see object3d.approxToBasemesh)
+
+        :param base: coordinates of base mesh (characters, vertices, 3)
+        :return: coordinates (characters, vertices of asset, 3)
+        """
+        w = asset.weights
+        o = asset.offsets
+        if asset.scaleMat is not None:
+            o = o * np.diag(asset.scaleMat)
+        refs = asset.ref_vIdxs
+        coords = np.empty((len(base), asset.obj.n_verts, 3), dtype=np.float32)
+        coords[:, :len(refs)] = w[:, 0, np.newaxis] * base[:, refs[:, 0]] + w[:, 1, np.newaxis] * base[:, refs[:, 1]] + \
+                w[:, 2, np.newaxis] * base[:, refs[:, 2]] + o
+        self._overflow(asset.obj, coords)
+        return coords
+
+    def chunks(self, keys, matrix):
+        """
+        generator for chunks of characters
+
+        :param keys: keys (columns of matrix)
+        :param matrix: values (characters, keys)
+        :return: start row, end row, dictionary "base" or name of asset: coordinates (characters, vertices, 3)
+        """
+        matrix = np.atleast_2d(matrix)
+        size = self._chunksize()
+        assets = self._assets()
+        for start in range(0, len(matrix), size):
+            end = min(start + size, len(matrix))
+            base = self.baseCoords(self.weights(keys, matrix[start:end]))
+            result = { "base": base }
+            for asset in assets:
+                result[asset.name] = self.assetCoords(asset, base)
+            yield start, end, result
+
+    def evaluate(self, keys, matrix):
+        """
+        coordinates of all characters
+
+        :param keys: keys (columns of matrix)
+        :param matrix: values (characters, keys)
+        :return: dictionary "base" or name of asset: coordinates (characters, vertices, 3)
+        """
+        result = {}
+        count = len(np.atleast_2d(matrix))
+        for start, end, chunk in self.chunks(keys, matrix):
+            for name, coords in chunk.items():
+                if name not in result:
+                    result[name] = np.empty((count,) + coords.shape[1:], dtype=np.float32)
+                result[name][start:end] = coords
+        return result
+
+    def statistics(self, keys, matrix):
+        """
+        mean shape and variance per vertex, chunks are combined (parallel algorithm by Chan et al.)
+
+        :param keys: keys (columns of matrix)
+        :param matrix: values (characters, keys)
+        :return: dictionary "base" or name of asset: (mean (vertices, 3), variance (vertices, 3))
+        """
+        stats = {}
+        for start, end, chunk in self.chunks(keys, matrix):
+            n = end - start
+            for name, coords in chunk.items():
+                mean = coords.mean(axis=0, dtype=np.float64)
+                m2 = ((coords - mean) ** 2).sum(axis=0)
+                total = 0
+                if name in stats:
+                    total, omean, om2 = stats[name]
+                    delta = mean - omean
+                    mean = omean + delta * n / (total + n)
+                    m2 = om2 + m2 + delta ** 2 * total * n / (total + n)
+                stats[name] = (total + n, mean, m2)
+        return { name: (mean, m2 / total) for name, (total, mean, m2) in stats.items() }
+
+    def accuracyReport(self, keys, matrix):
+        """
+        compare basis with the exact targets for the base mesh
+
+        :param keys: keys (columns of matrix)
+        :param matrix: values (characters, keys)
+        :return: dictionary with maximum and rms error per character, memory and ranks per region
+        """
+        if self.basis is None:
+            self.buildBasis()
+        matrix = np.atleast_2d(matrix)
+        basis = self.basis
+        maxerr = np.zeros(len(matrix))
+        rmserr = np.zeros(len(matrix))
+        size = max(1, self._chunksize() // 2)
+        for start in range(0, len(matrix), size):
+            end = min(start + size, len(matrix))
+            weights = self.weights(keys, matrix[start:end])
+            approx = self.baseCoords(weights)
+            self.basis = None
+            exact = self.baseCoords(weights)
+            self.basis = basis
+            diff = np.linalg.norm(approx - exact, axis=-1)
+            maxerr[start:end] = diff.max(axis=1)
+            rmserr[start:end] = np.sqrt((diff ** 2).mean(axis=1))
+
+        sparse, compressed = basis.memory()
+        report = { "max_error": maxerr, "rms_error": rmserr,
+                "sparse_bytes": sparse, "basis_bytes": compressed, "regions": basis.report() }
+        self.env.logLine(2, "Basis accuracy: max error " + str(float(report["max_error"].max())) +
+                ", memory " + str(sparse) + " -> " + str(compressed) + " bytes")
+        return report
@@ -23,6 +23,7 @@ import json
 import struct
 import numpy as np
 from obj3d.skeleton import skeleton as newSkeleton
+from core.skinweights import weightEntries, variableWeights
 
 class blendCom:
     def __init__(self, glob, exportfolder, imagefolder="textures", hiddenverts=False, onground=True, animation=False, scale =0.1):
@@ -305,51 +306,13 @@ class blendCom:
     def addWeightBuffers(self, coords, bweights, mapping):
         wpvlen = len(coords) // 3   # length of vertex per face derived from flattened coords
 
-        lsize = 0
-
-        vertex = {}
-        # TODO: how to deal with empty weights
-
-        if mapping is None:
-            for bone, t in bweights.items():
-                bonenumber = self.bonenames[bone]
-                ind, w = bweights[bone]
-                for n, i in enumerate (ind):
-                    if i < wpvlen:
-                        if i not in vertex:
-                            vertex[i] = []
-                        vertex[i].append((bonenumber, w[n]))
-                        lsize += 1
-        else:
-            lenmap = len(mapping)
-            for bone, t in bweights.items():
-                bonenumber = self.bonenames[bone]
-                ind, w = bweights[bone]
-                for n, i in enumerate (ind):
-                    if i < lenmap:
-                        i = mapping[i]
-                        if i < wpvlen and i != -1:
-                            if i not in vertex:
-                                vertex[i] = []
-                            vertex[i].append((bonenumber, w[n]))
-                            lsize += 1
-
-        #print ("Verts:" + str(wpvlen))
-        #print ("Weight array:" + str(lsize))
-        weightpervertex = np.zeros(wpvlen, dtype=np.dtype('i1'))
-        joints =  np.zeros(lsize, dtype=np.dtype('i4'))
-        weights = np.zeros(lsize, dtype=np.float32)
-
-        i = 0
-        for j in range(0, wpvlen):
-            cnt = 0
-            if j in vertex:
-                for n,w in vertex[j]:
-                    joints[i] = n
-                    weights[i] = w
-                    i += 1
-                    cnt += 1
-            weightpervertex[j] = cnt
+        bonenumbers = {bone: self.bonenames[bone] for bone in bweights}
+        (verts, joints, weights) = weightEntries(bweights, bonenumbers, wpvlen, mapping)
+        (counts, joints, weights) = variableWeights(verts, joints, weights, wpvlen)
+
+        weightpervertex = counts.astype(np.dtype('i1'))
+        joints = joints.astype(np.dtype('i4'))
+        weights = weights.astype(np.float32)
 
         bufwpv    = self.addBufferView(self.WPV_BUFFER, weightpervertex.tobytes())
         bufjoint  = self.addBufferView(self.JOINT_BUFFER, joints.tobytes())
@@ -29,7 +29,16 @@ class UserEnvironment():
             "theme": "makehuman.qss",
             "units": "metric",
             "apihost": "127.0.0.1",
-            "apiport": 12345
+            "apiport": 12345,
+            "texture_budget": 1024,
+            "image_cache_budget": 512,
+            "anim_key_tolerance": 0.0,
+            "gltf_morphs": [],
+            "batch_budget": 256,
+            "basis_tolerance": 0.001,
+            "binary_storage": "float32",
+            "mesh_cache_budget": 128,
+            "mesh_cache_disk": 0
         }
 
     def getDefaultConf(self):
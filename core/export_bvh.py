@@ -40,7 +40,8 @@ class bvhExport:
         self.z_up = False
         self.bvh = BVH(glob, "export")
         self.skeldef = []
-        self.motion = []
+        self.motion = None      # matrix frames x channels
+        self.zeros = None       # mask of channels written as "0"
         self.bvhorder = []
 
     def debug(self, text):
@@ -157,54 +158,64 @@ class bvhExport:
                     else:
                         self.debug(joint.name + " not found")
 
-        for frame in range(0, sourcebvh.frameCount):
+        # collect motion as matrix frames x channels, channels marked in zeros are written as "0"
+        # (missing joints and unchanged rotations)
+        #
+        frames = sourcebvh.frameCount
+        numchannels = sum(len(destjoint.channels) for destjoint, sourcejoint in jointtable)
+        self.motion = np.zeros((frames, numchannels), dtype=np.float64)
+        self.zeros = np.zeros((frames, numchannels), dtype=bool)
 
-            line = ""
+        col = 0
+        for cnt, (destjoint, sourcejoint)  in enumerate(jointtable):
 
-            for cnt, (destjoint, sourcejoint)  in enumerate(jointtable):
+            # get animdata from source, if sourcejoint is not found, write error only once
+            #
+            channels = len(destjoint.channels)
+            if sourcejoint is None:
+                if destjoint.name not in notfound:
+                    self.debug ("No source joint for " + destjoint.name)
+                    notfound[destjoint.name] = True
+                self.zeros[:, col:col+channels] = True
+                col += channels
+                continue
+
+            # recalculate animdata for corrections
+            #
+            if sourcejoint.name in corrections:
+                f = sourcebvh.posesToAnimdata(sourcejoint.finalPoses[:frames])
+            else:
+                f = sourcejoint.animdata[:frames]
 
-                # get animdata from source, if sourcejoint is not found, write error only once
-                #
-                channels = len(destjoint.channels)
-                if sourcejoint is None:
-                    if destjoint.name not in notfound:
-                        self.debug ("No source joint for " + destjoint.name)
-                        notfound[destjoint.name] = True
-                    line += ("0 " * channels)
-                else:
-                    # write short output in case a bone is not changed
-                    #
-                    f = sourcejoint.animdata[frame].copy()
-
-                    # recalculate animdata for corrections
-                    #
-                    if sourcejoint.name in corrections:
-                        f = sourcebvh.poseToAnimdata(sourcejoint.finalPoses[frame])
-
-                    if channels == 3:
-                        for c in [3, 4, 5]:
-                            if f[c] == 0.0:
-                                line += "0 "
-                            else:
-                                line += ("%f " % f[c])
-                    else:
-                        pos = f * self.scale
-                        if cnt == 0 and self.onground:
-                            line += ("%f %f %f " % (pos[0], pos[1], pos[2] + self.animYoffset))
-                        else:
-                            line += ("%f %f %f " % (pos[0], pos[1], pos[2]))
-
-                        for c in [3, 4, 5]:
-                            if f[c] == 0.0:
-                                line += "0 "
-                            else:
-                                line += ("%f " % f[c])
-
-            # replace last blank with newline (empty lines are not allowed)
+            if channels == 6:
+                pos = f[:,:3] * self.scale
+                self.motion[:, col:col+3] = pos
+                if cnt == 0 and self.onground:
+                    self.motion[:, col+2] += self.animYoffset
+                col += 3
+
+            self.motion[:, col:col+3] = f[:,3:6]
+            self.zeros[:, col:col+3] = f[:,3:6] == 0.0
+            col += 3
+
+    def motionLines(self, chunk=256):
+        """
+        format the motion matrix, one line per frame
+
+        :param int chunk: number of frames formatted at once
+        :return: generator of text blocks
+        """
+        if self.motion is None or self.motion.shape[1] == 0:
+            return
+        for start in range(0, len(self.motion), chunk):
+            motion = self.motion[start:start+chunk]
+            zeros = self.zeros[start:start+chunk]
+
+            # one format string for the whole block, "0" is inserted directly, last channel ends the line
             #
-            if len(line) > 0 and line[-1] == ' ':
-                line = line[:-1] + '\n'
-                self.motion.append(line)
+            fmt = np.where(zeros, "0 ", "%f ").astype(object)
+            fmt[:, -1] = np.where(zeros[:, -1], "0\n", "%f\n")
+            yield "".join(fmt.ravel().tolist()) % tuple(motion[~zeros].tolist())
 
     def ascSave(self, baseclass, filename):
 
@@ -241,8 +252,7 @@ class bvhExport:
                 for line in self.skeldef:
                     f.write(line)
                 f.write(frameheader)
-                for line in self.motion:
-                    f.write(line)
+                f.writelines(self.motionLines())
 
         except IOError as error:
             self.env.last_error = str(error)
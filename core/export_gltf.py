@@ -15,8 +15,13 @@
 import os
 import json
 import struct
+import shutil
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+import core.math as mquat
 from obj3d.skeleton import skeleton as newSkeleton
+from core.skinweights import weightEntries, topWeights
+from obj3d.fops_binary import contentHash
 
 class gltfExport:
     """Class representation of glTF export function
@@ -30,10 +35,14 @@ class gltfExport:
     :param bool onground: if character should stay on ground
     :param bool animation: if animation should be exported
     :param float scale: the scale of the output
+    :param float keytolerance: if > 0 animation frames which can be interpolated within this tolerance are dropped
+    :param list morphs: modifier patterns or group prefixes exported as morph targets
     """
 
+    digests = {}    # content hashes of copied images, shared by all exports
+
     def __init__(self, glob, exportfolder, imagefolder="textures", includetextures=False, hiddenverts=False,
-            onground=True, animation=False, saveprops=False, scale=0.1):
+            onground=True, animation=False, saveprops=False, scale=0.1, keytolerance=0.0, morphs=None):
 
         # subfolder for textures
         #
@@ -47,6 +56,8 @@ class gltfExport:
         self.animation = animation
         self.saveprops = saveprops
         self.scale = scale
+        self.keytolerance = keytolerance
+        self.morphs = morphs
         self.lowestPos = 0.0
         self.animYoffset = 0.0
 
@@ -117,6 +128,7 @@ class gltfExport:
         self.bonestart = 0      # used to keep track of first bone in glTF
 
         self.meshindices = []   # holds meshindices for joints and weights
+        self.imagecopies = {}   # images to copy, destination: source
 
     def __str__(self):
         return json.dumps(self.json, indent=3)
@@ -138,7 +150,10 @@ class gltfExport:
         #
         # buffer + we create one big binary buffer, we will keep all buffers 4 byte aligned
         # (byteLength must contain original length, but offset must be corrected)
+        # numpy arrays are not copied, a memoryview of the array is kept until binSave writes it
 
+        if isinstance(data, np.ndarray):
+            data = memoryview(np.ascontiguousarray(data)).cast("B")
         length = len(data)
         b = length & 3
         pad = 4-b if b > 0 else 0
@@ -158,16 +173,13 @@ class gltfExport:
         self.accessor_cnt += 1
 
         cnt = len(coord) // 3
-        ncoord = np.copy(coord)
-        meshCoords = np.reshape(ncoord, (cnt,3))
+        meshCoords = np.reshape(coord, (cnt,3))
 
-        if self.scale != 1.0:
-            ncoord = ncoord * self.scale
+        ncoord = coord * self.scale if self.scale != 1.0 else coord
         minimum = (meshCoords.min(axis=0) * self.scale).tolist()
         maximum = (meshCoords.max(axis=0) * self.scale).tolist()
 
-        data = ncoord.tobytes()
-        buf = self.addBufferView(self.ARRAY_BUFFER, data)
+        buf = self.addBufferView(self.ARRAY_BUFFER, ncoord)
 
         self.json["accessors"].append({"bufferView": buf, "componentType": self.FLOAT, "count": cnt, "type": "VEC3", "min": minimum, "max": maximum})
         return self.accessor_cnt
@@ -180,8 +192,7 @@ class gltfExport:
         minimum = meshCoords.min(axis=0).tolist()
         maximum = meshCoords.max(axis=0).tolist()
 
-        data = norm.tobytes()
-        buf = self.addBufferView(self.ARRAY_BUFFER, data)
+        buf = self.addBufferView(self.ARRAY_BUFFER, norm)
         self.json["accessors"].append({"bufferView": buf, "componentType": self.FLOAT, "count": cnt, "type": "VEC3", "min": minimum, "max": maximum})
         return self.accessor_cnt
 
@@ -193,8 +204,7 @@ class gltfExport:
         minimum = meshCoords.min(axis=0).tolist()
         maximum = meshCoords.max(axis=0).tolist()
 
-        data = uvcoord.tobytes()
-        buf = self.addBufferView(self.ARRAY_BUFFER, data)
+        buf = self.addBufferView(self.ARRAY_BUFFER, uvcoord)
 
         self.json["accessors"].append({"bufferView": buf, "componentType": self.FLOAT, "count": cnt, "type": "VEC2", "min": minimum, "max": maximum})
         return self.accessor_cnt
@@ -205,8 +215,7 @@ class gltfExport:
         minimum = int(icoord.min())
         maximum = int(icoord.max())
 
-        data = icoord.tobytes()
-        buf = self.addBufferView(self.ELEMENT_ARRAY_BUFFER, data)
+        buf = self.addBufferView(self.ELEMENT_ARRAY_BUFFER, icoord)
 
         self.json["accessors"].append({"bufferView": buf, "componentType": self.UNSIGNED_INT, "count": cnt, "type": "SCALAR", "min": [minimum], "max": [maximum]})
         return self.accessor_cnt
@@ -221,8 +230,7 @@ class gltfExport:
             bindmat[n], bindinv = bone.getBindMatrix(0, 'y')
             n += 1
 
-        data = bindmat.tobytes()
-        buf = self.addBufferView(None, data)
+        buf = self.addBufferView(None, bindmat)
 
         self.json["accessors"].append({"bufferView": buf, "componentType": self.FLOAT, "count": cnt, "type": "MAT4"})
         return self.accessor_cnt
@@ -237,68 +245,33 @@ class gltfExport:
             joints = np.zeros((numverts, 4), dtype=np.uint8)
             jtype = self.UNSIGNED_BYTE
 
-        weights = np.zeros((numverts, 4), dtype=np.float32)
-
-        vertex = {}
-
-        #print ("Verts:" + str(numverts))
-        maxv = 0
-        for elem in bweights:
-            # get bone number from list
-            #
-            bonenumber = self.bonenames[elem][0]
-            ind, w = bweights[elem]
-            for n, i in enumerate (ind):
-                if i > maxv:
-                    maxv = i
-                if i not in vertex:
-                    vertex[i] = []
-                vertex[i].append((bonenumber, w[n]))
-        #print ("Maxv:" + str(maxv))
-
-        for v in vertex:
-            m = vertex[v]
-            #
-            # get largest 4 values
-            #
-            if len(m) > 4:
-                m = sorted(m, key=lambda elem: elem[1], reverse=True)[:4]
-            for i, (n,w) in enumerate(m):
-                joints[v][i] = n
-                weights[v][i] = w
-
-        # normalize weights (can deal with 0.0 sums)
+        # get largest 4 values per vertex, normalized
         #
-        sums = weights.sum(axis=1, keepdims=1)
-        sums[sums==0.0] = 1.0
-        weights = weights/sums
-
-        if overflow is not None:
-            for (s,d) in overflow:
-                for i in range(0,4):
-                    joints[d][i] = joints[s][i]
-                    weights[d][i] = weights[s][i]
-
-        data = joints.tobytes()
-        buf = self.addBufferView(self.ARRAY_BUFFER, data)
+        bonenumbers = {elem: self.bonenames[elem][0] for elem in bweights}
+        (verts, jnums, wvals) = weightEntries(bweights, bonenumbers, numverts)
+        (jnums, weights) = topWeights(verts, jnums, wvals, numverts, 4, overflow)
+        joints[:] = jnums
+
+        buf = self.addBufferView(self.ARRAY_BUFFER, joints)
         self.json["accessors"].append({"bufferView": buf, "componentType": jtype, "count": numverts, "type": "VEC4"})
 
         self.accessor_cnt += 1
-        data = weights.tobytes()
-        buf = self.addBufferView(self.ARRAY_BUFFER, data)
+        buf = self.addBufferView(self.ARRAY_BUFFER, weights)
         self.json["accessors"].append({"bufferView": buf, "componentType": self.FLOAT, "count": numverts, "type": "VEC4"})
         return self.accessor_cnt
 
-    def addAnimInputAccessor(self, frames, framelen):
+    def addAnimInputAccessor(self, frames, framelen, keys=None):
         self.accessor_cnt += 1
         timestamps = np.zeros(frames, dtype=np.float32)
         timepos = 0.0
         for i in range(frames):
             timestamps[i] = timepos
             timepos += framelen
+        if keys is not None:
+            timestamps = timestamps[keys]
+            frames = len(keys)
         maximum = float(timestamps[-1])
-        data = timestamps.tobytes()
-        buf = self.addBufferView(None, data)
+        buf = self.addBufferView(None, timestamps)
         self.json["accessors"].append({"bufferView": buf, "componentType": self.FLOAT, "count": frames, "min": [ 0.0 ], "max": [maximum],  "type": "SCALAR"})
         return self.accessor_cnt
 
@@ -309,19 +282,58 @@ class gltfExport:
             jtype = "VEC4"
         else:
             jtype = "VEC3"
-        data = values.tobytes()
-        buf = self.addBufferView(None, data)
+        buf = self.addBufferView(None, values)
         self.json["accessors"].append({"bufferView": buf, "componentType": self.FLOAT, "count": frames, "type": jtype})
         return self.accessor_cnt
 
     def copyImage(self, source, dest):
+        """
+        images are copied when the file is written (copyImages), each destination only once
+        """
         self.filedebug("Need to copy " + source + " to " + dest)
 
         if self.env.mkdir(dest) is False:
             return False
 
         dest = os.path.join(dest, os.path.basename(source))
-        return self.env.copyfile(source, dest)
+        self.imagecopies[dest] = source
+        return True
+
+    def fileDigest(self, path):
+        """
+        content hash of a file, cached by name, size and modification time for all exports of a session
+        """
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        if key not in gltfExport.digests:
+            gltfExport.digests[key] = contentHash(path)
+        return gltfExport.digests[key]
+
+    def copyImages(self):
+        """
+        copy images in parallel, destinations with identical content are not written again
+        (batch exports to the same folder share the textures)
+        """
+        def copy(item):
+            dest, source = item
+            try:
+                if os.path.isfile(dest) and os.path.getsize(dest) == os.path.getsize(source) \
+                        and self.fileDigest(dest) == self.fileDigest(source):
+                    return None
+                shutil.copyfile(source, dest)
+            except OSError as error:
+                return "Unable to copy file. " + str(error)
+            return None
+
+        if len(self.imagecopies) == 0:
+            return True
+        with ThreadPoolExecutor(max_workers=min(8, len(self.imagecopies))) as pool:
+            errors = [err for err in pool.map(copy, self.imagecopies.items()) if err is not None]
+        self.imagecopies = {}
+        if len(errors) > 0:
+            self.env.last_error = errors[0]
+            return False
+        return True
 
     def addImage(self, image):
         self.image_cnt += 1
@@ -495,25 +507,86 @@ class gltfExport:
         # returns always last element
         return len(self.json["materials"]) - 1
 
-    def filterMorphDeltas(self, raw_deltas, mapping):
+    def selectMorphTargets(self):
         """
-        Filters deltas to match the mesh with hidden vertices
-        mapping is an array where -1 = hidden, and any other number = new index
+        collect the targets of the modifiers selected for export, a selection is either the pattern
+        of a modifier (as used in mhm files) or a group prefix like "face" or "face|right ear".
+        Macros and barycentric modifiers cannot be expressed by a single target and are skipped
+
+        :return: list of Morphtargets
+        """
+        targets = []
+        if not self.morphs or self.glob.Targets is None:
+            return targets
+
+        for m in self.glob.Targets.modelling_targets:
+            if m.macro is not None or m.barycentric is not None:
+                continue
+            if m.pattern in self.morphs or any(m.group == p or m.group.startswith(p + "|") for p in self.morphs):
+                for target in (m.decr, m.incr):
+                    if target is not None and target.raw is not None:
+                        targets.append(target)
+        return targets
+
+    def morphDeltas(self, target, obj, asset, mapping):
         """
-        cnt = np.count_nonzero(mapping != -1)
-        filtered_deltas = np.zeros(cnt * 3, dtype=np.float32)
+        dense deltas of a target for one mesh, assets are approximated by the weights of their reference vertices,
+        overflow is corrected, hidden vertices are removed and deltas are scaled
+
+        :param target: Morphtarget (sparse deltas for the base mesh)
+        :param obj: object3d to export
+        :param asset: attached asset or None for the base mesh
+        :param mapping: vertex mapping from optimizeHiddenMesh or None
+        :return: deltas (vertices, 3)
+        """
+        base = self.glob.baseClass.baseMesh
+        deltas = np.zeros((base.n_origverts, 3), dtype=np.float32)
+        deltas[target.indices()] = target.vectors()
+
+        if asset is not None:
+            r = asset.ref_vIdxs
+            w = asset.weights
+            deltas = w[:,0:1] * deltas[r[:,0]] + w[:,1:2] * deltas[r[:,1]] + w[:,2:3] * deltas[r[:,2]]
 
-        # Reshape for easier coordinate mapping
-        reshaped_deltas = np.reshape(raw_deltas, (-1, 3))
+        full = np.zeros((obj.n_verts, 3), dtype=np.float32)
+        full[:len(deltas)] = deltas
+        if obj.overflow is not None and len(obj.overflow) > 0:
+            full[obj.overflow[:,1]] = full[obj.overflow[:,0]]
 
-        for old_idx, new_idx in enumerate(mapping):
-            if new_idx != -1:
-                # Copy the X, Y, Z delta to the new position
-                filtered_deltas[new_idx*3 : new_idx*3+3] = reshaped_deltas[old_idx]
+        if mapping is not None:
+            full = full[mapping != -1]
 
-        return filtered_deltas
+        return full * self.scale if self.scale != 1.0 else full
 
-    def addMesh(self, obj, nodenumber, bweights, morph_data=None):
+    def addTargetPosAccessor(self, deltas):
+        """
+        morph target positions, a sparse accessor is used when it is smaller than a dense one
+        (16 bytes per moved vertex for index and value, instead of 12 bytes per vertex)
+        """
+        self.accessor_cnt += 1
+        cnt = len(deltas)
+        moved = np.flatnonzero(np.any(deltas != 0.0, axis=1)).astype(np.uint32)
+        values = deltas[moved]
+
+        minimum = values.min(axis=0)
+        maximum = values.max(axis=0)
+        if len(moved) < cnt:
+            minimum = np.minimum(minimum, 0.0)
+            maximum = np.maximum(maximum, 0.0)
+
+        accessor = {"componentType": self.FLOAT, "count": cnt, "type": "VEC3", "min": minimum.tolist(), "max": maximum.tolist()}
+        if len(moved) * 16 < cnt * 12:
+            ind = self.addBufferView(None, moved)
+            val = self.addBufferView(None, values)
+            accessor["sparse"] = {"count": len(moved), "indices": {"bufferView": ind, "componentType": self.UNSIGNED_INT},
+                    "values": {"bufferView": val}}
+        else:
+            accessor["bufferView"] = self.addBufferView(self.ARRAY_BUFFER, deltas)
+
+        self.json["accessors"].append(accessor)
+        return self.accessor_cnt
+
+    def addMesh(self, obj, nodenumber, bweights, targets=None, asset=None):
         icoord = None
         mapping = None # will contain vertex map for hidden elements
 
@@ -544,31 +617,25 @@ class gltfExport:
             "material": nodenumber,
             "mode": self.TRIANGLES
         }
+        mesh_entry = {"name": obj.name, "primitives": [primitive]}
 
-        # Handle Morph Targets (TODO: for later use)
+        # morph targets, targets not influencing this mesh are skipped
         #
-        if morph_data:
-            primitive["targets"] = []
+        if targets:
+            morphs = []
             target_names = []
+            for target in targets:
+                deltas = self.morphDeltas(target, obj, asset, mapping)
+                if not deltas.any():
+                    continue
+                morphs.append({"POSITION": self.addTargetPosAccessor(deltas)})
+                target_names.append(os.path.basename(target.name))
 
-            for name, deltas in morph_data:
-                # If mesh contained hidden vertices, we must filter the deltas to match
-                if mapping is not None:
-                    final_deltas = self.filterMorphDeltas(deltas, mapping)
-                else:
-                    final_deltas = deltas
-
-                target_idx = self.addTargetPosAccessor(final_deltas)
-                primitive["targets"].append({"POSITION": target_idx})
-                target_names.append(name)
-
-            mesh_entry = {
-                "name": obj.name,
-                "primitives": [primitive],
-                "extras": {"targetNames": target_names} # Show names in e.g. UE5
-            }
-        else:
-            mesh_entry = {"name": obj.name, "primitives": [primitive]}
+            if len(morphs) > 0:
+                self.debug(str(len(morphs)) + " morph targets for " + obj.name)
+                primitive["targets"] = morphs
+                mesh_entry["weights"] = [0.0] * len(morphs)
+                mesh_entry["extras"] = {"targetNames": target_names}   # Show names in e.g. UE5
 
         self.json["meshes"].append(mesh_entry)
         return len(self.json["meshes"]) - 1
@@ -623,6 +690,29 @@ class gltfExport:
             del node["children"]
         return num
 
+    def reduceKeyframes(self, values, tlen, inputs, frames, framelen):
+        """
+        drop frames which can be linearly interpolated within keytolerance, input accessors
+        are shared by channels using the same frames
+
+        :param values: translations or rotations per frame
+        :param int tlen: 3 for translation, 4 for rotation
+        :param dict inputs: input accessors already created
+        :return: input accessor, reduced values
+        """
+        if tlen == 4:
+            # use same hemisphere for neighboring quaternions, otherwise interpolation is not linear
+            #
+            values = values.copy()
+            signs = np.where(np.einsum("ij,ij->i", values[1:], values[:-1]) < 0.0, -1.0, 1.0)
+            values[1:] *= np.cumprod(signs)[:, None]
+
+        keys = mquat.linearKeyframes(values, self.keytolerance)
+        ident = keys.tobytes()
+        if ident not in inputs:
+            inputs[ident] = self.addAnimInputAccessor(frames, framelen, keys)
+        return inputs[ident], np.ascontiguousarray(values[keys])
+
     def addAnimations(self, skeleton, bvh, orig=True):
 
         # create channels and samplers
@@ -640,56 +730,49 @@ class gltfExport:
                 # smaller 1 
                 # offset = (self.animYoffset + self.lowestPos) * self.scale
 
-        common_input = self.addAnimInputAccessor(nFrames, bvh.frameTime)
-
-        # generate arrays for translation, rotation
+        # with keyframe reduction each channel gets its own input
         #
-        for key in self.bonenames:
-            self.bonenames[key][2] = np.zeros((nFrames, 3), dtype=np.float32)
-            self.bonenames[key][3] = np.zeros((nFrames, 4), dtype=np.float32)
+        common_input = self.addAnimInputAccessor(nFrames, bvh.frameTime) if self.keytolerance <= 0.0 else None
 
-        for frame in range(nFrames):
+        # pose all frames at once, bvh.joints are original joints in case of different skeleton,
+        # so in that case it will be posed by reference
+        #
+        poses = skeleton.poseFrames(bvh.joints, nFrames, not orig)
 
-            # bvh.joints are original joints in case of different skeleton, so in that case it will be posed by reference
+        for bonename in self.bonenames:
+            bone = skeleton.bones[bonename]
+            relative, globalmat = poses[bonename]
+            #
+            # for root bone the global vectors are used
+            # for other bones translation is calculated by local rest vector (cannot change)
+            # rotations are calculated by using pose matrix relative to parent
             #
-            if orig:
-                skeleton.pose(bvh.joints, frame, True)
+            if bone.parent is None:
+                trans = globalmat[:,:3,3] * self.scale - [0.0, offset, 0.0]
+                rot   = mquat.quaternionsFromMatrices(globalmat)
             else:
-                skeleton.poseByReference(bvh.joints, frame)
+                trans = np.broadcast_to(bone.getRestLocalTransVector(), (nFrames, 3))
+                rot   = mquat.quaternionsFromMatrices(relative)
 
-            for bonename in self.bonenames:
-                bone = skeleton.bones[bonename]
-                #
-                # for root bone the global vectors are used
-                # for other bones translation is calculated by local rest vector (cannot change)
-                # rotations are calculated by using inverse parent global Vector multiplied by current global vector
-                #
-                if bone.parent is None:
-                    trans = bone.getPoseGlobalTransVector() * self.scale - [0.0, offset, 0.0]
-                    rot   = bone.getPoseGlobalRotQVector()
-                else:
-                    trans = bone.getRestLocalTransVector()
-                    rot   = bone.getPoseRelParentRotQVector()
-
-                # quaternions, W ist last element
-                #
-                rot[[0, 1, 2, 3]] = rot[[1, 2, 3, 0]]
-                self.bonenames[bonename][2][frame][:] = trans[:]
-                self.bonenames[bonename][3][frame][:] = rot[:]
+            # quaternions, W ist last element
+            #
+            self.bonenames[bonename][2] = np.ascontiguousarray(trans, dtype=np.float32)
+            self.bonenames[bonename][3] = np.ascontiguousarray(rot[:, [1, 2, 3, 0]], dtype=np.float32)
 
         channels = []
         samplers = []
+        inputs = {}     # input accessors of reduced channels, key are the frames used
         sampler = 0
         for bonename in self.bonenames:
             node = self.bonenames[bonename][0] + self.bonestart
-            channels.append({"sampler": sampler, "target": { "node": node, "path": "translation" }})
-            output = self.addAnimOutputAccessor(self.bonenames[bonename][2], 3)
-            samplers.append({"input": common_input, "interpolation":"LINEAR", "output": output})
-            sampler += 1
-            channels.append({"sampler": sampler, "target": {"node": node, "path": "rotation" }})
-            output = self.addAnimOutputAccessor(self.bonenames[bonename][3], 4)
-            samplers.append({"input": common_input, "interpolation":"LINEAR", "output": output})
-            sampler += 1
+            for path, values, tlen in (("translation", self.bonenames[bonename][2], 3), ("rotation", self.bonenames[bonename][3], 4)):
+                input_acc = common_input
+                if self.keytolerance > 0.0:
+                    input_acc, values = self.reduceKeyframes(values, tlen, inputs, nFrames, bvh.frameTime)
+                channels.append({"sampler": sampler, "target": { "node": node, "path": path }})
+                output = self.addAnimOutputAccessor(values, tlen)
+                samplers.append({"input": input_acc, "interpolation":"LINEAR", "output": output})
+                sampler += 1
 
         self.json["animations"] = []
         self.json["animations"].append({"name": bvh.name, "channels": channels, "samplers": samplers})
@@ -705,6 +788,7 @@ class gltfExport:
 
         if has_character:
             skin = baseclass.baseMesh.material
+            morphtargets = self.selectMorphTargets()
             if baseclass.skeleton is not None:
                 # Recalculate skeletal skinning weights
                 baseweights = baseclass.default_skeleton.bWeights.transferWeights(baseclass.skeleton)
@@ -716,9 +800,11 @@ class gltfExport:
                     proxy.calculateBoneWeights()
                     baseweights = proxy.bWeights.transferWeights(baseclass.skeleton)
                 baseobject = proxy.obj
+                baseasset = proxy
                 start = 1
             else:
                 baseobject = baseclass.baseMesh
+                baseasset = None
                 start = 0
                 
             charactername = self.nodeName(baseobject.filename)
@@ -729,7 +815,7 @@ class gltfExport:
             if self.onground:
                 self.lowestPos = baseclass.getLowestPos()
 
-            mesh = self.addMesh(baseobject, mat, baseweights)
+            mesh = self.addMesh(baseobject, mat, baseweights, morphtargets, baseasset)
             
             # --- THE PLASTIC MAN FIX ---
             # Instead of changing internal bones or subtracting vertices separately,
@@ -787,7 +873,7 @@ class gltfExport:
                     elem.calculateBoneWeights()
                     weights = elem.bWeights.transferWeights(baseclass.skeleton)
 
-                mesh_idx = self.addMesh(current_obj, mat_idx, weights)
+                mesh_idx = self.addMesh(current_obj, mat_idx, weights, morphtargets, elem)
                 self.json["nodes"].append({"name": self.nodeName(elem.filename), "mesh": mesh_idx})
                 this_node_idx = len(self.json["nodes"]) - 1
                 children.append(this_node_idx)
@@ -915,23 +1001,20 @@ class gltfExport:
 
         completelength = struct.pack('<I', length)
 
+        # all chunks are written in one call, buffers are written directly from the arrays
+        #
+        chunks = [self.MAGIC, version, completelength, chunkjsonlen, self.JSON, jsondata, chunkbinlen, bytes(self.BIN, "utf-8")]
+        for elem in self.buffers:
+            chunks.append(elem)
+            b = len(elem) & 3
+            if b !=  0:
+                chunks.append(b'\x00' * (4-b))
+
         try:
             with open(filename, 'wb') as f:
-                f.write(self.MAGIC)
-                f.write(version)
-                f.write(completelength)
-                f.write(chunkjsonlen)
-                f.write(self.JSON)
-                f.write(jsondata)
-                f.write(chunkbinlen)
-                f.write(bytes(self.BIN, "utf-8"))
-                for elem in self.buffers:
-                    f.write(bytes(elem))
-                    b = len(elem) & 3
-                    if b !=  0:
-                        f.write(b'\x00' * (4-b))
+                f.writelines(chunks)
 
         except IOError as error: 
             self.env.last_error = str(error)
             return False
-        return True
+        return self.copyImages()
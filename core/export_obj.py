@@ -11,6 +11,10 @@
 import os
 import numpy as np
 
+# number of lines formatted at once
+#
+OBJ_CHUNK = 20000
+
 class objExport:
     def __init__(self, glob, exportfolder, imagefolder="textures", hiddenverts=False, onground=True, helper=False,
             normals=False, animation=False, saveprops=False, scale=0.1):
@@ -28,10 +32,6 @@ class objExport:
         self.animation = animation
         self.saveprops = saveprops
 
-        self.coordlines = []
-        self.normlines = []
-        self.uvlines = []
-        self.facelines = []
         self.matlines = []
 
         self.startvert = 1
@@ -64,64 +64,73 @@ class objExport:
         self.matlines.append(typeid + " " + name + "\n")
         return True
 
-    def addCoords(self, num, coords):
-        mcoord = np.reshape(coords, (len(coords)//3, 3))
-        for co in mcoord:
-            self.coordlines.append("v %.4f %.4f %.4f\n" % (co[0]*self.scale, co[1]*self.scale - self.lowestPos, co[2]*self.scale))
+    def writeFormatted(self, f, template, values):
+        """
+        bulk formatting, values [n, m] are written with a template containing m placeholders
+        """
+        for start in range(0, len(values), OBJ_CHUNK):
+            chunk = values[start:start+OBJ_CHUNK]
+            f.write((template * len(chunk)) % tuple(chunk.ravel().tolist()))
+
+    def addCoords(self, f, num, coords):
+        mcoord = np.reshape(coords, (len(coords)//3, 3)) * self.scale
+        mcoord[:,1] -= self.lowestPos
+        self.writeFormatted(f, "v %.4f %.4f %.4f\n", mcoord)
         self.obj[num]["lenV"] = len(mcoord)
 
-    def addNormals(self, num, values):
+    def addNormals(self, f, num, values):
         mvalues = np.reshape(values, (len(values)//3, 3))
-        for val in mvalues:
-            self.normlines.append("vn %.6f %.6f %.6f\n" % tuple(val))
+        self.writeFormatted(f, "vn %.6f %.6f %.6f\n", mvalues)
 
-    def addUVCoords(self, num, coords):
-        mcoord = np.reshape(coords, (len(coords)//2, 2))
-        for co in mcoord:
-            self.uvlines.append("vt %.6f %.6f\n" % (co[0], 1.0 - co[1]))
+    def addUVCoords(self, f, num, coords):
+        mcoord = np.reshape(coords, (len(coords)//2, 2)).copy()
+        mcoord[:,1] = 1.0 - mcoord[:,1]
+        self.writeFormatted(f, "vt %.6f %.6f\n", mcoord)
         self.obj[num]["lenUV"] = len(mcoord)
 
-    def addFaces(self, num, name, material, vpf, faces, ov):
+    def addFaces(self, f, num, name, material, vpf, faces, ov):
         matname = self.matName(num, material.name)
-        self.facelines.append("usemtl " + matname + "\n")
-        self.facelines.append("g " + name + "\n")
-
-        # --- overflow array is defined as pairs
-        overflow = {}
-        if ov is not None:
-            for l in ov:
-                overflow[l[1]] = l[0]
-        x = 0
-
-        last= self.startvert + self.obj[num]["lenV"]
-        if self.normals:
-            for n in vpf:
-                out = "f "
-                saveit = True
-                for i in range(n):
-                    uvface = faces[x]
-                    face = overflow[uvface] if uvface in overflow else uvface
-                    if (face + self.startvert) >= last:
-                        saveit = False
-
-                    out += "%d/%d/%d " % (face+self.startvert, uvface+self.startuv, face+self.startvert)
-                    x += 1
-                if saveit:
-                    self.facelines.append(out + "\n")
+        f.write("usemtl " + matname + "\n")
+        f.write("g " + name + "\n")
+
+        uvfaces = np.asarray(faces, dtype=np.int64)
+        vpf = np.asarray(vpf, dtype=np.int64)
+        if len(vpf) == 0:
+            self.startvert += self.obj[num]["lenV"]
+            self.startuv   += self.obj[num]["lenUV"]
+            return
+
+        # --- overflow array is defined as pairs (vertex, uv-vertex), remap is done as a gather
+        if ov is not None and len(ov) > 0:
+            ov = np.asarray(ov, dtype=np.int64)
+            remap = np.arange(max(uvfaces.max(), ov[:,1].max()) + 1)
+            remap[ov[:,1]] = ov[:,0]
+            vfaces = remap[uvfaces]
         else:
-            for n in vpf:
-                out = "f "
-                saveit = True
-                for i in range(n):
-                    uvface = faces[x]
-                    face = overflow[uvface] if uvface in overflow else uvface
-                    if (face + self.startvert) >= last:
-                        saveit = False
-
-                    out += "%d/%d " % (face+self.startvert, uvface+self.startuv)
-                    x += 1
-                if saveit:
-                    self.facelines.append(out + "\n")
+            vfaces = uvfaces
+
+        # faces using vertices beyond the coordinates are skipped
+        #
+        offsets = np.concatenate(([0], np.cumsum(vpf)))
+        skip = np.logical_or.reduceat(vfaces >= self.obj[num]["lenV"], offsets[:-1])
+
+        vfaces = vfaces + self.startvert
+        uvfaces = uvfaces + self.startuv
+
+        # write runs of faces with the same number of vertices
+        #
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(vpf)) + 1, [len(vpf)]))
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            n = vpf[start]
+            corners = slice(offsets[start], offsets[end])
+            keep = ~skip[start:end]
+            if self.normals:
+                values = np.stack((vfaces[corners], uvfaces[corners], vfaces[corners]), axis=1)
+                template = "f" + " %d/%d/%d" * n + "\n"
+            else:
+                values = np.stack((vfaces[corners], uvfaces[corners]), axis=1)
+                template = "f" + " %d/%d" * n + "\n"
+            self.writeFormatted(f, template, values.reshape(end - start, -1)[keep])
 
         self.startvert += self.obj[num]["lenV"]
         self.startuv   += self.obj[num]["lenUV"]
@@ -213,40 +222,39 @@ class objExport:
             (coords, norms, uvcoords, vpface, faces, overflow, mapping) = elem.obj.getVisGeometry(self.hiddenverts)
             self.obj.append ({"name": elem.obj.name, "mat": mat, "c": coords, "no": norms, "uv": uvcoords, "vpf": vpface, "f": faces, "o": overflow })
 
-        # vertices
-        #
-        for i, obj in enumerate(self.obj):
-            self.addCoords(i, obj["c"])
-
-        # normals in case they are selected
-        #
-        if self.normals:
-            for i, obj in enumerate(self.obj):
-                self.addNormals(i, obj["no"])
-
-        # UVs
-        #
-        for i, obj in enumerate(self.obj):
-            self.addUVCoords(i, obj["uv"])
-
-        # faces
-        #
-        for i, obj in enumerate(self.obj):
-            self.addFaces(i, obj["name"], obj["mat"], obj["vpf"], obj["f"], obj["o"])
-
         # materials
         #
         for i, obj in enumerate(self.obj):
             if self.addMaterial(i, obj["mat"]) is False:
                 return False
 
+        # mesh sections are streamed to file
+        #
         try:
             with open(filename, 'w', encoding="utf-8") as f:
                 f.write(header)
-                f.writelines(self.coordlines)
-                f.writelines(self.normlines)
-                f.writelines(self.uvlines)
-                f.writelines(self.facelines)
+
+                # vertices
+                #
+                for i, obj in enumerate(self.obj):
+                    self.addCoords(f, i, obj["c"])
+
+                # normals in case they are selected
+                #
+                if self.normals:
+                    for i, obj in enumerate(self.obj):
+                        self.addNormals(f, i, obj["no"])
+
+                # UVs
+                #
+                for i, obj in enumerate(self.obj):
+                    self.addUVCoords(f, i, obj["uv"])
+
+                # faces
+                #
+                for i, obj in enumerate(self.obj):
+                    self.addFaces(f, i, obj["name"], obj["mat"], obj["vpf"], obj["f"], obj["o"])
+
         except IOError as error:
             self.env.last_error = str(error)
             return False
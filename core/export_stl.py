@@ -37,54 +37,65 @@ UINT16    – Attribute byte count  (which can be used for everything but mostly
 """
 
 import struct
+import numpy as np
+
+# binary facet: normal, 3 vertices, attribute byte count (50 bytes, no padding)
+#
+STL_FACET = np.dtype([("normal", "<f4", (3,)), ("verts", "<f4", (3, 3)), ("attr", "<u2")])
+
+# ASCII facet template, CHUNK facets are formatted and written at once
+#
+STL_ASCFACET = "facet normal %.7g %.7g %.7g\n\touter loop\n" + "\t\tvertex %.7g %.7g %.7g\n" * 3 + "\tendloop\nendfacet\n"
+STL_CHUNK = 20000
 
 class stlExport:
-    def __init__(self, glob, exportfolder, hidden=False, scale=1.0):
+    def __init__(self, glob, exportfolder, hidden=False, scale=1.0, facetnormals=False):
         self.exportfolder = exportfolder
         self.env = glob.env
         self.scale = scale
         self.hidden = hidden
+        self.facetnormals = facetnormals
 
-    def ascMesh(self, f, obj):
-        hiddenmask = obj.hiddenMask() if self.hidden is False else None
-        norm = obj.gl_norm
-        coord = obj.gl_coord * self.scale
-        for elem in obj.fverts:
-            if hiddenmask is not None:
-                if (hiddenmask[elem[0]] & hiddenmask[elem[1]] & hiddenmask[elem[2]]) == 0:
-                    continue
-            (p1, p2, p3) = (elem[0] *3, elem[1] *3, elem[2] *3)
-            xnorm = (norm[p1] + norm[p2] + norm[p3]) / 3
-            ynorm = (norm[p1+1] + norm[p2+1] + norm[p3+1]) / 3
-            znorm = (norm[p1+2] + norm[p2+2] + norm[p3+2]) / 3
-            f.write("facet normal " + str(xnorm) + " "  + str(ynorm) + " " + str(znorm) + "\n" + \
-                "\touter loop\n\t\tvertex " + str(coord[p1]) + " "  + str(coord[p1 +1]) + " " + str(coord[p1+2]) + "\n" + \
-                "\t\tvertex " + str(coord[p2]) + " "  + str(coord[p2 +1]) + " " + str(coord[p2+2]) + "\n" + \
-                "\t\tvertex " + str(coord[p3]) + " "  + str(coord[p3 +1]) + " " + str(coord[p3+2]) + "\n" + \
-                "\tendloop\nendfacet\n")
+    def facets(self, obj):
+        """
+        gather normals and vertices of all (visible) triangles
 
-    def binMesh(self, f, obj):
+        :param object3d obj: mesh
+        :return: normals [n, 3] and vertices [n, 3, 3] as float32 arrays
+        """
+        fverts = obj.fverts
         hiddenmask = obj.hiddenMask() if self.hidden is False else None
         if hiddenmask is not None:
-            print ("Is hidden")
-        norm = obj.gl_norm
-        coord = obj.gl_coord * self.scale
-        cnt = 0
-        for elem in obj.fverts:
-            if hiddenmask is not None:
-                if (hiddenmask[elem[0]] & hiddenmask[elem[1]] & hiddenmask[elem[2]]) == 0:
-                    continue
-            (p1, p2, p3) = (elem[0] *3, elem[1] *3, elem[2] *3)
-            xnorm = (norm[p1] + norm[p2] + norm[p3]) / 3
-            ynorm = (norm[p1+1] + norm[p2+1] + norm[p3+1]) / 3
-            znorm = (norm[p1+2] + norm[p2+2] + norm[p3+2]) / 3
-
-            f.write(struct.pack(b'<ffffffffffffH', xnorm, ynorm, znorm,
-                coord[p1], coord[p1 +1], coord[p1+2],
-                coord[p2], coord[p2 +1], coord[p2+2],
-                coord[p3], coord[p3 +1], coord[p3+2], 0))
-            cnt += 1
-        return(cnt)
+            visible = (hiddenmask[fverts[:,0]] & hiddenmask[fverts[:,1]] & hiddenmask[fverts[:,2]]) != 0
+            fverts = fverts[visible]
+
+        verts = (obj.gl_coord.reshape(-1, 3) * self.scale)[fverts]
+        if self.facetnormals:
+            # geometric normal of the triangle
+            #
+            normals = np.cross(verts[:,1] - verts[:,0], verts[:,2] - verts[:,0])
+            length = np.linalg.norm(normals, axis=1, keepdims=True)
+            normals /= np.where(length == 0.0, 1.0, length)
+        else:
+            # average of the vertex normals
+            #
+            normals = obj.gl_norm.reshape(-1, 3)[fverts].mean(axis=1)
+        return normals.astype(np.float32, copy=False), verts.astype(np.float32, copy=False)
+
+    def ascMesh(self, f, obj):
+        normals, verts = self.facets(obj)
+        values = np.concatenate((normals, verts.reshape(-1, 9)), axis=1)
+        for start in range(0, len(values), STL_CHUNK):
+            chunk = values[start:start+STL_CHUNK]
+            f.write((STL_ASCFACET * len(chunk)) % tuple(chunk.ravel().tolist()))
+
+    def binMesh(self, f, obj):
+        normals, verts = self.facets(obj)
+        data = np.zeros(len(normals), dtype=STL_FACET)
+        data["normal"] = normals
+        data["verts"] = verts
+        f.write(data.data)
+        return(len(data))
 
     def ascSave(self, baseclass, filename):
         self.env.last_error ="okay"
@@ -15,6 +15,7 @@ import os
 import re
 import shutil
 import tempfile
+from core.quantize import quantizeTarget
 
 class AssetPack():
     def __init__(self):
@@ -335,7 +336,7 @@ class TargetASCII():
     """
 
     def __init__(self):
-        pass
+        self.errors = {}    # maximum error per target of last compact compression
 
     def load(self, filename):
         data = []
@@ -393,9 +394,35 @@ class TargetASCII():
                     content[name[:-7]] = arr
         return content
 
-    def compressAllTargets(self, sourcefolder, destfile, verbose=0, remove=True):
+    def compactTargets(self, content, storage):
+        """
+        convert targets to compact storage, a scale is saved as <name>#scale, errors are kept in self.errors
+        """
+        self.errors = {}
+        compact = {}
+        for name, arr in content.items():
+            compact[name], scale, self.errors[name] = quantizeTarget(arr, storage)
+            if scale is not None:
+                compact[name + "#scale"] = np.array(scale)
+        return compact
+
+    def quantizationReport(self):
+        """
+        :return: number of targets, maximum error, name of target with maximum error, mean of maximum errors
+        """
+        if len(self.errors) == 0:
+            return 0, 0.0, None, 0.0
+        name = max(self.errors, key=self.errors.get)
+        return len(self.errors), self.errors[name], name, sum(self.errors.values()) / len(self.errors)
+
+    def compressAllTargets(self, sourcefolder, destfile, verbose=0, remove=True, storage="float32"):
         content = self.loadAllTargets(sourcefolder, verbose)
         howmany = len(content)
+        if howmany > 0 and storage in ("float16", "int16"):
+            content = self.compactTargets(content, storage)
+            if verbose > 0:
+                num, maxerr, name, meanerr = self.quantizationReport()
+                print ("storage " + storage + ": maximum error " + str(maxerr) + " (" + name + "), mean " + str(meanerr))
         if howmany > 0:
             if verbose > 0:
                 print ("save compressed: " + destfile)
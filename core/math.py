@@ -2,19 +2,34 @@
     License information: data/licenses/makehuman_license.txt
     Author: black-punkduck
 
+    Array versions accept stacks (..., ) of angles, matrices or quaternions and return stacked results,
+    the scalar versions calculate one angle set, matrix or quaternion directly (numpy overhead of the
+    array versions is too high for single values).
+
     Functions:
+    * eulerMatricesXYZ                Euler rotations for arrays of angles, fixed order
     * eulerMatrixXYZ                  Euler rotation, fixed order
+    * eulerMatrices                   Euler rotations for arrays of angles, order must be given as e.g. yzx
     * eulerMatrix                     Euler rotation, order must be given as e.g. yzx
+    * eulerMatricesToRadians          Calculation radians angles from a stack of Euler matrices, order as index
     * eulerMatrixToRadians            Calculation radians angles from Euler matrix, order as index
     * eulerMatrixXYZToDegrees         Calculation x,y,z degrees angles from Euler matrix
     * eulerMatrixYZXToDegrees         Calculation y,z,x degrees angles from Euler matrix
+    * quaternionsToRotMatrices        Return homogeneous rotation matrices from a stack of quaternions.
     * quaternionToRotMatrix           Return homogeneous rotation matrix from quaternion.
+    * quaternionsFromMatrices         Return quaternions from a stack of rotation matrices.
     * quaternionFromMatrix            Return quaternion from rotation matrix.
+    * quaternionsMult                 Return multiplication of two stacks of quaternions.
     * quaternionMult                  Return multiplication of two quaternions.
+    * quaternionsSlerp                Return spherical linear interpolation between two stacks of quaternions.
     * quaternionSlerp                 Return spherical linear interpolation between two quaternions.
+    * quaternionsSlerpFromRest        do a slerp from rest quaternion by ratio for a stack of quaternions
     * quaternionSlerpFromMatrix       do a slerp from Restmatix by ratio
+    * rotMatrices                     calculate rotation matrices by arrays of angles and directions
     * rotMatrix                       calculate rotation matrix by angle and direction
     * changeOrientation               calculate orientations like 'yUpFaceZ', 'yUpFaceX', 'zUpFaceNegY',  'zUpFaceX'
+    * linearKeyframes                 Return keyframes needed to reproduce values by linear interpolation.
+    * boundedLeastSquares             Return damped least squares solution with lower and upper bounds.
 """
 
 import math
@@ -22,6 +37,32 @@ import numpy as np
 
 _EPS = np.finfo(float).eps * 4.0
 
+def eulerMatricesXYZ(ri, rj, rk, i, j, k):
+    """
+    :param ri, rj, rk: arrays (or values) in radians, broadcastable
+    :param i, j, k: indices
+    :return: array (..., 4, 4)
+    """
+    ri, rj, rk = np.broadcast_arrays(np.asarray(ri, dtype=np.float64), np.asarray(rj, dtype=np.float64),
+            np.asarray(rk, dtype=np.float64))
+    si, sj, sk = np.sin(ri), np.sin(rj), np.sin(rk)
+    ci, cj, ck = np.cos(ri), np.cos(rj), np.cos(rk)
+    cc, cs = ci*ck, ci*sk
+    sc, ss = si*ck, si*sk
+
+    M = np.zeros(ri.shape + (4, 4), dtype=np.float64)
+    M[..., i, i] = cj*ck
+    M[..., i, j] = sj*sc-cs
+    M[..., i, k] = sj*cc+ss
+    M[..., j, i] = cj*sk
+    M[..., j, j] = sj*ss+cc
+    M[..., j, k] = sj*cs-sc
+    M[..., k, i] = -sj
+    M[..., k, j] = cj*si
+    M[..., k, k] = cj*ci
+    M[..., 3, 3] = 1.0
+    return(M)
+
 def eulerMatrixXYZ(ri, rj, rk, i, j, k):
     """
     :param ri, rj, rk: values in radians
@@ -44,6 +85,56 @@ def eulerMatrixXYZ(ri, rj, rk, i, j, k):
     M[k, k] = cj*ci
     return(M)
 
+def eulerMatrices(x, y, z, s="xyz"):
+    """
+    :param x, y, z: arrays (or values) in radians, broadcastable
+    :param str s: order
+    :return: array (..., 4, 4)
+    """
+    if s == "xyz":
+        return eulerMatricesXYZ(x, y, z, 0, 1, 2)
+    elif s == "xzy":
+        return eulerMatricesXYZ(np.negative(x), np.negative(y), np.negative(z), 0, 2, 1)
+    elif s == "yzx":
+        return eulerMatricesXYZ(x, y, z, 1, 2, 0)
+    elif s == "yxz":
+        return eulerMatricesXYZ(np.negative(x), np.negative(y), np.negative(z), 1, 0, 2)
+    elif s == "zxy":
+        return eulerMatricesXYZ(x, y, z, 2, 0, 1)
+    # zyx
+    return eulerMatricesXYZ(np.negative(x), np.negative(y), np.negative(z), 2, 1, 0)
+
+def eulerMatrix(x, y, z, s="xyz"):
+    if s == "xyz":
+        return eulerMatrixXYZ(x, y, z, 0, 1, 2)
+    elif s == "xzy":
+        return eulerMatrixXYZ(-x, -y, -z, 0, 2, 1)
+    elif s == "yzx":
+        return eulerMatrixXYZ(x, y, z, 1, 2, 0)
+    elif s == "yxz":
+        return eulerMatrixXYZ(-x, -y, -z, 1, 0, 2)
+    elif s == "zxy":
+        return eulerMatrixXYZ(x, y, z, 2, 0, 1)
+    # zyx
+    return eulerMatrixXYZ(-x, -y, -z, 2, 1, 0)
+
+def eulerMatricesToRadians(m, i, j, k):
+    """
+    vectorized eulerMatrixToRadians, products are calculated in precision of m, angles in double precision
+
+    :param m: array (..., 3, 3) or (..., 4, 4)
+    :param i, j, k: indices
+    :return: arrays ax, ay, az
+    """
+    m = np.asarray(m)
+    cy = np.sqrt((m[...,i,i] * m[...,i,i] + m[...,j,i] * m[...,j,i]).astype(np.float64))
+    m = m.astype(np.float64)
+    regular = cy > _EPS
+    ax = np.where(regular, np.arctan2(m[...,k,j], m[...,k,k]), np.arctan2(-m[...,j,k], m[...,j,j]))
+    ay = np.arctan2(-m[...,k,i], cy)
+    az = np.where(regular, np.arctan2(m[...,j,i], m[...,i,i]), 0.0)
+    return ax, ay, az
+
 def eulerMatrixToRadians(m, i, j, k):
     cy = math.sqrt(m[i, i] *m[i, i] + m[j, i]*m[j, i])
     if cy > _EPS:
@@ -64,19 +155,32 @@ def eulerMatrixYZXToDegrees(m):
     x = np.degrees(eulerMatrixToRadians(m, 1, 2, 0))
     return x[0], x[1], x[2]
 
-def eulerMatrix(x, y, z, s="xyz"):
-    if s == "xyz":
-        return eulerMatrixXYZ(x, y, z, 0, 1, 2)
-    elif s == "xzy":
-        return eulerMatrixXYZ(-x, -y, -z, 0, 2, 1)
-    elif s == "yzx":
-        return eulerMatrixXYZ(x, y, z, 1, 2, 0)
-    elif s == "yxz":
-        return eulerMatrixXYZ(-x, -y, -z, 1, 0, 2)
-    elif s == "zxy":
-        return eulerMatrixXYZ(x, y, z, 2, 0, 1)
-    # zyx
-    return eulerMatrixXYZ(-x, -y, -z, 2, 1, 0)
+def quaternionsToRotMatrices(q):
+    """
+    Return homogeneous rotation matrices from a stack of quaternions.
+
+    :param q: array (..., 4) with w, x, y, z
+    :return: array (..., 4, 4)
+    """
+    q = np.array(q, dtype=np.float64, copy=True)
+    n = np.einsum("...i,...i->...", q, q)
+    small = n < _EPS
+    q *= np.sqrt(2.0 / np.where(small, 1.0, n))[..., None]
+    q = q[..., :, None] * q[..., None, :]
+
+    m = np.zeros(q.shape[:-2] + (4, 4), dtype=np.float64)
+    m[..., 0, 0] = 1.0 - q[..., 2, 2] - q[..., 3, 3]
+    m[..., 0, 1] = q[..., 1, 2] - q[..., 3, 0]
+    m[..., 0, 2] = q[..., 1, 3] + q[..., 2, 0]
+    m[..., 1, 0] = q[..., 1, 2] + q[..., 3, 0]
+    m[..., 1, 1] = 1.0 - q[..., 1, 1] - q[..., 3, 3]
+    m[..., 1, 2] = q[..., 2, 3] - q[..., 1, 0]
+    m[..., 2, 0] = q[..., 1, 3] - q[..., 2, 0]
+    m[..., 2, 1] = q[..., 2, 3] + q[..., 1, 0]
+    m[..., 2, 2] = 1.0 - q[..., 1, 1] - q[..., 2, 2]
+    m[..., 3, 3] = 1.0
+    m[small] = np.identity(4)
+    return m
 
 def quaternionToRotMatrix(quaternion):
     """
@@ -95,6 +199,36 @@ def quaternionToRotMatrix(quaternion):
         [    q[1, 3]-q[2, 0],     q[2, 3]+q[1, 0], 1.0-q[1, 1]-q[2, 2], 0.0],
         [                0.0,                 0.0,                 0.0, 1.0]])
 
+def quaternionsFromMatrices(m):
+    """
+    Return quaternions from a stack of rotation matrices.
+
+    :param m: array (..., 3, 3) or (..., 4, 4)
+    :return: array (..., 4) with w, x, y, z
+    """
+    m = np.asarray(m, dtype=np.float64)
+    m00, m01, m02 = m[...,0,0], m[...,0,1], m[...,0,2]
+    m10, m11, m12 = m[...,1,0], m[...,1,1], m[...,1,2]
+    m20, m21, m22 = m[...,2,0], m[...,2,1], m[...,2,2]
+    tr = m00 + m11 + m22
+
+    # case distinction by largest component, S is calculated for all cases
+    #
+    c0 = tr > 0
+    c1 = ~c0 & (m00 > m11) & (m00 > m22)
+    c2 = ~c0 & ~c1 & (m11 > m22)
+
+    diag = np.select([c0, c1, c2], [tr, m00 - m11 - m22, m11 - m00 - m22], m22 - m00 - m11)
+    S = np.sqrt(np.maximum(diag + 1.0, _EPS)) * 2
+    quarter = 0.25 * S
+
+    q = np.empty(m.shape[:-2] + (4,), dtype=np.float64)
+    q[...,0] = np.select([c0, c1, c2], [quarter, (m21 - m12) / S, (m02 - m20) / S], (m10 - m01) / S)
+    q[...,1] = np.select([c0, c1, c2], [(m21 - m12) / S, quarter, (m01 + m10) / S], (m02 + m20) / S)
+    q[...,2] = np.select([c0, c1, c2], [(m02 - m20) / S, (m01 + m10) / S, quarter], (m12 + m21) / S)
+    q[...,3] = np.select([c0, c1, c2], [(m10 - m01) / S, (m02 + m20) / S, (m12 + m21) / S], quarter)
+    return q.astype(np.float32)
+
 def quaternionFromMatrix(m):
     """
     Return quaternion from rotation matrix.
@@ -128,6 +262,23 @@ def quaternionFromMatrix(m):
 
     return np.asarray([qw, qx, qy, qz], dtype=np.float32)
 
+def quaternionsMult(quaternion1, quaternion0):
+    """
+    Return multiplication of two stacks of quaternions.
+
+    :param quaternion1: array (..., 4)
+    :param quaternion0: array (..., 4)
+    :return: array (..., 4)
+    """
+    q0 = np.asarray(quaternion0, dtype=np.float64)
+    q1 = np.asarray(quaternion1, dtype=np.float64)
+    w0, x0, y0, z0 = q0[...,0], q0[...,1], q0[...,2], q0[...,3]
+    w1, x1, y1, z1 = q1[...,0], q1[...,1], q1[...,2], q1[...,3]
+    return np.stack([-x1*x0 - y1*y0 - z1*z0 + w1*w0,
+                         x1*w0 + y1*z0 - z1*y0 + w1*x0,
+                        -x1*z0 + y1*w0 + z1*x0 + w1*y0,
+                         x1*y0 - y1*x0 + z1*w0 + w1*z0], axis=-1)
+
 def quaternionMult(quaternion1, quaternion0):
     """
     Return multiplication of two quaternions.
@@ -140,13 +291,50 @@ def quaternionMult(quaternion1, quaternion0):
                          x1*y0 - y1*x0 + z1*w0 + w1*z0], dtype=np.float64)
 
 
-def quaternionSlerp(quat0, quat1, fraction, shortestpath=True):
+def quaternionsSlerp(quat0, quat1, fractions, shortestpath=True):
     """
-    Return spherical linear interpolation between two quaternions.
+    Return spherical linear interpolation between two stacks of quaternions.
 
     [quat0 * sin((1-fraction) * angle) + quat1 * sin(fraction*angle)] / sin(angle)
 
     the angle itself is the half angle between quat0 and quat1
+
+    :param quat0: array (..., 4)
+    :param quat1: array (..., 4)
+    :param fractions: array broadcastable to quat0[..., 0]
+    :return: array (..., 4)
+    """
+    q0, q1 = np.broadcast_arrays(np.asarray(quat0, dtype=np.float64)[..., :4], np.asarray(quat1, dtype=np.float64)[..., :4])
+    fractions = np.broadcast_to(np.asarray(fractions, dtype=np.float64), q0.shape[:-1])
+
+    # calculate dot-product => results in angle of cos(angle), invert rotation for shortest path
+    #
+    d = np.einsum("...i,...i->...", q0, q1)
+    keep = np.abs(np.abs(d) - 1.0) < _EPS
+    if shortestpath:
+        negative = d < 0.0
+        d = np.where(negative, -d, d)
+        q1s = np.where(negative[..., None], -q1, q1)
+    else:
+        q1s = q1
+
+    # now calculate angle, distribute factors to get just one multiplication per quaternion
+    #
+    angle = np.arccos(np.clip(d, -1.0, 1.0))
+    keep |= np.abs(angle) < _EPS
+    isin = 1.0 / np.sin(np.where(keep, 1.0, angle))
+    result = q0 * (np.sin((1.0 - fractions) * angle) * isin)[..., None] + q1s * (np.sin(fractions * angle) * isin)[..., None]
+
+    # trivial cases
+    #
+    result[keep] = q0[keep]
+    result[fractions == 0.0] = q0[fractions == 0.0]
+    result[fractions == 1.0] = q1[fractions == 1.0]
+    return result
+
+def quaternionSlerp(quat0, quat1, fraction, shortestpath=True):
+    """
+    Return spherical linear interpolation between two quaternions, see quaternionsSlerp
     """
     q0 = np.array(quat0[:4], dtype=np.float64, copy=True)
     q1 = np.array(quat1[:4], dtype=np.float64, copy=True)
@@ -183,6 +371,15 @@ def quaternionSlerp(quat0, quat1, fraction, shortestpath=True):
     q0 += q1
     return q0
 
+def quaternionsSlerpFromRest(quats, fractions, shortestpath=True):
+    """
+    do a slerp from rest quaternion (1, 0, 0, 0) for a stack of quaternions
+
+    :param quats: array (..., 4) with w, x, y, z
+    :param fractions: array broadcastable to quats[..., 0]
+    :return: array (..., 4)
+    """
+    return quaternionsSlerp(np.array([1.0, 0.0, 0.0, 0.0]), quats, fractions, shortestpath)
 
 def quaternionSlerpFromMatrix(mat, fraction, shortestpath=True):
     """
@@ -195,6 +392,42 @@ def quaternionSlerpFromMatrix(mat, fraction, shortestpath=True):
     return (quaternionSlerp(quat0, quat1, fraction, shortestpath))
 
 
+def rotMatrices(angles, directions):
+    """
+    calculate rotation matrices by angles around directions
+
+    :param angles: array (...) in radians
+    :param directions: array (..., 3), broadcastable
+    :return: array (..., 4, 4)
+    """
+    angles = np.asarray(angles, dtype=np.float64)
+    direction = np.asarray(directions, dtype=np.float32)[..., :3]
+    angles, _ = np.broadcast_arrays(angles, direction[..., 0])
+    direction = np.broadcast_to(direction, angles.shape + (3,))
+    sina = np.sin(angles)[..., None, None]
+    cosa = np.cos(angles)[..., None, None]
+
+    # convert direction to length of a unit vector
+    #
+    direction = direction / np.sqrt(np.einsum("...i,...i->...", direction, direction).astype(np.float64))[..., None]
+
+    R = np.identity(3) * cosa
+    R = R + direction[..., :, None] * direction[..., None, :] * (1.0 - cosa)
+    direction = direction * sina[..., 0]
+    cross = np.zeros(angles.shape + (3, 3), dtype=np.float64)
+    cross[..., 0, 1] = -direction[..., 2]
+    cross[..., 0, 2] = direction[..., 1]
+    cross[..., 1, 0] = direction[..., 2]
+    cross[..., 1, 2] = -direction[..., 0]
+    cross[..., 2, 0] = -direction[..., 1]
+    cross[..., 2, 1] = direction[..., 0]
+    R += cross
+
+    M = np.zeros(angles.shape + (4, 4), dtype=np.float64)
+    M[..., :3, :3] = R
+    M[..., 3, 3] = 1.0
+    return (M)
+
 def rotMatrix(angle, direction):
     sina = math.sin(angle)
     cosa = math.cos(angle)
@@ -263,3 +496,88 @@ def changeOrientation(mat, orientation=0, rotAxis='y', offset=[0,0,0]):
     return tmat
 
 
+def linearKeyframes(values, tolerance):
+    """
+    Return indices of keyframes needed to reproduce values by linear interpolation
+    within tolerance (Ramer-Douglas-Peucker over frames, deviation is the maximum over all components).
+    First and last frame are always used.
+
+    :param values: array (frames, n)
+    :param float tolerance: maximum deviation
+    :return: array of frame indices
+    """
+    frames = len(values)
+    if frames < 3:
+        return np.arange(frames)
+
+    keep = np.zeros(frames, dtype=bool)
+    keep[0] = keep[-1] = True
+    segments = [(0, frames - 1)]
+    while len(segments) > 0:
+        a, b = segments.pop()
+        if b - a < 2:
+            continue
+        t = (np.arange(a + 1, b) - a) / (b - a)
+        interpolated = values[a] + t[:, None] * (values[b] - values[a])
+        deviation = np.abs(values[a+1:b] - interpolated).max(axis=1)
+        i = int(np.argmax(deviation))
+        if deviation[i] > tolerance:
+            k = a + 1 + i
+            keep[k] = True
+            segments.append((a, k))
+            segments.append((k, b))
+    return np.flatnonzero(keep)
+
+
+def boundedLeastSquares(A, b, lower, upper, x0=None, damping=0.0, maxiter=None):
+    """
+    Return x minimizing |A x - b|^2 + damping * |x - x0|^2 with lower <= x <= upper
+    (active set method on the normal equations, variables with lower == upper are fixed).
+
+    :param A: array (m, n)
+    :param b: array (m)
+    :param lower: lower bounds (n)
+    :param upper: upper bounds (n)
+    :param x0: start and reference values (n), default zero
+    :param float damping: weight to keep x close to x0, makes underdetermined systems unique
+    :param int maxiter: maximum number of active set changes
+    :return: array (n)
+    """
+    n = A.shape[1]
+    lower = np.asarray(lower, dtype=np.float64)
+    upper = np.asarray(upper, dtype=np.float64)
+    x0 = np.zeros(n) if x0 is None else np.asarray(x0, dtype=np.float64)
+    H = A.T @ A + damping * np.identity(n)
+    g = A.T @ b + damping * x0
+
+    x = np.clip(x0, lower, upper)
+    free = lower < upper
+    if maxiter is None:
+        maxiter = 2 * n + 10
+
+    for _ in range(maxiter):
+        fixed = ~free
+        idx = np.flatnonzero(free)
+        if len(idx) > 0:
+            rhs = g[idx] - H[np.ix_(idx, fixed)] @ x[fixed]
+            try:
+                xf = np.linalg.solve(H[np.ix_(idx, idx)], rhs)
+            except np.linalg.LinAlgError:
+                xf = np.linalg.lstsq(H[np.ix_(idx, idx)], rhs, rcond=None)[0]
+
+            # variables outside of the box are fixed at their bound
+            #
+            out = (xf < lower[idx]) | (xf > upper[idx])
+            x[idx] = np.clip(xf, lower[idx], upper[idx])
+            if out.any():
+                free[idx[out]] = False
+                continue
+
+        # release the fixed variable with the largest gradient pointing into the box
+        #
+        grad = H @ x - g
+        inward = fixed & (lower < upper) & (((x <= lower) & (grad < 0.0)) | ((x >= upper) & (grad > 0.0)))
+        if not inward.any() or np.abs(grad[inward]).max() < _EPS * (1.0 + np.abs(g).max()):
+            break
+        free[np.flatnonzero(inward)[np.argmax(np.abs(grad[inward]))]] = True
+    return x
@@ -0,0 +1,365 @@
+"""
+    License information: data/licenses/makehuman_license.txt
+    Author: black-punkduck
+
+    Classes:
+    * Measurements
+    * MeasureSolver
+"""
+import numpy as np
+from core.math import boundedLeastSquares
+
+class Measurements():
+    """
+    all measurements of the base mesh, compiled to one padded index array.
+    A measurement is the length of a chain of vertices (mentioned in modelling targets as "measure"),
+    shorter chains are padded with their last vertex, so padding adds segments of length 0.
+
+    * names in base.json "measure" are aliases for the measurements of these targets
+    * values are cached until the version of the mesh changes
+    * evaluate works for one mesh or a batch of meshes (e.g. generated characters)
+
+    :param glob: handle to global object to access base object etc
+    :type glob: class: globalObjects
+    """
+    def __init__(self, glob):
+        self.glob = glob
+        self.env = glob.env
+        self.names = []         # names of measurements (modifier names)
+        self.rows = {}          # name or alias: row in index
+        self.index = None       # padded vertex indices (measurements, maximum chain length)
+        self.cache = None       # cached values
+        self.cachemesh = None   # mesh of cached values
+        self.cacheversion = -1  # version of mesh when cached
+
+    def compile(self):
+        """
+        compile measurements from modelling targets and aliases from base.json
+        """
+        targets = self.glob.Targets.modelling_targets if self.glob.Targets is not None else []
+        chains = []
+        self.names = []
+        self.rows = {}
+        for target in targets:
+            if target.measure:
+                self.rows[target.name] = len(chains)
+                self.names.append(target.name)
+                chains.append(target.measure)
+
+        bi = self.glob.baseClass.baseInfo
+        if "measure" in bi:
+            for name, key in bi["measure"].items():
+                if key in self.glob.targetRepo:
+                    t = self.glob.targetRepo[key]
+                    if t.name in self.rows:
+                        self.rows[name] = self.rows[t.name]
+
+        maxlen = max([len(chain) for chain in chains], default=1)
+        self.index = np.zeros((len(chains), maxlen), dtype=np.int64)
+        for row, chain in enumerate(chains):
+            self.index[row, :len(chain)] = chain
+            self.index[row, len(chain):] = chain[-1]
+
+        self.cache = None
+        self.cachemesh = None
+        self.env.logLine(2, "Measurements compiled: " + str(len(chains)) + ", maximum chain length " + str(maxlen))
+
+    def evaluate(self, coords, index=None):
+        """
+        calculate all measurements with one gather
+
+        :param coords: vertex coordinates (verts, 3) or batch (meshes, verts, 3), flat arrays are reshaped
+        :param index: optional padded index to be used instead of the compiled one (e.g. for a subset of vertices)
+        :return: measurements (measurements) or (meshes, measurements)
+        """
+        if index is None:
+            index = self.index
+        coords = np.asarray(coords)
+        if coords.ndim == 1:
+            coords = coords.reshape(-1, 3)
+        p = coords[..., index, :]
+        return np.linalg.norm(p[..., 1:, :] - p[..., :-1, :], axis=-1).sum(axis=-1)
+
+    def values(self, mesh=None):
+        """
+        all measurements of a mesh, cached until mesh version changes
+
+        :param mesh: object3d, default is base mesh
+        :return: measurements (measurements)
+        """
+        if mesh is None:
+            mesh = self.glob.baseClass.baseMesh
+        if self.index is None:
+            self.compile()
+        if self.cachemesh is not mesh or self.cacheversion != mesh.version:
+            self.cache = self.evaluate(mesh.gl_coord)
+            self.cachemesh = mesh
+            self.cacheversion = mesh.version
+        return self.cache
+
+    def getValue(self, name, mesh=None):
+        """
+        single measurement by name or alias, None if unknown
+        """
+        if self.index is None:
+            self.compile()
+        if name not in self.rows:
+            return None
+        return float(self.values(mesh)[self.rows[name]])
+
+class MeasureSolver():
+    """
+    fits modifier values to desired measurements (e.g. size 175 cm, waist 80 cm) in one go.
+
+    A measurement is linearized: the sensitivities of all measurements to all modifiers (Jacobian)
+    are calculated from the target deltas at the vertices of the measurements only. Increment and decrement
+    of a modifier are used as two variables in range 0 .. 1, a damped bounded least squares solution
+    keeps the change small. The Jacobian is cached per macro state, the solution is refined by
+    evaluating the measurements of the predicted vertices, so no mesh has to be changed in between.
+
+    :param glob: handle to global object to access base object etc
+    :type glob: class: globalObjects
+    :param measurements: compiled measurements
+    :type measurements: class: Measurements
+    """
+    def __init__(self, glob, measurements):
+        self.glob = glob
+        self.env = glob.env
+        self.measurements = measurements
+        self.damping = 1e-3     # relative weight to keep modifiers close to their current values
+        self.maxcache = 64      # maximum number of cached Jacobians
+        self.deltas = {}        # candidates: subset of vertices and target deltas
+        self.jacobians = {}     # (candidates, macro state): Jacobian
+
+    def macroState(self):
+        """
+        values of all macro modifiers (including barycentric ones) as a key
+        """
+        state = []
+        for target in self.glob.Targets.modelling_targets:
+            if target.barycentric is not None:
+                state.extend([l["value"] for l in target.barycentric])
+            elif target.macro is not None:
+                state.append(target.value)
+        return tuple(state)
+
+    def candidates(self, groups=None):
+        """
+        modifiers allowed to change (no macros), optionally restricted to groups or patterns.
+        when symmetry is switched on, both sides are used as one variable
+
+        :param groups: list of patterns or group names (group name also selects all subgroups)
+        :return: list of lists of modifiers
+        """
+        sym = self.glob.Targets.getSym()
+        repo = self.glob.targetRepo
+        cands = []
+        used = set()
+        for target in self.glob.Targets.modelling_targets:
+            if target.macro is not None or target.barycentric is not None:
+                continue
+            if (target.incr is None and target.decr is None) or target.pattern in used:
+                continue
+            if groups is not None:
+                if not any(target.pattern == g or target.group == g or target.group.startswith(g + "|") for g in groups):
+                    continue
+            tied = [target]
+            used.add(target.pattern)
+            if sym and target.sym is not None and target.sym in repo:
+                tied.append(repo[target.sym])
+                used.add(target.sym)
+            cands.append(tied)
+        return cands
+
+    def _scatter(self, mtarget, lookup, out, factor=1.0):
+        """
+        add delta of a morph target to out (subset of vertices)
+        """
+        if mtarget is None or mtarget.raw is None:
+            return
+        local = lookup[mtarget.indices()]
+        used = local >= 0
+        out[local[used]] += mtarget.vectors()[used] * factor
+
+    def _prepare(self, cands):
+        """
+        subset of vertices used by measurements and height, deltas of the candidates (increment and decrement)
+        on these vertices. Candidates without influence are removed
+        """
+        key = tuple(tied[0].pattern for tied in cands)
+        if key in self.deltas:
+            return self.deltas[key]
+
+        mesh = self.glob.baseClass.baseMesh
+        meas = self.measurements
+        height = np.array([mesh.max_index[1], mesh.min_index[1]])
+        verts = np.unique(np.concatenate([meas.index.ravel(), height]))
+        lookup = np.full(mesh.n_origverts, -1, dtype=np.int64)
+        lookup[verts] = np.arange(len(verts))
+
+        deltas = np.zeros((2, len(cands), len(verts), 3))
+        for i, tied in enumerate(cands):
+            for target in tied:
+                self._scatter(target.incr, lookup, deltas[0, i])
+                self._scatter(target.decr, lookup, deltas[1, i])
+
+        used = np.abs(deltas).reshape(2, len(cands), -1).max(axis=(0, 2)) > 0.0
+        cands = [tied for i, tied in enumerate(cands) if used[i]]
+        deltas = deltas[:, used].reshape(-1, len(verts), 3)
+        upper = np.array([1.0 if tied[0].incr is not None else 0.0 for tied in cands] +
+                [1.0 if tied[0].decr is not None else 0.0 for tied in cands])
+
+        prep = { "cands": cands, "verts": verts, "lookup": lookup, "index": lookup[meas.index],
+                "height": lookup[height], "deltas": deltas, "upper": upper }
+        self.deltas[key] = prep
+        self.env.logLine(2, "Measure solver prepared: " + str(len(cands)) + " modifiers, " + str(len(verts)) + " vertices")
+        return prep
+
+    def _split(self, cands):
+        """
+        current values of candidates split into increment and decrement (0 .. 1)
+        """
+        values = np.array([tied[0].value / 100 for tied in cands])
+        return np.concatenate([np.maximum(values, 0.0), np.maximum(-values, 0.0)])
+
+    def _evaluate(self, prep, coords):
+        """
+        measurements and height (last value) of subset coordinates
+        """
+        h0, h1 = prep["height"]
+        return np.append(self.measurements.evaluate(coords, prep["index"]), coords[h0, 1] - coords[h1, 1])
+
+    def _jacobian(self, prep, key):
+        """
+        Jacobian (measurements + height, 2 * candidates) at the macro state: all other modifiers are
+        removed from the current coordinates, result is cached
+        """
+        if key in self.jacobians:
+            return self.jacobians[key]
+
+        lookup = prep["lookup"]
+        coords = self.glob.baseClass.baseMesh.gl_coord.reshape(-1, 3)[prep["verts"]].astype(np.float64)
+        for target in self.glob.Targets.modelling_targets:
+            if target.macro is None and target.barycentric is None and target.value != 0.0:
+                if target.value > 0.0:
+                    self._scatter(target.incr, lookup, coords, -target.value / 100)
+                else:
+                    self._scatter(target.decr, lookup, coords, target.value / 100)
+
+        # derivative of a chain length is the sum of the unit vectors of its segments
+        #
+        index = prep["index"]
+        p = coords[index]
+        seg = p[:, 1:] - p[:, :-1]
+        length = np.linalg.norm(seg, axis=-1, keepdims=True)
+        unit = np.divide(seg, length, out=np.zeros_like(seg), where=length > 0.0)
+
+        rows = len(index)
+        grad = np.zeros((rows + 1, len(coords), 3))
+        r = np.arange(rows)[:, None]
+        np.add.at(grad, (r, index[:, 1:]), unit)
+        np.add.at(grad, (r, index[:, :-1]), -unit)
+        h0, h1 = prep["height"]
+        grad[rows, h0, 1] += 1.0
+        grad[rows, h1, 1] -= 1.0
+
+        jac = np.einsum('mvc,tvc->mt', grad, prep["deltas"])
+        if len(self.jacobians) >= self.maxcache:
+            del self.jacobians[next(iter(self.jacobians))]
+        self.jacobians[key] = jac
+        return jac
+
+    def solve(self, desired, groups=None, iterations=5, tolerance=0.01):
+        """
+        calculate modifier values for desired measurements, the mesh is not changed
+
+        :param dict desired: name (measurement, alias like waist or "size" for height): value in centimeters
+        :param groups: optional list of patterns or group names of modifiers allowed to change
+        :param int iterations: maximum number of refinements
+        :param float tolerance: maximum deviation in centimeters
+        :return: dictionary pattern: value (-1 .. 1), dictionary name: reached value in centimeters or None, None
+        """
+        meas = self.measurements
+        if meas.index is None:
+            meas.compile()
+
+        rows = []
+        names = []
+        goal = []
+        for name, value in desired.items():
+            if name == "size":
+                row = len(meas.index)
+            elif name in meas.rows:
+                row = meas.rows[name]
+            else:
+                self.env.logLine(1, "Unknown measurement: " + name)
+                continue
+            rows.append(row)
+            names.append(name)
+            goal.append(value / 10)
+
+        cands = self.candidates(groups)
+        if len(rows) == 0 or len(cands) == 0:
+            return None, None
+
+        prep = self._prepare(cands)
+        cands = prep["cands"]
+        if len(cands) == 0:
+            return None, None
+        key = (tuple(tied[0].pattern for tied in cands), self.macroState())
+        A = self._jacobian(prep, key)[rows]
+        goal = np.array(goal)
+
+        # current coordinates without candidates, these are added by the solution
+        #
+        z0 = self._split(cands)
+        deltas = prep["deltas"]
+        base = self.glob.baseClass.baseMesh.gl_coord.reshape(-1, 3)[prep["verts"]] - np.einsum('t,tvc->vc', z0, deltas)
+        damping = self.damping * max(np.mean(np.sum(A * A, axis=0)), 1e-12)
+        lower = np.zeros(len(z0))
+        upper = prep["upper"].copy()
+        n = len(cands)
+
+        # a modifier uses either increment or decrement, if both are used the smaller side is
+        # switched off and the solution is calculated again
+        #
+        z = z0
+        for _ in range(n + 1):
+            for _ in range(iterations):
+                reached = self._evaluate(prep, base + np.einsum('t,tvc->vc', z, deltas))[rows]
+                residual = goal - reached
+                if np.abs(residual).max() < tolerance / 10:
+                    break
+                z = boundedLeastSquares(A, residual + A @ z, lower, upper, z0, damping)
+            both = np.flatnonzero((z[:n] > 0.0) & (z[n:] > 0.0))
+            if len(both) == 0:
+                break
+            smaller = np.where(z[both] < z[n + both], both, n + both)
+            upper[smaller] = 0.0
+            z = np.minimum(z, upper)
+
+        reached = self._evaluate(prep, base + np.einsum('t,tvc->vc', z, deltas))[rows]
+        values = {}
+        for i, tied in enumerate(cands):
+            value = round(float(z[i] - z[n + i]), 6)
+            if value != round(tied[0].value / 100, 6):
+                for target in tied:
+                    values[target.pattern] = value
+
+        result = dict(zip(names, (reached * 10).tolist()))
+        self.env.logLine(2, "Measure solver: " + str(len(values)) + " modifiers changed, reached " + str(result))
+        return values, result
+
+    def apply(self, values, api=False):
+        """
+        set values and apply all targets
+
+        :param dict values: pattern: value as returned by solve
+        :param bool api: do not run in thread (API)
+        """
+        for pattern, value in values.items():
+            self.glob.Targets.setTargetByName(pattern, value)
+        if api:
+            self.glob.baseClass.nonParApplyTargets()
+        else:
+            self.glob.baseClass.parApplyTargets()
@@ -0,0 +1,342 @@
+"""
+    License information: data/licenses/makehuman_license.txt
+    Author: black-punkduck
+
+    Classes:
+    * MeshCache
+"""
+import os
+import hashlib
+import numpy as np
+from collections import OrderedDict
+
+class MeshCache():
+    """
+    results of applyAllTargets (coordinates of base mesh and attached assets), key is a hash of the base mesh,
+    the loaded target data (see targetFingerprint) and all modifier values. Assets are kept per file inside
+    an entry, so changing the assets does not change the key.
+
+    * least recently used entries are dropped when budget "mesh_cache_budget" (MB) is exceeded
+    * with "mesh_cache_disk" (MB) > 0 dropped entries are written to the user dbcache folder and survive a restart
+    * a new state where only modifiers (no macros) differ starts from the nearest cached entry
+
+    The buffer of the base mesh without macros is stored as well, it is used when a macro slider is moved.
+    Normals are not part of an entry, they are not changed by applyAllTargets. Skeleton and pose are applied
+    afterwards to the result, so they are not part of the key.
+
+    :param glob: handle to global object to access base object etc
+    :type glob: class: globalObjects
+    """
+    def __init__(self, glob):
+        self.glob = glob
+        self.env = glob.env
+        conf = self.env.config
+        self.budget = (conf["mesh_cache_budget"] if "mesh_cache_budget" in conf else 128) * 1048576
+        self.diskbudget = (conf["mesh_cache_disk"] if "mesh_cache_disk" in conf else 0) * 1048576
+        self.entries = OrderedDict()    # key: entry (dictionary with vector, macro, base, nonmacro, assets, size)
+        self.ondisk = OrderedDict()     # key: size of file
+        self.used = 0
+        self.diskused = 0
+        self.hits = 0
+        self.misses = 0
+        self.keys = None                # names of values in vector
+        self.macromask = None           # values which are used by macros (or barycentric)
+        self.folder = None
+        self.fingerprint = self.targetFingerprint()
+        if self.diskbudget > 0:
+            self.folder = self.env.stdUserPath("dbcache", "meshcache")
+            self.scanDisk()
+
+    def targetFingerprint(self):
+        """
+        hash of the target data: date and size of binary targets (or ASCII targets when no binary exists),
+        storage type and base mesh. Recompiled targets create new keys.
+        """
+        conf = self.env.config
+        h = hashlib.blake2b(digest_size=16)
+        h.update(str(conf["binary_storage"] if "binary_storage" in conf else "float32").encode("utf-8"))
+        paths = [self.glob.baseClass.baseMesh.filename]
+        if self.glob.Targets is not None:
+            for x in self.glob.Targets.target_env:
+                folder = x["targetpath"]
+                if folder is None or not os.path.isdir(folder):
+                    continue
+                bintargets = os.path.join(folder, "compressedtargets.npz")
+                if os.path.isfile(bintargets):
+                    paths.append(bintargets)
+                else:
+                    for root, dirs, files in os.walk(folder):
+                        paths.extend([os.path.join(root, name) for name in files if name.endswith(".target")])
+        for path in sorted(paths):
+            if path is not None and os.path.isfile(path):
+                st = os.stat(path)
+                h.update((path + "|" + str(st.st_mtime_ns) + "|" + str(st.st_size) + "\n").encode("utf-8"))
+        return h.hexdigest()
+
+    def compile(self, values):
+        """
+        order of values, a change of the loaded targets creates new keys
+        """
+        repo = self.glob.targetRepo
+        self.keys = sorted(values.keys())
+        self.macromask = np.array([repo[key].macro is not None or repo[key].barycentric is not None
+            for key in self.keys], dtype=bool)
+
+    def state(self):
+        """
+        :return: key, vector of all values, hash of macro values
+        """
+        values = self.glob.Targets.currentValues()
+        if self.keys is None or len(self.keys) != len(values):
+            self.compile(values)
+        vector = np.array([values[key] for key in self.keys], dtype=np.float64)
+
+        h = hashlib.blake2b(digest_size=16)
+        h.update(self.fingerprint.encode("utf-8"))
+        h.update("|".join(self.keys).encode("utf-8"))
+        macro = hashlib.blake2b(vector[self.macromask].tobytes(), digest_size=16).hexdigest()
+        h.update(vector.tobytes())
+        return h.hexdigest(), vector, macro
+
+    def restore(self):
+        """
+        set base mesh and attached assets from cache, an entry with the same macros is used as a start
+
+        :return: True if mesh is complete
+        """
+        key, vector, macro = self.state()
+        entry = self.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.env.logLine(8, "Mesh cache hit: " + key)
+            base = self.glob.baseClass.baseMesh
+            base.gl_coord[:] = entry["base"]
+            base.version += 1
+            self.restoreNonMacro(entry["nonmacro"])
+            self.restoreAssets(entry)
+            return True
+
+        self.misses += 1
+        parent = self.parent(vector, macro)
+        if parent is None:
+            return False
+
+        # add differences of modifiers only, to mesh and to buffer without macros
+        #
+        base = self.glob.baseClass.baseMesh
+        base.gl_coord[:] = parent["base"]
+        self.restoreNonMacro(parent["nonmacro"])
+        coords = base.gl_coord.reshape(-1, 3)
+        nonmacro = base.gl_coord_mn.reshape(-1, 3)
+        for i in np.flatnonzero(vector != parent["vector"]):
+            target = self.glob.targetRepo[self.keys[i]]
+            new = vector[i]
+            old = parent["vector"][i]
+            for mt, weight in ((target.incr, max(new, 0.0) - max(old, 0.0)), (target.decr, max(-new, 0.0) - max(-old, 0.0))):
+                if mt is not None and weight != 0.0:
+                    delta = weight * mt.vectors()
+                    coords[mt.indices()] += delta
+                    nonmacro[mt.indices()] += delta
+        base.overflowCorrection(base.gl_coord)
+        base.overflowCorrection(base.gl_coord_mn)
+        base.version += 1
+        self.env.logLine(8, "Mesh cache: started from cached parent")
+        self.glob.baseClass.updateAttachedAssets()
+        self.store(key, vector, macro)
+        return True
+
+    def restoreNonMacro(self, nonmacro):
+        """
+        buffer without macros is needed by macro sliders (see object3d.addMacroBuffer)
+        """
+        base = self.glob.baseClass.baseMesh
+        base.gl_coord_mn = base.writableBuffer(base.gl_coord_mn)
+        base.gl_coord_mn[:] = nonmacro
+
+    def restoreAssets(self, entry):
+        """
+        assets with a cached result are copied, others are calculated
+        """
+        base = self.glob.baseClass.baseMesh
+        missing = False
+        for asset in self.glob.baseClass.attachedAssets:
+            if asset.obj is None:
+                continue
+            coords = entry["assets"].get(asset.filename)
+            if coords is not None and len(coords) == len(asset.obj.gl_coord):
+                asset.obj.gl_coord[:] = coords
+                asset.obj.version += 1
+            else:
+                asset.obj.approxToBasemesh(asset, base)
+                missing = True
+        if missing:
+            size = entry["size"]
+            self.addAssets(entry)
+            self.used += entry["size"] - size
+            self.evict()
+
+    def parent(self, vector, macro):
+        """
+        cached entry with identical macros and fewest different modifiers, only used when it needs
+        less targets than a new calculation
+        """
+        best = None
+        bestcount = np.count_nonzero(vector[~self.macromask]) + 1
+        for entry in self.entries.values():
+            if entry["macro"] == macro and len(entry["vector"]) == len(vector):
+                count = np.count_nonzero(entry["vector"] != vector)
+                if count < bestcount:
+                    best = entry
+                    bestcount = count
+        return best
+
+    def store(self, key=None, vector=None, macro=None):
+        """
+        store result of applyAllTargets
+        """
+        if key is None:
+            key, vector, macro = self.state()
+        base = self.glob.baseClass.baseMesh
+        entry = { "vector": vector, "macro": macro, "base": base.gl_coord.copy(), "nonmacro": base.gl_coord_mn.copy(),
+                "assets": {}, "size": 0 }
+        self.addAssets(entry)
+        self.put(key, entry)
+
+    def entrySize(self, entry):
+        return entry["vector"].nbytes + entry["base"].nbytes + entry["nonmacro"].nbytes + sum([c.nbytes for c in entry["assets"].values()])
+
+    def addAssets(self, entry):
+        """
+        add coordinates of attached assets not yet in entry
+        """
+        for asset in self.glob.baseClass.attachedAssets:
+            if asset.obj is not None and asset.filename not in entry["assets"]:
+                entry["assets"][asset.filename] = asset.obj.gl_coord.copy()
+        entry["size"] = self.entrySize(entry)
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        if key in self.ondisk:
+            entry = self.loadEntry(key)
+            if entry is not None:
+                self.put(key, entry)
+                return entry
+        return None
+
+    def put(self, key, entry):
+        if key in self.entries:
+            self.used -= self.entries.pop(key)["size"]
+        self.entries[key] = entry
+        self.used += entry["size"]
+        self.evict()
+
+    def evict(self):
+        """
+        drop least recently used entries until budget is reached, spill them to disk when configured
+        """
+        while self.used > self.budget and len(self.entries) > 1:
+            key, entry = self.entries.popitem(last=False)
+            self.used -= entry["size"]
+            if self.folder is not None:
+                self.saveEntry(key, entry)
+
+    def filename(self, key):
+        return os.path.join(self.folder, key + ".npz")
+
+    def scanDisk(self):
+        """
+        entries of former sessions, oldest first. When the target data has changed, all files are deleted
+        """
+        if self.folder is None:
+            return
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+        except OSError as error:
+            self.env.logLine(1, "Mesh cache: " + str(error))
+            return
+        files = [f for f in os.listdir(self.folder) if f.endswith(".npz")]
+        files.sort(key=lambda f: os.path.getmtime(os.path.join(self.folder, f)))
+        for f in files:
+            size = os.path.getsize(os.path.join(self.folder, f))
+            self.ondisk[f[:-4]] = size
+            self.diskused += size
+
+        fpfile = os.path.join(self.folder, "fingerprint")
+        old = None
+        if os.path.isfile(fpfile):
+            with open(fpfile, "r") as f:
+                old = f.read().strip()
+        if old != self.fingerprint:
+            if len(self.ondisk) > 0:
+                self.env.logLine(8, "Mesh cache: targets changed, delete " + str(len(self.ondisk)) + " entries")
+            self.clear(True)
+            try:
+                with open(fpfile, "w") as f:
+                    f.write(self.fingerprint)
+            except OSError as error:
+                self.env.logLine(1, "Mesh cache: " + str(error))
+
+    def saveEntry(self, key, entry):
+        if key in self.ondisk:
+            self.ondisk.move_to_end(key)
+            return
+        names = list(entry["assets"].keys())
+        content = { "vector": entry["vector"], "macro": np.array(entry["macro"]), "base": entry["base"],
+                "nonmacro": entry["nonmacro"], "assetnames": np.array(names, dtype=str) }
+        for i, name in enumerate(names):
+            content["asset" + str(i)] = entry["assets"][name]
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            with open(self.filename(key), "wb") as f:
+                np.savez(f, **content)
+        except OSError as error:
+            self.env.logLine(1, "Mesh cache: " + str(error))
+            return
+        size = os.path.getsize(self.filename(key))
+        self.ondisk[key] = size
+        self.diskused += size
+        while self.diskused > self.diskbudget and len(self.ondisk) > 0:
+            self.deleteEntry(next(iter(self.ondisk)))
+
+    def loadEntry(self, key):
+        try:
+            with np.load(self.filename(key)) as npzfile:
+                names = [str(name) for name in npzfile["assetnames"]]
+                assets = { name: npzfile["asset" + str(i)] for i, name in enumerate(names) }
+                entry = { "vector": npzfile["vector"], "macro": str(npzfile["macro"]), "base": npzfile["base"],
+                        "nonmacro": npzfile["nonmacro"], "assets": assets, "size": 0 }
+        except (OSError, ValueError, KeyError) as error:
+            self.env.logLine(1, "Mesh cache: " + str(error))
+            self.deleteEntry(key)
+            return None
+        entry["size"] = self.entrySize(entry)
+        self.ondisk.move_to_end(key)
+        return entry
+
+    def deleteEntry(self, key):
+        self.diskused -= self.ondisk.pop(key)
+        try:
+            os.remove(self.filename(key))
+        except OSError:
+            pass
+
+    def clear(self, disk=False):
+        """
+        drop all entries, e.g. when targets are changed
+
+        :param bool disk: delete files as well
+        """
+        self.entries = OrderedDict()
+        self.used = 0
+        if disk:
+            for key in list(self.ondisk.keys()):
+                self.deleteEntry(key)
+
+    def statistics(self):
+        """
+        :return: dictionary with hits, misses, entries and bytes in memory and on disk
+        """
+        return { "hits": self.hits, "misses": self.misses, "entries": len(self.entries), "bytes": self.used,
+                "disk_entries": len(self.ondisk), "disk_bytes": self.diskused }
@@ -0,0 +1,65 @@
+"""
+    License information: data/licenses/makehuman_license.txt
+    Author: black-punkduck
+
+    compact storage of targets and asset fitting data, storage is "float32" (default), "float16" or "int16"
+    (quantized with a scale per array). Indices use uint16 when all numbers fit.
+
+    Functions:
+    * compactIndices
+    * quantize
+    * dequantize
+    * quantizeTarget
+"""
+
+import numpy as np
+
+def compactIndices(index):
+    """
+    uint16 when all numbers fit, otherwise uint32
+    """
+    index = np.asarray(index)
+    if len(index) == 0 or index.max() < 65536:
+        return index.astype(np.uint16)
+    return index.astype(np.uint32)
+
+def quantize(values, storage):
+    """
+    :param values: float array
+    :param str storage: "float16", "int16" or "float32"
+    :return: array, scale (None if not needed)
+    """
+    values = np.asarray(values)
+    if storage == "float16":
+        return values.astype(np.float16), None
+    if storage == "int16":
+        m = float(np.abs(values).max()) if values.size > 0 else 0.0
+        scale = np.float32(m / 32767 if m > 0.0 else 1.0)
+        return np.round(values / scale).astype(np.int16), scale
+    return values.astype(np.float32), None
+
+def dequantize(values, scale=None):
+    """
+    :return: float32 array (no copy for float32 without scale)
+    """
+    values = values.astype(np.float32, copy=False)
+    if scale is not None:
+        return values * scale
+    return values
+
+def quantizeTarget(arr, storage):
+    """
+    convert structured target array (index, vector) to compact storage
+
+    :param arr: target as loaded by TargetASCII.load
+    :param str storage: "float16", "int16" or "float32"
+    :return: structured array, scale (None if not needed), maximum error
+    """
+    index = compactIndices(arr['index'])
+    vector, scale = quantize(arr['vector'], storage)
+    dtype = [('index', index.dtype.str), ('vector', '(3,)' + vector.dtype.str)]
+    compact = np.empty(len(arr), dtype=dtype)
+    compact['index'] = index
+    compact['vector'] = vector
+    error = float(np.abs(dequantize(vector, scale) - arr['vector']).max()) if len(arr) > 0 else 0.0
+    return compact, scale, error
@@ -5,6 +5,7 @@
     classes:
     * TargetRandomizer
 """
+import numpy as np
 from numpy import random
 
 class TargetRandomizer():
@@ -27,6 +28,8 @@ class TargetRandomizer():
     * symfactor     is a value between full symmetry (1.0) and no symmetry (0.0)
     * weirdofactor  is a value between no change at all (0.0) and fully random change (1.0)
     * fromDefault   means the character is reset to default before. Without that, non-selected groups are not changed at all
+    * doBatch       draws values for many characters at once as a matrix (characters x targets) with a seedable
+                    generator, sliders are not changed. A row can be applied with applyBatchRow
 
     this class is API callable
     """
@@ -348,22 +351,206 @@ class TargetRandomizer():
         if self.idealMin > 0.0:
             self.addNamedTarget(self.idealName)
 
+        for key, target in self.selectedTargets():
+            self.addTarget(key, target)
+
+        self.applyRules()
+        return True
+
+    def selectedTargets(self):
+        """
+        keys and targets of the selected groups in order of the target repository
+        """
+        selected = []
         for key, target in self.glob.targetRepo.items():
             tg = target.group
             if not self.groups:                     # no group dictionary, so all elements
-                self.addTarget(key, target)
+                selected.append((key, target))
             elif "|" in tg:
                 group, sub = tg.split("|", 2)
                 if group in self.groups:
                     if self.groups[group] is None:
-                        self.addTarget(key, target)
+                        selected.append((key, target))
                     else:
                         for subgroup in self.groups[group]:
                             if subgroup == sub:
-                                self.addTarget(key, target)
+                                selected.append((key, target))
+        return selected
 
-        self.applyRules()
-        return True
+    def randoms(self, rng, count):
+        """
+        array version of random using a generator
+        """
+        if self.method == 0:
+            return rng.random(count)
+        # truncated normal distribution
+        #
+        return np.clip(rng.normal(loc=0.5, scale=0.2, size=count), 0.0, 1.0)
+
+    def randomValues(self, rng, target, count):
+        """
+        array version of randomValue, returns 0 for single side targets, 1 for double sided
+        """
+        if target.decr is None or target.incr is None:
+            if target.default != 0.0:
+                modrange = 100-target.default if target.default > 50.0 else target.default
+                x = (self.randoms(rng, count) * modrange * self.weirdofactor + target.default) / 100.0
+            else:
+                x = self.randoms(rng, count) * self.weirdofactor
+            return x, 0
+
+        x = (1 - self.randoms(rng, count) * 2) * self.weirdofactor
+        return x, 1
+
+    def setBatchColumn(self, batch, key, values):
+        c = batch["columns"][key]
+        batch["matrix"][:, c] = values
+        batch["used"][c] = True
+
+    def addBatchTarget(self, key, target, rng, batch):
+        """
+        array version of addTarget, values are written to the columns of the batch matrix
+
+        :param batch: dictionary with matrix, columns (key: column), used (randomized columns), done (names of special targets)
+        """
+        count = len(batch["matrix"])
+
+        if target.name == self.gendName or target.name == self.idealName:
+            if target.name in batch["done"]:
+                return
+            batch["done"].add(target.name)
+            if target.name == self.idealName:
+                self.setBatchColumn(batch, key, self.randoms(rng, count) * (1.0 - self.idealMin) + self.idealMin)
+            elif self.gender == 0:
+                self.setBatchColumn(batch, key, self.randoms(rng, count))
+            elif self.gender == 1:
+                self.setBatchColumn(batch, key, 0.0)
+            elif self.gender == 2:
+                self.setBatchColumn(batch, key, 1.0)
+            else:
+                self.setBatchColumn(batch, key, np.round(self.randoms(rng, count)))
+            return
+
+        for s in self.nonsymgroups:
+            if (target.decr is not None and target.decr.name.endswith(s)) or \
+                target.incr is not None and target.incr.name.endswith(s):
+
+                if self.symfactor <= 0.99:
+                    rnd, s = self.randomValues(rng, target, count)
+                    self.setBatchColumn(batch, key, (1.0 - self.symfactor) * rnd)
+                return
+
+        if target.sym:
+            if target.isRSide:
+                rnd, s = self.randomValues(rng, target, count)
+                self.setBatchColumn(batch, key, rnd)
+                if self.symfactor > 0.99:
+                    self.setBatchColumn(batch, target.sym, rnd)
+                else:
+                    if s == 0:
+                        d = (self.randoms(rng, count) - 0.5) * (1.0 - self.symfactor)
+                        lower = 0.0
+                    else:
+                        d = (1 - self.randoms(rng, count) * 2) * (1.0 - self.symfactor)
+                        lower = 1.0
+                    rnd2 = np.where(d < 0.0, (lower + rnd) * d + rnd, (1.0 - rnd) * d + rnd)
+                    bad = (rnd2 < -lower) | (rnd2 > 1.0)
+                    rnd2[bad] = rnd[bad]
+                    self.setBatchColumn(batch, target.sym, rnd2)
+        elif target.barycentric is not None:
+            if target.name not in batch["done"]:
+                batch["done"].add(target.name)
+                x = self.randoms(rng, count)
+                y = self.randoms(rng, count) * (1 - x)
+                for elem, val in zip(target.barycentric, (x, y, 1 - x - y)):
+                    self.setBatchColumn(batch, elem["name"], val)
+        else:
+            rnd, dummy = self.randomValues(rng, target, count)
+            self.setBatchColumn(batch, key, rnd)
+
+    def applyBatchRules(self, batch):
+        """
+        array version of applyRules, values of targets are reset per character
+        """
+        repo = self.glob.targetRepo
+        names = {}
+        for key, t in repo.items():
+            if t.name not in names:
+                names[t.name] = batch["columns"][key]
+
+        matrix = batch["matrix"]
+        for elem, rule in self.rules.items():
+            if elem not in names or not batch["used"][names[elem]]:
+                continue
+            conditions = []
+            for name, condition in rule.items():
+                if name not in names:
+                    conditions = None
+                    break
+                conditions.append((names[name], compile(condition, "rule", "eval")))
+
+            c = names[elem]
+            for row in range(len(matrix)):
+                if conditions is None or not all(eval(code, {}, {"x": matrix[row, col]}) for col, code in conditions):
+                    matrix[row, c] = 0.0
+
+    def doBatch(self, count, mode=0, seed=None):
+        """
+        the randomizer function for many characters, sliders are not changed. Values of not selected
+        targets are the default values (fromDefault) or the current ones.
+
+        :param count: number of characters
+        :param mode: 0 = linear, 1 = gauss
+        :param seed: seed or numpy Generator for reproducible results
+        :returns: list of keys (columns), matrix (count, keys) with values as used by setTargetByName or None, None
+        """
+        if self.glob.baseClass is None:
+            print ("No base")
+            return None, None
+        if self.glob.targetRepo is None:
+            print ("No Targets")
+            return None, None
+
+        self.method = mode
+        rng = random.default_rng(seed)
+        keys = list(self.glob.targetRepo.keys())
+        batch = { "matrix": np.empty((count, len(keys))), "columns": { key: i for i, key in enumerate(keys) },
+                "used": np.zeros(len(keys), dtype=bool), "done": set() }
+
+        for i, (key, target) in enumerate(self.glob.targetRepo.items()):
+            if target.barycentric is not None:
+                for j, elem in enumerate(target.barycentric):
+                    if elem["name"] == key:
+                        batch["matrix"][:, i] = [0.33, 0.33, 0.34][j] if self.fromDefault else elem["value"]
+            else:
+                batch["matrix"][:, i] = (target.default if self.fromDefault else target.value) / 100
+
+        if self.gender != 0:
+            self.addNamedBatchTarget(self.gendName, rng, batch)
+
+        if self.idealMin > 0.0:
+            self.addNamedBatchTarget(self.idealName, rng, batch)
+
+        for key, target in self.selectedTargets():
+            self.addBatchTarget(key, target, rng, batch)
+
+        self.applyBatchRules(batch)
+        return keys, batch["matrix"]
+
+    def addNamedBatchTarget(self, name, rng, batch):
+        for key, t in self.glob.targetRepo.items():
+            if (name == t.name):
+                self.addBatchTarget(key, t, rng, batch)
+                return
+
+    def applyBatchRow(self, keys, matrix, row, api=False):
+        """
+        apply one character of a batch
+        """
+        tlist = []
+        for i, key in enumerate(keys):
+            tlist.append([key, self.glob.targetRepo[key], float(matrix[row, i])])
+        self._applyList(tlist, api)
 
     def _applyList(self, tlist, api=False):
         for elem in tlist:
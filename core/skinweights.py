@@ -0,0 +1,111 @@
+"""
+    License information: data/licenses/makehuman_license.txt
+    Author: black-punkduck
+
+    packing of bone weights for exports, per-bone tables are converted
+    to a vertex x bone sparse matrix in coordinate form
+
+    Functions:
+    * weightEntries
+    * topWeights
+    * variableWeights
+"""
+
+import numpy as np
+
+def weightEntries(bweights, bonenumbers, numverts, mapping=None):
+    """
+    convert per-bone weight tables to entries sorted by vertex, inside a vertex the entries
+    keep the order of the bones
+
+    :param dict bweights: bone: (vertices, weights)
+    :param dict bonenumbers: bone: joint number
+    :param int numverts: number of vertices, higher vertex numbers are ignored
+    :param mapping: optional array to map vertex numbers, -1 = vertex not used
+    :return: vertices, joints, weights (arrays of same length)
+    """
+    bones = list(bweights.keys())
+    lengths = [len(bweights[bone][0]) for bone in bones]
+    if sum(lengths) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+    verts = np.concatenate([bweights[bone][0] for bone in bones]).astype(np.int64)
+    weights = np.concatenate([bweights[bone][1] for bone in bones]).astype(np.float32)
+    joints = np.repeat(np.array([bonenumbers[bone] for bone in bones], dtype=np.int64), lengths)
+
+    if mapping is not None:
+        used = verts < len(mapping)
+        verts = mapping[verts[used]].astype(np.int64)
+        joints = joints[used]
+        weights = weights[used]
+        used = verts != -1
+    else:
+        used = np.ones(len(verts), dtype=bool)
+    used &= (verts >= 0) & (verts < numverts)
+
+    order = np.argsort(verts[used], kind="stable")
+    return verts[used][order], joints[used][order], weights[used][order]
+
+def topWeights(verts, joints, weights, numverts, k=4, overflow=None):
+    """
+    select the k largest influences per vertex (fixed layout as used by glTF JOINTS_0/WEIGHTS_0)
+    vertices with more than k influences are sorted by weight, others keep the order of the bones.
+    weights are normalized, overflow vertices get the values of their source
+
+    :param verts: vertices from weightEntries (sorted)
+    :param joints: joint numbers from weightEntries
+    :param weights: weights from weightEntries
+    :param int numverts: number of vertices
+    :param int k: number of influences per vertex
+    :param overflow: optional array of (source, destination) vertex numbers
+    :return: joints (numverts, k), weights (numverts, k)
+    """
+    counts = np.bincount(verts, minlength=numverts)
+    starts = np.cumsum(counts) - counts
+    maxcount = max(int(counts.max()) if len(counts) > 0 else 0, k)
+
+    # padded matrix vertex x influence, padding is never selected
+    #
+    slots = np.arange(len(verts)) - starts[verts]
+    wmatrix = np.full((numverts, maxcount), -np.inf, dtype=np.float32)
+    jmatrix = np.zeros((numverts, maxcount), dtype=np.int64)
+    wmatrix[verts, slots] = weights
+    jmatrix[verts, slots] = joints
+
+    # rows with more influences are sorted by weight (stable, so equal weights keep order of bones)
+    #
+    many = np.flatnonzero(counts > k)
+    if len(many) > 0:
+        order = np.argsort(-wmatrix[many], axis=1, kind="stable")[:, :k]
+        wmatrix[many, :k] = np.take_along_axis(wmatrix[many], order, axis=1)
+        jmatrix[many, :k] = np.take_along_axis(jmatrix[many], order, axis=1)
+
+    tjoints = jmatrix[:, :k]
+    tweights = wmatrix[:, :k]
+    tweights[np.isinf(tweights)] = 0.0
+
+    # normalize weights (can deal with 0.0 sums)
+    #
+    sums = tweights.sum(axis=1, keepdims=1)
+    sums[sums==0.0] = 1.0
+    tweights = tweights / sums
+
+    if overflow is not None and len(overflow) > 0:
+        overflow = np.asarray(overflow)
+        tjoints[overflow[:,1]] = tjoints[overflow[:,0]]
+        tweights[overflow[:,1]] = tweights[overflow[:,0]]
+
+    return tjoints, tweights
+
+def variableWeights(verts, joints, weights, numverts):
+    """
+    variable length layout (number of influences per vertex, followed by all joints and weights in vertex order)
+
+    :param verts: vertices from weightEntries (sorted)
+    :param joints: joint numbers from weightEntries
+    :param weights: weights from weightEntries
+    :param int numverts: number of vertices
+    :return: influences per vertex, joints, weights
+    """
+    counts = np.bincount(verts, minlength=numverts)
+    return counts, joints, weights
@@ -13,6 +13,7 @@ from gui.common import WorkerThread
 from gui.slider import ScaleComboItem
 from core.targetcat import TargetCategories
 from core.importfiles import TargetASCII
+from core.quantize import dequantize
 
 import os
 import sys
@@ -231,94 +232,8 @@ class Modelling(ScaleComboItem):
                     key = self.glob.targetRepo[self.sym]
                     self.obj.getInitialCopyForSlider(key.value / 100, key.decr, key.incr)
 
-    def generateAllMacroWeights(self, targetlist, macroname, factor, weights):
-        """
-        recursive function to generate weights.  Since for example 4 different components will change the character,
-        one need to figure out how much each component will be used. Therefore one need to consider the components like a tree
-        for the leaf the value itself is added, otherwise we do an recursion
-        """
-        if len(weights) > 0:
-            for i in range(0,3):
-                if  weights[0].names[i] is not None:
-                    self.generateAllMacroWeights(targetlist, macroname + "-" +  weights[0].names[i], factor * weights[0].values[i], weights[1:])
-        else:
-            if factor > 0.01:
-                targetlist.append ({"name": macroname[1:], "factor": factor})
-
     def macroCalculation(self, m_influence):
-        macros = self.glob.targetMacros
-        macrodef = macros["macrodef"]
-        components = macros["components"]
-        targetlist = []
-        for l in m_influence:
-            #print ("   " + macrodef[l]["name"])
-            comps = macrodef[l]["comp"]
-            weightarray = []
-            for elem in comps:
-                if elem in components:
-                    pattern = components[elem]["pattern"]
-                    values  = components[elem]["values"]
-                    # print ("\t\tPattern:" +  str(pattern) + " " + str(values))
-
-                    if "steps" not in components[elem]:
-
-                        # extra for sum of sliders (human phenotype)
-                        #
-                        sum = components[elem]["sum"]
-                        m = MacroTree()
-                        for i,v in enumerate(values):
-                            p = pattern +  sum[i]
-                            if p not in self.glob.targetRepo:
-                                continue
-                            current = self.glob.targetRepo[p]
-                            b = current.barycentric[i]["value"]
-                            if b > 0.001:
-                                # print ("\t\tCurrent value " + v + " " + str(b))
-                                m.insert(v, b)
-                        weightarray.append(m)
-                    else:
-                        steps = components[elem]["steps"]
-                        if pattern not in self.glob.targetRepo:
-                            continue
-                        current = self.glob.targetRepo[pattern].value / 100
-                        # print ("\t\tCurrent " + str(current) + " Divisions: " + str(len(steps)))
-
-                        for i in range(0,len(steps)-1):
-                            if current > steps[i+1]:
-                                continue
-                            else:
-                                c = (current - steps[i]) / (steps[i+1] - steps[i])
-                                m = MacroTree()
-                                if c < 0.999:
-                                    m.insert(values[i], 1-c)
-                                if c > 0.001:
-                                    m.insert(values[i+1], c)
-                                weightarray.append(m)
-                                break
-
-            self.generateAllMacroWeights(targetlist, "", 1.0, weightarray)
-
-        # The last step is the optimization: Some weightfiles are not existing.
-        # So they would be a factor of 0. Sometimes targets are identical.
-        # All targets are in memory and there are no duplicates. The calculated
-        # target name will be mapped to the targets (using the value "t")
-        # So it either add them the new targetname to a list or add the second factor if allready exists.
-
-        sortedtargets = {}
-        l = macros["targetlink"]
-
-        for elem in targetlist:
-            name = elem["name"]
-            if name is not None:
-                if name in l and l[name] is not None:
-                    if l[name] in sortedtargets:
-                        sortedtargets[l[name]] += elem["factor"]
-                        #print(" Add: " + name)
-                    else:
-                        sortedtargets[l[name]] = elem["factor"]
-                        #print(" New: " + name)
-                else:
-                    pass
+        sortedtargets = self.glob.Targets.macroFactors(self.glob.Targets.currentValues(), m_influence)
 
         # add them to screen first
         #
@@ -447,6 +362,7 @@ class Morphtarget:
         self.raw  = None
         self.verts= []
         self.data = []
+        self.scale = None   # scale of int16 storage
         self.env  = env
 
     def __str__(self):
@@ -462,6 +378,8 @@ class Morphtarget:
                 self.raw = bintargets[self.name]
                 self.verts = self.raw['index']
                 self.data = self.raw['vector']
+                if self.name + "#scale" in bintargets.files:
+                    self.scale = bintargets[self.name + "#scale"].item()
                 return
 
         filename = os.path.join(path, self.name) + ".target"
@@ -475,6 +393,20 @@ class Morphtarget:
         self.verts = self.raw['index']
         self.data = self.raw['vector']
 
+    def indices(self):
+        """
+        vertex numbers, compact storage (uint16) is widened to avoid overflows in index calculation
+        """
+        if self.verts.dtype.itemsize < 4:
+            return self.verts.astype(np.int64)
+        return self.verts
+
+    def vectors(self):
+        """
+        deltas as float32, compact storage is dequantized on the fly
+        """
+        return dequantize(self.data, self.scale)
+
     def releaseNumpy(self):
         if self.raw is not None:
             self.verts = None
@@ -654,9 +586,10 @@ class Targets:
                     # avoid remove when no ASCII targets are there
                     #
                     remove = not (i == self.target_sysindex)
-                    num = ta.compressAllTargets(x["targetpath"], bintargets, verbose=0, remove=remove)
+                    num = ta.compressAllTargets(x["targetpath"], bintargets, verbose=0, remove=remove, storage=self.storage())
                     if num > 0:
                         self.env.logLine(1, str(num) + " targets compressed. Binary targets will be used on next restart")
+                        self.logQuantization(ta)
                     else:
                         self.env.logLine(1, "No targets for " + bintargets)
                 else:
@@ -695,18 +628,34 @@ class Targets:
             sourcefolder = self.env.stdSysPath("target")
             destfile = self.env.stdSysPath("target", "compressedtargets.npz")
             self.env.logLine (8, "Compress system targets in " + sourcefolder + " to "+  destfile)
-            ta.compressAllTargets(sourcefolder, destfile, remove=False)
+            ta.compressAllTargets(sourcefolder, destfile, remove=False, storage=self.storage())
+            self.logQuantization(ta)
 
         if sys_user & 2:
             sourcefolder = self.env.stdUserPath("target")
             destfile = self.env.stdUserPath("target", "compressedtargets.npz")
             self.env.logLine (8, "Compress user targets in " + sourcefolder + " to "+  destfile)
-            ta.compressAllTargets(sourcefolder, destfile, remove=True)
+            ta.compressAllTargets(sourcefolder, destfile, remove=True, storage=self.storage())
+            self.logQuantization(ta)
             if self.target_sysindex == 2:
                 sourcefolder = self.env.stdUserPath("contarget")
                 destfile = self.env.stdUserPath("contarget", "compressedtargets.npz")
                 self.env.logLine (8, "Compress user constant targets in " + sourcefolder + " to "+  destfile)
-                ta.compressAllTargets(sourcefolder, destfile, remove=False)
+                ta.compressAllTargets(sourcefolder, destfile, remove=False, storage=self.storage())
+                self.logQuantization(ta)
+
+    def storage(self):
+        """
+        storage of binary targets (float32, float16 or int16)
+        """
+        conf = self.env.config
+        return conf["binary_storage"] if "binary_storage" in conf else "float32"
+
+    def logQuantization(self, ta):
+        num, maxerr, name, meanerr = ta.quantizationReport()
+        if num > 0:
+            self.env.logLine(1, "Targets stored as " + self.storage() + ", maximum error " + str(maxerr) +
+                    " (" + name + "), mean of maximum errors " + str(meanerr))
 
     def setSkinDiffuseColor(self):
         for target in self.modelling_targets:
@@ -754,6 +703,117 @@ class Targets:
             self.env.logLine (2, "Missing target:" + key)
             self.glob.missingTargets.append(key)
 
+    def currentValues(self):
+        """
+        values of all targets as used by setTargetByName, barycentric ones by the name of the element
+        """
+        values = {}
+        for key, t in self.glob.targetRepo.items():
+            if t.barycentric is not None:
+                for l in t.barycentric:
+                    if l["name"] == key:
+                        values[key] = l["value"]
+            else:
+                values[key] = t.value / 100
+        return values
+
+    def generateAllMacroWeights(self, targetlist, macroname, factor, weights):
+        """
+        recursive function to generate weights.  Since for example 4 different components will change the character,
+        one need to figure out how much each component will be used. Therefore one need to consider the components like a tree
+        for the leaf the value itself is added, otherwise we do an recursion
+        """
+        if len(weights) > 0:
+            for i in range(0,3):
+                if  weights[0].names[i] is not None:
+                    self.generateAllMacroWeights(targetlist, macroname + "-" +  weights[0].names[i], factor * weights[0].values[i], weights[1:])
+        else:
+            if factor > 0.01:
+                targetlist.append ({"name": macroname[1:], "factor": factor})
+
+    def macroFactors(self, values, m_influence):
+        """
+        calculate the factors of the macro targets, values are not taken from the sliders,
+        so it can be used for other characters as well
+
+        :param dict values: key: value as used by setTargetByName (see currentValues)
+        :param m_influence: list of macro definitions to use
+        :return: dictionary name of macro target: factor
+        """
+        macros = self.glob.targetMacros
+        macrodef = macros["macrodef"]
+        components = macros["components"]
+        targetlist = []
+        for l in m_influence:
+            #print ("   " + macrodef[l]["name"])
+            comps = macrodef[l]["comp"]
+            weightarray = []
+            for elem in comps:
+                if elem in components:
+                    pattern = components[elem]["pattern"]
+                    cvalues = components[elem]["values"]
+                    # print ("\t\tPattern:" +  str(pattern) + " " + str(cvalues))
+
+                    if "steps" not in components[elem]:
+
+                        # extra for sum of sliders (human phenotype)
+                        #
+                        sum = components[elem]["sum"]
+                        m = MacroTree()
+                        for i,v in enumerate(cvalues):
+                            p = pattern +  sum[i]
+                            if p not in values:
+                                continue
+                            b = values[p]
+                            if b > 0.001:
+                                # print ("\t\tCurrent value " + v + " " + str(b))
+                                m.insert(v, b)
+                        weightarray.append(m)
+                    else:
+                        steps = components[elem]["steps"]
+                        if pattern not in values:
+                            continue
+                        current = values[pattern]
+                        # print ("\t\tCurrent " + str(current) + " Divisions: " + str(len(steps)))
+
+                        for i in range(0,len(steps)-1):
+                            if current > steps[i+1]:
+                                continue
+                            else:
+                                c = (current - steps[i]) / (steps[i+1] - steps[i])
+                                m = MacroTree()
+                                if c < 0.999:
+                                    m.insert(cvalues[i], 1-c)
+                                if c > 0.001:
+                                    m.insert(cvalues[i+1], c)
+                                weightarray.append(m)
+                                break
+
+            self.generateAllMacroWeights(targetlist, "", 1.0, weightarray)
+
+        # The last step is the optimization: Some weightfiles are not existing.
+        # So they would be a factor of 0. Sometimes targets are identical.
+        # All targets are in memory and there are no duplicates. The calculated
+        # target name will be mapped to the targets (using the value "t")
+        # So it either add them the new targetname to a list or add the second factor if allready exists.
+
+        sortedtargets = {}
+        l = macros["targetlink"]
+
+        for elem in targetlist:
+            name = elem["name"]
+            if name is not None:
+                if name in l and l[name] is not None:
+                    if l[name] in sortedtargets:
+                        sortedtargets[l[name]] += elem["factor"]
+                        #print(" Add: " + name)
+                    else:
+                        sortedtargets[l[name]] = elem["factor"]
+                        #print(" New: " + name)
+                else:
+                    pass
+        return sortedtargets
+
     def modifierPresets(self, presets):
         """
         set presets from base.json
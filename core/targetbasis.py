@@ -0,0 +1,129 @@
+"""
+    License information: data/licenses/makehuman_license.txt
+    Author: black-punkduck
+
+    Classes:
+    * TargetBasis
+"""
+import numpy as np
+
+class TargetBasis():
+    """
+    low-rank basis of morph targets, calculated per region with a truncated SVD.
+
+    A region is a set of correlated targets (e.g. a macro folder or a modifier group). All deltas of a region
+    are a matrix (targets x coordinates of the region), which is replaced by coefficients (targets x rank) and
+    a basis (rank x coordinates). The rank is the smallest one where no target differs by more than tolerance.
+    The difference of a target is the norm over all its coordinates, so it is also the limit for a single vertex.
+
+    Weights of targets become a small coefficient vector per region, the mesh is reconstructed by one dense product.
+    Regions where the basis would not be smaller than the sparse targets (large rank, few vertices per target)
+    are kept sparse and evaluated target by target.
+
+    :param glob: handle to global object
+    :type glob: class: globalObjects
+    :param morphs: list of morph targets (columns of the weight matrix)
+    :param regions: list of region names, one per morph target
+    :param float tolerance: maximum difference of a reconstructed target, default is config "basis_tolerance"
+    """
+    def __init__(self, glob, morphs, regions, tolerance=None):
+        self.glob = glob
+        self.env = glob.env
+        if tolerance is None:
+            conf = self.env.config
+            tolerance = conf["basis_tolerance"] if "basis_tolerance" in conf else 0.001
+        self.tolerance = tolerance
+        self.morphs = morphs
+        self.regions = regions
+        self.compiled = []      # per region: dictionary with name, columns, vertices, coefficients, basis, bound, sparse
+
+    def build(self):
+        """
+        calculate the truncated SVD for all regions, a region is kept sparse if the basis needs the same or more memory
+        """
+        self.compiled = []
+        for name in dict.fromkeys(self.regions):
+            cols = np.array([i for i, r in enumerate(self.regions) if r == name])
+            sparsesize = sum([self.morphs[c].verts.nbytes + self.morphs[c].data.nbytes for c in cols])
+            verts = np.unique(np.concatenate([self.morphs[c].indices() for c in cols]))
+            lookup = np.full(verts[-1] + 1, -1, dtype=np.int64)
+            lookup[verts] = np.arange(len(verts))
+
+            deltas = np.zeros((len(cols), len(verts), 3))
+            for i, c in enumerate(cols):
+                mt = self.morphs[c]
+                deltas[i, lookup[mt.indices()]] = mt.vectors()
+            deltas = deltas.reshape(len(cols), -1)
+
+            u, s, vt = np.linalg.svd(deltas, full_matrices=False)
+
+            # error of each target when using rank k is the energy of the skipped components
+            #
+            energy = (u * s) ** 2
+            residual = np.cumsum(energy[:, ::-1], axis=1)[:, ::-1]
+            residual = np.concatenate([residual, np.zeros((len(cols), 1))], axis=1)
+            ok = np.flatnonzero(residual.max(axis=0) <= self.tolerance ** 2)
+            rank = int(ok[0]) if len(ok) > 0 else len(s)
+
+            # float32 coefficients and basis, vertex numbers as uint32
+            #
+            basissize = 4 * (rank * (len(verts) * 3 + len(cols)) + len(verts))
+            if basissize >= sparsesize:
+                self.compiled.append({ "name": name, "columns": cols, "verts": verts.astype(np.uint32),
+                    "coeff": None, "basis": None, "bound": np.zeros(len(cols)), "sparse": True })
+                self.env.logLine(2, "Target basis " + name + ": " + str(len(cols)) + " targets, rank " + str(rank) +
+                    " kept sparse (" + str(sparsesize) + " <= " + str(basissize) + " bytes)")
+                continue
+
+            self.compiled.append({ "name": name, "columns": cols, "verts": verts.astype(np.uint32),
+                "coeff": (u[:, :rank] * s[:rank]).astype(np.float32), "basis": vt[:rank].astype(np.float32),
+                "bound": np.sqrt(residual[:, rank]), "sparse": False })
+            self.env.logLine(2, "Target basis " + name + ": " + str(len(cols)) + " targets, " + str(len(verts)) +
+                " vertices, rank " + str(rank))
+
+        sparse, basis = self.memory()
+        self.env.logLine(2, "Target basis: " + str(sparse) + " bytes of sparse targets replaced by " + str(basis) +
+            " bytes, saving " + str(sparse - basis) + " bytes")
+
+    def addDeltas(self, coords, weights):
+        """
+        add weighted deltas of all regions to coordinates
+
+        :param coords: coordinates (characters, vertices, 3), changed in place
+        :param weights: weights (characters, morph targets)
+        """
+        for region in self.compiled:
+            w = weights[:, region["columns"]]
+            if not w.any():
+                continue
+            if region["sparse"]:
+                for i in np.flatnonzero(np.any(w != 0.0, axis=0)):
+                    mt = self.morphs[region["columns"][i]]
+                    coords[:, mt.indices()] += w[:, i, np.newaxis, np.newaxis] * mt.vectors()[np.newaxis]
+                continue
+            if len(region["basis"]) == 0:
+                continue
+            coeff = w @ region["coeff"]
+            coords[:, region["verts"]] += (coeff @ region["basis"]).reshape(len(coords), -1, 3)
+
+    def memory(self):
+        """
+        memory in bytes of the sparse targets and of the basis (including regions kept sparse)
+        """
+        sparse = sum([mt.verts.nbytes + mt.data.nbytes for mt in self.morphs])
+        basis = 0
+        for r in self.compiled:
+            if r["sparse"]:
+                basis += sum([self.morphs[c].verts.nbytes + self.morphs[c].data.nbytes for c in r["columns"]])
+            else:
+                basis += r["coeff"].nbytes + r["basis"].nbytes + r["verts"].nbytes
+        return sparse, basis
+
+    def report(self):
+        """
+        ranks and error bounds per region
+
+        :return: list of (region name, targets, vertices, rank (None if kept sparse), maximum error bound of a target)
+        """
+        return [(r["name"], len(r["columns"]), len(r["verts"]), None if r["sparse"] else len(r["basis"]),
+                float(r["bound"].max())) for r in self.compiled]
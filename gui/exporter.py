@@ -162,7 +162,7 @@ class ExportLeftPanel(QVBoxLayout):
         self.norm.setLayoutDirection(Qt.LeftToRight)
         self.norm.toggled.connect(self.changeNormals)
         self.norm.setChecked(self.values.normals)
-        self.norm.setToolTip('Some applications need the vertex normals to create a smoothed mesh')
+        self.norm.setToolTip('Some applications need the vertex normals to create a smoothed mesh<br>STL: unchecked = geometric facet normals, checked = averaged vertex normals')
         self.addWidget(self.norm)
 
         self.addWidget(QLabel("Scaling:"))
@@ -202,7 +202,7 @@ class ExportLeftPanel(QVBoxLayout):
             ".stl":  {"tip": common + "STL files are unit less. When working with printers 1 unit equals 1 millimeter (preset scale 1:10)",
                 "num": 3, "binset": True, "binmode": "both", "imgset": False, "imgmode": False, "hiddenset": True, "hiddenmode": False,
                 "animset": False, "animmode": False, "poseset": True, "posemode": False,
-                "helpset": False, "helpmode": False, "normset": False, "normmode": False,
+                "helpset": False, "helpmode": False, "normset": True, "normmode": True,
                 "customset": False, "custommode": False},
             ".glb": { "tip": common + "GLB/GLTF units are usually meters",
                 "num": 0, "binset": False, "binmode": True, "imgset": True, "imgmode": "both", "hiddenset": True, "hiddenmode": False,
@@ -389,12 +389,13 @@ class ExportLeftPanel(QVBoxLayout):
         if etype == ".glb":
             self.setAnimMode(False)
             gltf = gltfExport(self.glob, folder, texfolder, self.values.imgmode, self.values.savehiddenverts,
-                    self.values.onground,  self.values.animation, self.values.save_props, scale)
+                    self.values.onground,  self.values.animation, self.values.save_props, scale,
+                    self.glob.env.config["anim_key_tolerance"], self.glob.env.config["gltf_morphs"])
             success = gltf.binSave(self.bc, path)
             self.setAnimMode(lastanim)
 
         elif etype == ".stl":
-            stl = stlExport(self.glob, folder, self.values.savehiddenverts, scale)
+            stl = stlExport(self.glob, folder, self.values.savehiddenverts, scale, not self.values.normals)
             if self.values.binmode:
                 success = stl.binSave(self.bc, path)
             else:
@@ -101,7 +101,7 @@ class MHCharMeasWindow(QWidget):
                 if key in self.glob.targetRepo:
                     t = self.glob.targetRepo[key]
                     if t.measure:
-                        val, coords = bc.baseMesh.getMeasure(t.measure)
+                        val = bc.measurements.getValue(name)
                         text = self.env.toUnit(val)
                         self.addOrReplace(val, name, text)
                     elif name == "gender":
@@ -164,7 +164,7 @@ class GenericPoseEdit():
             self.poseskel.setOffset(self.position)
 
         corrections = {}
-        changed = self.poseskel.posebyBlends(blends, None)
+        changed = self.poseskel.posebyBlends(blends, None, units=self.units)
         if len(changed) > 0:
             for bone in changed:
                 elem = self.poseskel.bones[bone]
@@ -187,7 +187,7 @@ class GenericPoseEdit():
             blends, position = self.getChangedValues()
             if position is not None:
                 self.poseskel.setOffset(position)
-            self.poseskel.posebyBlends(blends, None)
+            self.poseskel.posebyBlends(blends, None, units=self.units)
         else:
             self.glob.midColumn.animViews(True)
             self.showCorrectedPose()
@@ -209,7 +209,7 @@ class GenericPoseEdit():
             if elem.name in pose.poses:
                 elem.value =  pose.poses[elem.name] * 100
         self.redraw(None)
-        self.poseskel.posebyBlends(pose.blends, self.bonemask)
+        self.poseskel.posebyBlends(pose.blends, self.bonemask, units=self.units)
 
     def fillPoses(self):
 
@@ -259,7 +259,7 @@ class GenericPoseEdit():
             if pos is not None:
                 self.poseskel.setOffset(self.position)
             self.poseskel.restPose(bones_only=True)
-            self.poseskel.posebyBlends(blends, None)
+            self.poseskel.posebyBlends(blends, None, units=self.units)
 
         self.view.Tweak()
 
@@ -330,7 +330,7 @@ class GenericPoseEdit():
             HintBox(self.parent.central_widget, "Corrections reset" + poscorr)
             return
 
-        changed = self.poseskel.posebyBlends(blends, self.bonemask, True)
+        changed = self.poseskel.posebyBlends(blends, self.bonemask, True, self.units)
         for bone in changed:
             elem = self.poseskel.bones[bone]
             corrections[bone] = elem.getRelativeCorrection()
@@ -2,6 +2,10 @@
     License information: data/licenses/makehuman_license.txt
     Author: black-punkduck, Elvaerwyn_MH2
 
+    Functions:
+    * createRenderJobs
+    * renderJobFile
+
     Classes:
     * RendererValues
     * Renderer
@@ -10,14 +14,105 @@
 from PySide6.QtCore import Qt
 from PySide6.QtWidgets import QWidget, QVBoxLayout, QPushButton, QLineEdit, QGridLayout, QLabel, QMessageBox,  QCheckBox, QHBoxLayout, QComboBox
 
-from gui.common import IconButton, MHFileRequest, MHBusyWindow, WorkerThread, ImageBox
+from gui.common import IconButton, MHFileRequest, MHBusyWindow, MHProgWindow, WorkerThread, ImageBox, HintBox
 from gui.slider import SimpleSlider
 
-from opengl.offscreen import OffScreenRender
+from opengl.offscreen import OffScreenRender, RenderJob, RenderQueue
 from core.loopapproximation import LoopApproximation
 
 import os
 
+def createRenderJobs(basename, width, height, angles, frames, models=None):
+    """
+    creates jobs for all combinations of models, frames and angles
+
+    :param str basename: filename, a running number is appended (name_0000.png)
+    :param list angles: y-rotations
+    :param list frames: frame numbers (use [None] for no animation)
+    :param list models: mhm files (use None for current character)
+    :return: list of RenderJob
+    """
+    if basename.endswith(".png"):
+        basename = basename[:-4]
+    jobs = []
+    for model in (models or [None]):
+        for frame in frames:
+            for angle in angles:
+                filename = basename + "_" + str(len(jobs)).zfill(4) + ".png"
+                jobs.append(RenderJob(filename, width, height, angle, frame, model))
+    return jobs
+
+def renderJobFile(glob, filename):
+    """
+    render images described by a JSON file without user interaction, used by command line.
+    On servers without display use QT_QPA_PLATFORM=offscreen (and LIBGL_ALWAYS_SOFTWARE=1 for Mesa llvmpipe)
+
+    keys: "output" (basename), "width", "height", "transparent", "turntable" (number of angles),
+    "angle" (start angle), "frames" ("all" or list of numbers), "models" (list of mhm files)
+
+    :return: number of images written or -1 in case of error
+    """
+    env = glob.env
+    view = glob.openGLWindow
+    conf = env.readJSON(filename)
+    if conf is None:
+        return -1
+
+    if "output" not in conf:
+        env.last_error = "no output defined in " + filename
+        return -1
+
+    width = conf["width"] if "width" in conf else 1000
+    height = conf["height"] if "height" in conf else 1000
+    steps = conf["turntable"] if "turntable" in conf else 1
+    start = conf["angle"] if "angle" in conf else 0.0
+    angles = [start + n * 360.0 / steps for n in range(steps)]
+    models = conf["models"] if "models" in conf else None
+    frames = [None]
+    if "frames" in conf:
+        if conf["frames"] == "all":
+            bc = glob.baseClass
+            frames = list(range(bc.bvh.frameCount)) if bc is not None and bc.bvh is not None else [None]
+        else:
+            frames = conf["frames"]
+
+    jobs = createRenderJobs(conf["output"], width, height, angles, frames, models)
+    loaded = [None]
+
+    def prepare(job):
+        bc = glob.baseClass
+        if job.model is not None and job.model != loaded[0]:
+            view.noGLObjects(leavebase=True)
+            glob.textureRepo.cleanup()
+            bc.reset()
+            bc.baseMesh.initMaterial()
+            bc.loadMHMFile(job.model)
+            view.setCameraCenter()
+            view.addAssets()
+            view.newSkin(bc.baseMesh)
+            view.scene.prepareSkeleton()
+            view.scene.newFloorPosition()
+            loaded[0] = job.model
+            if job.frame is not None and bc.bvh is not None:
+                bc.setPoseMode()
+
+        if job.frame is not None and bc.bvh is not None and job.frame < bc.bvh.frameCount:
+            bc.bvh.currentFrame = job.frame
+            bc.showPose()
+        view.setYRotation(float(job.angle))
+
+    def progress(num, job):
+        env.logLine(1, "Rendered " + str(num) + "/" + str(len(jobs)) + ": " + job.filename + " (" + str(round(job.time, 3)) + " sec)")
+
+    if glob.baseClass is not None and glob.baseClass.bvh is not None and frames[0] is not None:
+        glob.baseClass.setPoseMode()
+
+    rqueue = RenderQueue(glob, view, conf["transparent"] if "transparent" in conf else False, prepare, progress)
+    written = rqueue.run(jobs)
+    for job in rqueue.failed:
+        env.logLine(1, "Render error: " + str(job) + ": " + str(job.error))
+    return written
+
 class RendererValues():
     """
     class to keep the values, when called again
@@ -30,6 +125,8 @@ class RendererValues():
         self.imwidth  = 1000
         self.imheight = 1000
         self.angle = 0
+        self.steps = 1
+        self.allframes = False
 
 class Renderer(QVBoxLayout):
     """
@@ -116,6 +213,21 @@ class Renderer(QVBoxLayout):
         self.angSlider.setSliderValue(self.values.angle)
         self.addWidget(self.angSlider)
 
+        glayout = QGridLayout()
+        glayout.addWidget(QLabel("Image sequence (background modes):"), 0, 0, 1, 2)
+        glayout.addWidget(QLabel("Turntable steps"), 1, 0)
+        self.steps = QLineEdit()
+        self.steps.editingFinished.connect(self.acceptSteps)
+        glayout.addWidget(self.steps, 1, 1)
+        self.allFrames = QCheckBox("all animation frames")
+        self.allFrames.setLayoutDirection(Qt.LeftToRight)
+        self.allFrames.toggled.connect(self.changeAllFrames)
+        glayout.addWidget(self.allFrames, 2, 0, 1, 2)
+        self.seqbutton = QPushButton("Render sequence")
+        self.seqbutton.clicked.connect(self.renderSequence)
+        glayout.addWidget(self.seqbutton, 3, 0, 1, 2)
+        self.addLayout(glayout)
+
         self.subdivbutton = QPushButton("Smooth (subdivided)")
         self.subdivbutton.clicked.connect(self.toggleSmooth)
         self.subdivbutton.setCheckable(True)
@@ -224,6 +336,10 @@ class Renderer(QVBoxLayout):
 
     def changeRenderMode(self, param):
         self.values.rendermode = param
+        self.seqbutton.setEnabled(param != 0)
+
+    def changeAllFrames(self, param):
+        self.values.allframes = param
 
     def changePosed(self, param):
         self.setUnsubdivided()
@@ -243,6 +359,9 @@ class Renderer(QVBoxLayout):
         self.width.setText(str(self.values.imwidth))
         self.height.setText(str(self.values.imheight))
         self.showAfter.setChecked(self.values.showafter)
+        self.steps.setText(str(self.values.steps))
+        self.seqbutton.setEnabled(self.values.rendermode != 0)
+        self.allFrames.setChecked(self.values.allframes)
 
         self.corrAnim.blockSignals(True)    # avoid these buttons to change
         self.corrAnim.setChecked(self.values.doCorrections)
@@ -258,6 +377,9 @@ class Renderer(QVBoxLayout):
 
             if frames > 1:
                 self.frameSlider.setEnabled(self.values.posed)
+            self.allFrames.setEnabled(frames > 1 and self.values.posed)
+        else:
+            self.allFrames.setEnabled(False)
 
 
     def acceptIntegers(self):
@@ -278,6 +400,15 @@ class Renderer(QVBoxLayout):
         else:
             self.values.imheight = i
 
+    def acceptSteps(self):
+        try:
+            i = int(self.steps.text())
+        except ValueError:
+            i = 1
+        i = min(max(i, 1), 360)
+        self.steps.setText(str(i))
+        self.values.steps = i
+
     def changeCorr(self):
         self.setUnsubdivided()
         self.values.doCorrections = self.corrAnim.isChecked()
@@ -416,6 +547,49 @@ class Renderer(QVBoxLayout):
         if self.values.showafter:
             self.viewImage()
 
+    def renderSequence(self):
+        """
+        render turntable and/or animation frames as an image sequence (name_0000.png ...)
+        """
+        directory = os.path.join(self.env.stdUserPath(), "render")
+        freq = MHFileRequest(self.glob, "Image sequence (PNG)", "image files (*.png)", directory, save=".png")
+        basename = freq.request()
+        if basename is None:
+            return
+
+        width  = int(self.width.text())
+        height = int(self.height.text())
+        steps = self.values.steps
+        angles = [self.values.angle + n * 360.0 / steps for n in range(steps)]
+
+        frames = [None]
+        posed, numframes = self.bc.hasPoses()
+        if self.values.allframes and self.values.posed and numframes > 1:
+            frames = list(range(numframes))
+        oldframe = self.bvh.currentFrame if self.bvh is not None else 0
+
+        jobs = createRenderJobs(basename, width, height, angles, frames)
+        prog_window = MHProgWindow("Render sequence", len(jobs))
+
+        def prepare(job):
+            if job.frame is not None:
+                self.bvh.currentFrame = job.frame
+                self.bc.showPose()
+            self.view.setYRotation(float(job.angle))
+
+        def progress(num, job):
+            prog_window.setValueAndText(num, "Rendered " + job.filename)
+
+        rqueue = RenderQueue(self.glob, self.view, self.values.rendermode == 2, prepare, progress)
+        written = rqueue.run(jobs)
+        prog_window.progress.close()
+
+        if frames[0] is not None:
+            self.setFrame(oldframe)
+        self.view.setYRotation(float(self.values.angle))
+        self.view.Tweak()
+        HintBox(self.parent.central_widget, str(written) + " of " + str(len(jobs)) + " images saved as " + jobs[0].filename + " ...")
+
     def viewImage(self):
         self.lastimgview = ImageBox(self.parent, "Viewer", self.image, color=self.view.light.glclearcolor)
 
@@ -173,7 +173,7 @@ class MHMemWindow(QWidget):
         # textures
         #
         table = MHQTableView(self, "textures")
-        table.addModel(self.refreshTextureTable, ["#", "Name", "Width", "Height"])
+        table.addModel(self.refreshTextureTable, ["#", "Name", "Width", "Height", "MB"])
         tab.addTab(table, "Textures")
         self.tables.append(table)
 
@@ -257,7 +257,7 @@ class MHMemWindow(QWidget):
         t = self.glob.textureRepo.getTextures()
         if len(t) > 0:
             for texture in t:
-                data.append([t[texture][1], texture, t[texture][0].width(), t[texture][0].height()])
+                data.append([t[texture][1], texture, t[texture][0].width(), t[texture][0].height(), round(t[texture][5] / 1048576, 2)])
         else:
             data = [["no textures loaded"]]
         return (data)
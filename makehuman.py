@@ -46,6 +46,10 @@ def main():
         missing entries or when user space was moved to a new location. The manually
         entered data (new tags for categorization) is not deleted.'''))
     parser.add_argument("-A", '--admin', action="store_true", help="Support administrative tasks ('Admin'). Command will write into program folder, where makehuman is installed.")
+    parser.add_argument("--render", type=str, help=textwrap.dedent('''\
+        render images described in a JSON job file and exit (turntables, animation frames, several models).
+        On servers without display use QT_QPA_PLATFORM=offscreen, with LIBGL_ALWAYS_SOFTWARE=1
+        Mesa llvmpipe is used for rendering.'''))
     parser.add_argument("-v", "--verbose",  type=int, default = 1, help= textwrap.dedent('''\
             bitwise verbose option (add values)
             1 low log level (default)
@@ -98,6 +102,12 @@ def main():
     theme = env.existDataFile("themes", env.config["theme"])
     QDir.setSearchPaths("themes", [env.path_userdata + "/themes"])
 
+    # headless rendering on linux without display
+    #
+    if args.render and sys.platform.startswith("linux") and not (os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY")):
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        os.environ.setdefault("LIBGL_ALWAYS_SOFTWARE", "1")
+
     app = MHApplication(glob, sys.argv)
     glob.setApplication(app)
 
@@ -151,6 +161,20 @@ def main():
     # all we need from openGL is now existent (get initial values)
     #
     mainwin.initParams()
+
+    if args.render:
+        from gui.renderer import renderJobFile
+        app.processEvents(QEventLoop.AllEvents)
+        if glob.baseClass is None:
+            print("Cannot render with undefined base mesh")
+            sys.exit(25)
+        written = renderJobFile(glob, args.render)
+        if written < 0:
+            print (env.last_error)
+            sys.exit(25)
+        print (str(written) + " images rendered")
+        sys.exit(0)
+
     app.exec()
     
 
@@ -8,11 +8,58 @@
     * MHPose
     * MHPoseFaceConverter
     * PosePrims
+
+    Functions:
+    * compileRotations
+    * blendTensor
 """
 import numpy as np
 import core.math as mquat
 import math
 
+def compileRotations(posemats):
+    """
+    convert dictionaries of pose matrices to one quaternion tensor, bones not mentioned are at rest
+
+    :param posemats: list of dictionaries bone: 3x3 rotation matrix
+    :return: bones, quaternions (posemats x bones x 4), used (posemats x bones)
+    """
+    bones = []
+    index = {}
+    for posemat in posemats:
+        for bone in posemat:
+            if bone not in index:
+                index[bone] = len(bones)
+                bones.append(bone)
+
+    quats = np.zeros((len(posemats), len(bones), 4), dtype=np.float32)
+    quats[:,:,0] = 1.0
+    used = np.zeros((len(posemats), len(bones)), dtype=bool)
+    for row, posemat in enumerate(posemats):
+        if len(posemat) > 0:
+            columns = [index[bone] for bone in posemat]
+            quats[row, columns] = mquat.quaternionsFromMatrices(np.stack(list(posemat.values())))
+            used[row, columns] = True
+    return bones, quats, used
+
+def blendTensor(blends, units=None):
+    """
+    collect the rotations of blends as quaternion tensor, the precompiled tensor of
+    the units is used, when all pose matrices belong to them
+
+    :param blends: list of [posemat, value], value in percent
+    :param units: PosePrims or None
+    :return: bones, quaternions (blends x bones x 4), used (blends x bones), fractions (blends)
+    """
+    fractions = np.array([blend[1] / 100 for blend in blends], dtype=np.float64)
+    if units is not None and units.rotrows is not None:
+        rows = [units.rotrows.get(id(blend[0])) for blend in blends]
+        if None not in rows and all(units.rotmats[r] is blend[0] for r, blend in zip(rows, blends)):
+            return units.rotbones, units.rotations[rows], units.rotused[rows], fractions
+
+    bones, quats, used = compileRotations([blend[0] for blend in blends])
+    return bones, quats, used, fractions
+
 class BVHJoint():
     def __init__(self, name):
         self.name = name
@@ -265,42 +312,67 @@ class BVH():
 
     def calcLocRotMat(self, frame, data):
         """
-        calculation is done once after loading the file
-        it is always order yzx since it only works for z_up (and order is already sorted)
+        calculation for one frame, see calcLocRotMats
 
         :param frame: frame number
         :param data:  array of bvh data
         """
+        self.calcLocRotMats(np.asarray([data], dtype=np.float64), frame)
+
+    def calcLocRotMats(self, data, start=0):
+        """
+        calculation is done once after loading the file for all frames
+        it is always order yzx since it only works for z_up (and order is already sorted)
+
+        :param data: array of bvh data (frames, channels)
+        :param start: number of first frame
+        """
+        frames = np.s_[start:start+len(data)]
         i = 0
         for joint in self.bvhJointOrder:
             if joint.nChannels > 0:
                 for j, m in enumerate(joint.channelorder):
                     if m>=0:
-                        r = data[i+m]
-                        if -0.0001 < r < 0.0001:
-                            r = 0.0
-                        joint.animdata[frame, j ] = r
+                        r = data[:,i+m]
+                        joint.animdata[frames, j ] = np.where((-0.0001 < r) & (r < 0.0001), 0.0, r)
                 i += joint.nChannels
-                x = self.pi_mult * joint.animdata[frame, 3]
+
+                # angles are multiplied in precision of animdata
                 #
+                animdata = joint.animdata[frames]
+                x = (self.pi_mult * animdata[:,3]).astype(np.float64)
                 if self.z_up:
-                    y = -self.pi_mult * joint.animdata[frame, 4]
+                    y = (-self.pi_mult * animdata[:,4]).astype(np.float64)
                 else:
-                    y = self.pi_mult * joint.animdata[frame, 4]
-                z = self.pi_mult * joint.animdata[frame, 5]
+                    y = (self.pi_mult * animdata[:,4]).astype(np.float64)
+                z = (self.pi_mult * animdata[:,5]).astype(np.float64)
 
-                joint.matrixPoses[frame,:3,:3] = mquat.eulerMatrix(z, y, x, self.rotationorder)[:3,:3]
+                joint.matrixPoses[frames,:3,:3] = mquat.eulerMatrices(z, y, x, self.rotationorder)[:,:3,:3]
                 #
                 if joint.parent is None or self.dislocation:
-                    joint.matrixPoses[frame,:3,3] = [joint.animdata[frame, 0], joint.animdata[frame, 2], joint.animdata[frame, 1]]
+                    joint.matrixPoses[frames,:3,3] = animdata[:, [0, 2, 1]]
 
     def poseToAnimdata(self, matrixPose):
         """
         calculate corrected animdata for Blender output from matrixPose (finalPose)
         """
-        animdata = np.zeros(6, dtype=np.float32)
-        x, y, z = mquat.eulerMatrixYZXToDegrees(matrixPose[:3,:3])
-        animdata[:] = [matrixPose[0,3],matrixPose[2,3], matrixPose[1,3], z, -y, x]
+        return self.posesToAnimdata(np.asarray(matrixPose)[None])[0]
+
+    def posesToAnimdata(self, matrixPoses):
+        """
+        calculate corrected animdata for all frames (vectorized poseToAnimdata)
+
+        :param matrixPoses: array (frames, 3, 4)
+        :return: animdata (frames, 6)
+        """
+        animdata = np.zeros((len(matrixPoses), 6), dtype=np.float32)
+        x, y, z = mquat.eulerMatricesToRadians(matrixPoses[:,:3,:3], 1, 2, 0)
+        animdata[:,0] = matrixPoses[:,0,3]
+        animdata[:,1] = matrixPoses[:,2,3]
+        animdata[:,2] = matrixPoses[:,1,3]
+        animdata[:,3] = np.degrees(z)
+        animdata[:,4] = -np.degrees(y)
+        animdata[:,5] = np.degrees(x)
         return animdata
 
     def noFaceAnimation(self):
@@ -339,7 +411,7 @@ class BVH():
         #if pos is not None:
         #    self.skeleton.setOffset(pos)
         corrections = {}
-        changed = self.skeleton.posebyBlends(mhpose.blends, None)
+        changed = self.skeleton.posebyBlends(mhpose.blends, None, units=mhpose.prims)
 
         if len(changed) > 0:
             for bone in changed:
@@ -428,12 +500,12 @@ class BVH():
 
             self.initFrames()
 
-            for i in range(self.frameCount):
-                words = fp.readline().split()
-                data = [float(word) for word in words]
-                self.calcLocRotMat(i, data)
+            if self.frameCount > 0:
+                data = np.array([fp.readline().split() for i in range(self.frameCount)], dtype=np.float64)
+                self.calcLocRotMats(data)
                 if self.env.verbose & 32:
-                    self.debugChanged(i)
+                    for i in range(self.frameCount):
+                        self.debugChanged(i)
 
         # make a copy of the pointers
         self.identFinal()
@@ -452,6 +524,7 @@ class MHPose():
         self.author =""
         self.filename = None
         self.units = units.units
+        self.prims = units
         self.blends = []
         self.tags = []
         self.poses = {}
@@ -579,6 +652,11 @@ class PosePrims():
         self.filterparam = None
         self.groups   = []
         self.bonemask = []
+        self.rotbones = None    # bones of the quaternion tensor
+        self.rotations = None   # quaternion tensor (units x bones x 4), bones and reverse are different units
+        self.rotused = None     # bones used by a unit (units x bones)
+        self.rotmats = None     # pose matrices per row
+        self.rotrows = None     # row of a pose matrix dictionary (by id)
 
     def __str__(self):
         return str(self.units.keys())
@@ -626,5 +704,19 @@ class PosePrims():
                     g[bone] = np.asarray(g[bone], dtype=np.float32).reshape(3,3)
 
         self.units = prims
+        self.compileUnits()
         return True, "Okay"
 
+    def compileUnits(self):
+        """
+        precompile the pose matrices of all units to a quaternion tensor
+        """
+        self.rotmats = []
+        for val in self.units.values():
+            for key in ("bones", "reverse"):
+                if key in val:
+                    self.rotmats.append(val[key])
+
+        self.rotbones, self.rotations, self.rotused = compileRotations(self.rotmats)
+        self.rotrows = {id(posemat): row for row, posemat in enumerate(self.rotmats)}
+
@@ -7,6 +7,8 @@
     * boneWeights
 """
 
+import hashlib
+from collections import OrderedDict
 import numpy as np
 import core.math as mquat
 
@@ -223,6 +225,26 @@ class cBone():
             # No translation
             self.matPoseLocal[:3,3] = [0, 0, 0]
 
+    def calcLocalPoseMats(self, poseMats):
+        """
+        stacked version of calcLocalPoseMat for a number of frames, bone itself is not changed
+
+        :param poseMats: array (frames, 3, 4) of pose matrices
+        :return: array (frames, 4, 4) of relative pose matrices
+        """
+        mats = np.zeros((len(poseMats), 4, 4), dtype=np.float32)
+        mats[:,:3,:3] = poseMats[:,:3,:3]
+        mats[:,3,3] = 1.0
+        mats = np.matmul(np.matmul(self.invRestGlobal, mats), self.matRestGlobal)
+
+        # translations described in bone-local axis directions
+        #
+        if poseMats.shape[2] == 4:
+            mats[:,:3,3] = np.matmul(poseMats[:,:3,3], self.invRestGlobal[:3,:3].T)
+        else:
+            mats[:,:3,3] = 0.0
+        return mats
+
     def calcGlobalPoseMat(self):
         if self.parent:
             self.matPoseGlobal = np.dot(self.parent.matPoseGlobal, np.dot(self.matRestLocal, self.matPoseLocal))
@@ -244,6 +266,12 @@ class cBone():
 
 
 class boneWeights():
+
+    # number of cached asset weights (per base weights) and of transferred weights (per weights), least recently used are dropped
+    #
+    maxAssets = 32
+    maxTransfers = 4
+
     def __init__(self, glob, default_skeleton, mesh):
         self.glob = glob
         self.env  = glob.env
@@ -251,69 +279,78 @@ class boneWeights():
         self.root = default_skeleton.root
         self.bWeights = {}
         self.mesh = mesh
+        self.digest = None          # content hash of weights, see fingerprint
+        self.assetCache = OrderedDict()     # weights of assets calculated from these weights, key is hash of asset references
+        self.sourcekey = None               # fingerprint of weights used by approxWeights
+        self.transferCache = OrderedDict()  # weights transferred to custom skeletons, key is hash of skeleton (skeletonKey)
 
     def debug(self, text):
         self.env.logLine(2, "boneWeights: " +  text)
 
     def createWeightsPerBone(self, wdict):
+        """
+        create weights from a dictionary bone: [(vertex, weight), ...] (e.g. weight files)
+        """
+        bones = [bone for bone, g in wdict.items() if len(g) > 0]
+        pairs = [np.asarray(wdict[bone], dtype=np.float64).reshape(-1, 2) for bone in bones]
+        if len(pairs) == 0:
+            pairs = [np.zeros((0, 2), dtype=np.float64)]
+        lengths = [len(p) for p in pairs]
+        pairs = np.concatenate(pairs)
+        bidx = np.repeat(np.arange(len(lengths)), lengths)
+        self.setWeights(bones, bidx, pairs[:,0].astype(np.int64), pairs[:,1].astype(np.float32))
+
+    def setWeights(self, bones, bidx, verts, weights):
+        """
+        create bWeights from weights in coordinate form (one entry per bone, vertex and weight).
+        weights are normalized per vertex, values under the threshold are filtered out, unweighted
+        vertices are assigned to root bone and multiple entries of the same vertex are summed up
+
+        :param bones: list of bone names
+        :param bidx: array with index of bone (in bones) per entry
+        :param verts: array with vertex number per entry
+        :param weights: array with weight per entry
+        """
         cnt = self.mesh.n_origverts
+        self.digest = None
+        self.transferCache = OrderedDict()
+        self.bWeights = {}
 
         # calculate sums to normalize weights
         #
-        wtot = np.zeros(cnt, np.float32)
-
-        for bone, g in wdict.items():
-            for item in g:
-                vn,w = item
-                wtot[vn] += w
+        wtot = np.bincount(verts, weights=weights, minlength=cnt).astype(np.float32)
+        weights = weights.astype(np.float32) / wtot[verts]
 
-        # calculate weights
+        # Filter out weights under the threshold
         #
-        for bone, g in wdict.items():
-            if len(g) == 0:
-                continue
-            verts = []
-            weights = []
-            for vn, w in g:
-                verts.append(vn)
-                weights.append(w / wtot[vn])
-            verts = np.asarray(verts, dtype=np.uint32)
-            weights = np.asarray(weights, np.float32)
-
-            # Sort by vertex index
-            #
-            i_s = np.argsort(verts)
-            verts = verts[i_s]
-            weights = weights[i_s]
-
-            # Filter out weights under the threshold
-            #
-            i_s = np.argwhere(weights > 1e-4)[:,0]
-            verts = verts[i_s]
-            weights = weights[i_s]
-            self.bWeights[bone] = (verts, weights)
+        keep = weights > 1e-4
+        bidx = bidx[keep]
+        verts = verts[keep]
+        weights = weights[keep]
 
         # assign rest to root bone
         #
-        if self.root not in self.bWeights:
-            vs = []
-            ws = []
-        else:
-            vs,ws = self.bWeights[self.root]
-            vs = list(vs)
-            ws = list(ws)
-
-        rw_i = np.argwhere(wtot == 0.0)[:,0]
-        vs.extend(rw_i)
-        ws.extend(np.ones(len(rw_i), dtype=np.float32))
-
+        rw_i = np.flatnonzero(wtot[:cnt] == 0.0)
         if len(rw_i) > 0:
             # get first 20 as an example if any
-            text = ', '.join([str(s) for s in rw_i][:20])
+            text = ', '.join([str(s) for s in rw_i[:20]])
             self.debug("Unweighted vertices assigned to:" + self.root + " " +  text)
 
-        if len(vs) > 0:
-            self.bWeights[self.root] = (np.asarray(vs, dtype=np.uint32), np.asarray(ws, dtype=np.float32))
+            if self.root not in bones:
+                bones = bones + [self.root]
+            bidx = np.concatenate((bidx, np.full(len(rw_i), bones.index(self.root))))
+            verts = np.concatenate((verts, rw_i))
+            weights = np.concatenate((weights, np.ones(len(rw_i), dtype=np.float32)))
+
+        # sort by bone and vertex index, duplicates are summed up
+        #
+        stride = max(cnt, int(verts.max()) + 1 if len(verts) > 0 else 0)
+        keys, inv = np.unique(bidx.astype(np.int64) * stride + verts, return_inverse=True)
+        sums = np.bincount(inv, weights=weights).astype(np.float32)
+        uverts = (keys % stride).astype(np.uint32)
+        bounds = np.searchsorted(keys // stride, np.arange(len(bones) + 1))
+        for i, bone in enumerate(bones):
+            self.bWeights[bone] = (uverts[bounds[i]:bounds[i+1]], sums[bounds[i]:bounds[i+1]])
 
     def sortWeights(self, weights):
         """
@@ -330,83 +367,183 @@ class boneWeights():
 
     def deDuplicateWeights(self, weights):
         """
-        weight arrays must be sorted
         for assets weights are calculated using 3 values from the base mesh, this means that values are used multiple times
         the skinning algorithm expects them once. This procedure is doing that by using np.unique to get occurences
+        and np.bincount to sum up the weights
         """
 
         for bone in weights:
             v, w = weights[bone]
-            m, ind = np.unique(v, return_index=True)
-            m, cnt = np.unique(v, return_counts=True)
-
-            # in m values, in ind positions to get initial weights from, in cnt count how many others to add
-            # we now can organize the new weights array and then set or add the values
-            #
-            sumweights = np.zeros(len(m), dtype=np.float32)
-            i = 0
-            for x in m:
-                pos = ind[i]
-                sumw = w[pos]
-                for l in range(1,cnt[i]):
-                    sumw +=  w[pos+l]
-                sumweights[i] = sumw
-                i+=1
-            weights[bone] = (m, sumweights)
+            m, inv = np.unique(v, return_inverse=True)
+            weights[bone] = (m, np.bincount(inv, weights=w, minlength=len(m)).astype(np.float32))
 
         return weights
 
+    def fingerprint(self):
+        """
+        content hash of the weights, used as key for weights of assets calculated from these weights
+        """
+        if self.digest is None:
+            h = hashlib.blake2b(digest_size=16)
+            h.update(self.root.encode("utf-8"))
+            for bone, (v, w) in self.bWeights.items():
+                h.update(bone.encode("utf-8"))
+                h.update(np.ascontiguousarray(v, dtype=np.uint32).tobytes())
+                h.update(np.ascontiguousarray(w, dtype=np.float32).tobytes())
+            self.digest = h.hexdigest()
+        return self.digest
+
+    def packWeights(self, key):
+        """
+        weights in a form to be saved in a binary file (bone names, counts, vertices, weights)
+
+        :param key: key of the weights used for calculation
+        :return: dictionary with arrays
+        """
+        bones = list(self.bWeights.keys())
+        content = {}
+        content["bw_key"] = np.array([key], dtype="|S" + str(len(key)))
+        content["bw_bones"] = np.array(bones, dtype="|S" + str(max([len(b) for b in bones], default=1)))
+        content["bw_counts"] = np.array([len(self.bWeights[b][0]) for b in bones], dtype=np.int32)
+        if len(bones) > 0:
+            content["bw_verts"] = np.concatenate([self.bWeights[b][0] for b in bones]).astype(np.uint32)
+            content["bw_weights"] = np.concatenate([self.bWeights[b][1] for b in bones]).astype(np.float32)
+        else:
+            content["bw_verts"] = np.zeros(0, dtype=np.uint32)
+            content["bw_weights"] = np.zeros(0, dtype=np.float32)
+        return content
+
+    def unpackWeights(self, content, key):
+        """
+        set weights from arrays created by packWeights, if calculated with the same key
+
+        :param content: dictionary or npz-file with arrays
+        :param key: key of the weights used for calculation
+        :return: True if weights are used
+        """
+        if content is None or "bw_key" not in content or content["bw_key"][0].decode("utf-8") != key:
+            return False
+        bounds = np.concatenate(([0], np.cumsum(content["bw_counts"])))
+        verts = content["bw_verts"]
+        weights = content["bw_weights"]
+        self.transferCache = OrderedDict()
+        self.bWeights = {}
+        for i, bone in enumerate(content["bw_bones"]):
+            self.bWeights[bone.decode("utf-8")] = (verts[bounds[i]:bounds[i+1]], weights[bounds[i]:bounds[i+1]])
+        return True
 
     def approxWeights(self, asset, base):
+        """
+        create bone weights for an asset from weights of the base mesh. This is a sparse matrix product
+        (asset reference weights x base vertex-bone weights) done in coordinate form, the products are then
+        normalized by setWeights. Results are cached per base weights, keyed by a hash of the asset references
+        (shared with the weights transferred to custom skeletons), in the binary file the key of the
+        base weights is saved as well
+
+        :param asset: attached asset with ref_vIdxs and weights
+        :param base: boneWeights of the base mesh
+        """
+        key = base.fingerprint()
+        self.sourcekey = key
+        if self.unpackWeights(asset.cachedWeights, key):
+            self.debug("Use weights saved in binary for " + asset.name)
+            base.cacheAsset(self.assetKey(asset), self)
+            return
+
+        akey = self.assetKey(asset)
+        if akey in base.assetCache:
+            base.assetCache.move_to_end(akey)
+            (weights, self.transferCache) = base.assetCache[akey]
+            self.bWeights = dict(weights)
+            return
+
+        # reference entries (asset vertex, base vertex, weight) sorted by base vertex
         #
-        # create bone weights from base
-
-        # recalculate the input in case of mesh loaded in binary form for easier calculation (tested)
-        # form is:
-        # vertex_num: baseskeleton: [(vertexnum_asset, weight), (...) ]
-
-        self.vertWeights = {}
-        for idx in range(asset.ref_vIdxs.shape[0]):
-            for l in range(0,3):
-                base_vert, w = asset.ref_vIdxs[idx, l], asset.weights[idx, l]
-                if base_vert in self.vertWeights:
-                    self.vertWeights[base_vert].append((idx, w))
-                else:
-                    self.vertWeights[base_vert] = [(idx, w)]
+        rverts = asset.ref_vIdxs.ravel()
+        order = np.argsort(rverts, kind="stable")
+        rverts = rverts[order]
+        rasset = order // asset.ref_vIdxs.shape[1]
+        rweights = asset.weights.ravel()[order]
 
-        # now generate the weights to be calculated by createWeightsPerBone
+        # base entries (bone, base vertex, weight)
         #
-        weights = {}
-        for bname, (indxs, wghts) in list(base.bWeights.items()):
-            vgroup = []
-            for (base_vert,wt) in zip(indxs, wghts):
-                if base_vert in self.vertWeights:
-                    vlist = self.vertWeights[base_vert]
-                    for (pv, w) in vlist:
-                        pw = w*wt
-                        if (pw > 1e-4):
-                            vgroup.append((pv, pw))
-
-            if len(vgroup) > 0:
-                weights[bname] = vgroup
-        self.createWeightsPerBone (weights)
-
-        # since the algorithm above also creates multiple values for one index it must be changed to unique
+        bones = list(base.bWeights.keys())
+        lengths = [len(base.bWeights[b][0]) for b in bones]
+        if sum(lengths) > 0:
+            bverts = np.concatenate([base.bWeights[b][0] for b in bones])
+            bweights = np.concatenate([base.bWeights[b][1] for b in bones])
+        else:
+            bverts = np.zeros(0, dtype=np.uint32)
+            bweights = np.zeros(0, dtype=np.float32)
+        bbones = np.repeat(np.arange(len(bones)), lengths)
+
+        # join both on base vertex, each base entry gets all references to its vertex
+        #
+        first = np.searchsorted(rverts, bverts, side="left")
+        counts = np.searchsorted(rverts, bverts, side="right") - first
+        entries = np.repeat(np.arange(len(bverts)), counts)
+        refs = np.arange(len(entries)) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(first, counts)
+
+        products = rweights[refs] * bweights[entries]
+        keep = products > 1e-4
+        entries = entries[keep]
+        products = products[keep]
+        verts = rasset[refs[keep]].astype(np.int64)
+
+        # only bones with weights are used
         #
-        self.bWeights = self.deDuplicateWeights(self.bWeights)
+        used, bidx = np.unique(bbones[entries], return_inverse=True)
+        self.setWeights([bones[i] for i in used], bidx, verts, products)
+        base.cacheAsset(akey, self)
 
-    def transferWeights(self, customskeleton):
+    def cacheAsset(self, akey, weights):
+        """
+        keep weights of an asset calculated from these weights (the transfer cache is shared)
 
-        # in case skeleton is default skeleton, do nothing
-        #
-        if customskeleton is self.default_skeleton:
-            self.debug("No transfer of weights needed, default skeleton")
-            return self.bWeights
+        :param str akey: hash of asset references, see assetKey
+        :param weights: boneWeights of the asset
+        """
+        self.assetCache[akey] = (dict(weights.bWeights), weights.transferCache)
+        self.assetCache.move_to_end(akey)
+        while len(self.assetCache) > self.maxAssets:
+            self.assetCache.popitem(last=False)
 
-        weights = {}    # new weights
+    def assetKey(self, asset):
+        """
+        content hash of the reference vertices and weights of an asset
+        """
+        h = hashlib.blake2b(digest_size=16)
+        h.update(np.ascontiguousarray(asset.ref_vIdxs, dtype=np.uint32).tobytes())
+        h.update(np.ascontiguousarray(asset.weights, dtype=np.float32).tobytes())
+        return h.hexdigest()
+
+    def skeletonKey(self, customskeleton):
+        """
+        hash of the bone hierarchy and the references of a custom skeleton, used as key of transferred weights
+        """
+        h = hashlib.blake2b(digest_size=16)
+        for bone, b in customskeleton.bones.items():
+            h.update(repr((bone, b.parentname, b.reference, b.weightref)).encode("utf-8"))
+        return h.hexdigest()
+
+    def transferMapping(self, customskeleton):
+        """
+        compile the references of a custom skeleton (weightref, reference and parent chain of
+        unreferenced bones) to a sparse aggregation matrix default bones x custom bones
+
+        :param customskeleton: custom skeleton
+        :return: list of custom bones, dictionary default bone: list of indices of custom bones
+        """
+        bones = []      # custom bones receiving weights in order of creation
+        targets = {}    # default bone: indices of custom bones
         bonesref = {}   # contains all bones referenced by custom skeleton
 
-        self.debug("Transfer weights from " + self.default_skeleton.name + " to " + customskeleton.name)
+        def addGroup(bone, bonegroup):
+            if len(bonegroup) > 0:
+                if bone not in bones:
+                    bones.append(bone)
+                for elem in bonegroup:
+                    targets.setdefault(elem, []).append(bones.index(bone))
 
         for bone, b in customskeleton.bones.items():
 
@@ -426,35 +563,18 @@ class boneWeights():
             # it is possible to define the same name for another bone
             # but in this case reference must have 0 elements
             #
-
             if bone in self.bWeights and len(b.reference) == 0:
                 if b.weightref is not None and len(b.weightref) > 0:
-                    bonegroup = []
-                    for  elem in b.weightref:
-                        if elem in  self.bWeights:
-                            bonegroup.append(elem)
-                    if len(bonegroup) > 0:
-                        vn =  np.concatenate((tuple(self.bWeights[elem][0] for elem in bonegroup)), axis=0)
-                        w  =  np.concatenate((tuple(self.bWeights[elem][1] for elem in bonegroup)), axis=0)
-                        weights[bone] = (vn, w)
+                    addGroup(bone, [elem for elem in b.weightref if elem in self.bWeights])
                 else:
-                    weights[bone] = self.bWeights[bone]
-
+                    addGroup(bone, [bone])
             else:
-                # print (b.name, b.reference) # array
-                bonegroup = []
-                for  elem in b.reference:
-                    if elem in  self.bWeights:
-                        bonegroup.append(elem)
-
+                bonegroup = [elem for elem in b.reference if elem in self.bWeights]
                 if b.weightref is not None and len(b.weightref) > 0:
                     for  elem in b.weightref:
                         if elem in  self.bWeights and elem not in bonegroup:
                             bonegroup.append(elem)
-                if len(bonegroup) > 0:
-                    vn =  np.concatenate((tuple(self.bWeights[elem][0] for elem in bonegroup)), axis=0)
-                    w  =  np.concatenate((tuple(self.bWeights[elem][1] for elem in bonegroup)), axis=0)
-                    weights[bone] = (vn, w)
+                addGroup(bone, bonegroup)
 
         # distribute missing vertices
         #
@@ -465,24 +585,78 @@ class boneWeights():
                     nbone = nbone.parent
                     if nbone.name in bonesref:
                         dest = bonesref[nbone.name]
-                        if dest in weights:
-                            self.debug(bone + ": parent chain reference: " + nbone.name + " should be appended to " + dest)
-                            vn =  np.concatenate((self.bWeights[bone][0], weights[dest][0] ), axis=0)
-                            w  =  np.concatenate((self.bWeights[bone][1], weights[dest][1] ), axis=0)
-                        else:
-                            self.debug(bone + ": parent chain reference: " + nbone.name + " should be created as " + dest)
-                            vn =  self.bWeights[bone][0]
-                            w  =  self.bWeights[bone][1]
-
-                        weights[dest] = (vn, w)
+                        self.debug(bone + ": parent chain reference: " + nbone.name + " is added to " + dest)
+                        addGroup(dest, [bone])
                         break
             else:
                 self.debug(bone + ": " + bonesref[bone])
 
-        weights = self.sortWeights(weights)
-        weights = self.deDuplicateWeights(weights)
+        return bones, targets
 
-        return weights
+    def transferWeights(self, customskeleton):
+        """
+        transfer weights to a custom skeleton. The weights (vertex x default bones) are multiplied with
+        the aggregation matrix of transferMapping, result is cached per hash of the custom skeleton
+
+        :param customskeleton: custom skeleton
+        :return: dictionary bone: (vertices, weights)
+        """
+
+        # in case skeleton is default skeleton, do nothing
+        #
+        if customskeleton is self.default_skeleton:
+            self.debug("No transfer of weights needed, default skeleton")
+            return self.bWeights
+
+        skey = self.skeletonKey(customskeleton)
+        if skey in self.transferCache:
+            self.transferCache.move_to_end(skey)
+            return dict(self.transferCache[skey])
+
+        self.debug("Transfer weights from " + self.default_skeleton.name + " to " + customskeleton.name)
+        bones, targets = self.transferMapping(customskeleton)
+
+        # weights in coordinate form, per entry index of default bone
+        #
+        names = list(self.bWeights.keys())
+        lengths = [len(self.bWeights[b][0]) for b in names]
+        if sum(lengths) > 0:
+            verts = np.concatenate([self.bWeights[b][0] for b in names]).astype(np.int64)
+            weights = np.concatenate([self.bWeights[b][1] for b in names]).astype(np.float32)
+        else:
+            verts = np.zeros(0, dtype=np.int64)
+            weights = np.zeros(0, dtype=np.float32)
+        bidx = np.repeat(np.arange(len(names)), lengths)
+
+        # aggregation matrix in compressed row form (row = default bone, columns = custom bones)
+        #
+        rows = [targets.get(b, []) for b in names]
+        rowlen = np.array([len(r) for r in rows], dtype=np.int64)
+        rowstart = np.cumsum(rowlen) - rowlen
+        columns = np.array([c for r in rows for c in r], dtype=np.int64)
+
+        # product: each entry is repeated for all custom bones of its default bone
+        #
+        counts = rowlen[bidx]
+        entries = np.repeat(np.arange(len(verts)), counts)
+        offsets = np.arange(len(entries)) - np.repeat(np.cumsum(counts) - counts, counts)
+        cidx = columns[rowstart[bidx[entries]] + offsets]
+
+        # sort by custom bone and vertex index, duplicates are summed up
+        #
+        stride = int(verts.max()) + 1 if len(verts) > 0 else 1
+        keys, inv = np.unique(cidx * stride + verts[entries], return_inverse=True)
+        sums = np.bincount(inv, weights=weights[entries]).astype(np.float32)
+        uverts = (keys % stride).astype(np.uint32)
+        bounds = np.searchsorted(keys // stride, np.arange(len(bones) + 1))
+
+        result = {}
+        for i, bone in enumerate(bones):
+            result[bone] = (uverts[bounds[i]:bounds[i+1]], sums[bounds[i]:bounds[i+1]])
+        self.transferCache[skey] = result
+        while len(self.transferCache) > self.maxTransfers:
+            self.transferCache.popitem(last=False)
+        return dict(result)
 
     def loadJSON(self, path):
         json = self.env.readJSON(path)
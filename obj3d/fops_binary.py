@@ -8,14 +8,19 @@
     * exportObj3dBinary
     * importObjValues
     * importObj3dBinary
+    * contentHash
+    * cacheFileNames
     * importObjFromFile
 """
 
 import numpy as np
 import os
-from obj3d.fops_wavefront import importWaveFront
+import hashlib
+from obj3d.fops_wavefront import importWaveFront, faceLists
 
-def exportObj3dBinary(filename, obj, content = {}):
+def exportObj3dBinary(filename, obj, content = None):
+    if content is None:
+        content = {}
 
     # binary structure
     # first header
@@ -124,15 +129,9 @@ def importObjValues(npzfile, obj):
     for num, elem in enumerate(npzfile["groupinfo"]):
         start = elem[0]
         faces = elem[1]
-        f = []
-        fs = start
-        for i in range(faces):
-            v = []
-            for k in range(0, fsize[j]):
-                v.append(verts[fs+k])
-            f.append(v)
-            fs += fsize[j]
-            j += 1
+        sizes = fsize[j:j+faces]
+        f = faceLists(verts[start:start+sizes.sum()], sizes)
+        j += faces
 
         group =  obj.npGrpNames[num].decode("utf-8")
         groups[group] = { "v": f, "uv": elem[2] }
@@ -150,12 +149,38 @@ def importObjValues(npzfile, obj):
 
 def importObj3dBinary(path, obj):
     obj.env.logLine(8, "Read binary: " + path)
-    npzfile = np.load(path)
-    return(importObjValues(npzfile, obj))
+    with np.load(path) as npzfile:
+        return(importObjValues(npzfile, obj))
+
+def contentHash(path):
+    """
+    hash of file content, used to validate the binary cache of OBJ files
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1048576), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def cacheFileNames(path, digest, env):
+    """
+    cache is written to the user dbcache folder, assets in user space may also use a file next to the OBJ file.
+    System folders are never used (installation could be read-only)
+    """
+    if not hasattr(env, "stdUserPath"):
+        return []
+    userdata = env.stdUserPath()
+    names = [os.path.join(userdata, "dbcache", digest + ".mhcache")]
+    if os.path.abspath(path).startswith(os.path.join(os.path.abspath(userdata), "")):
+        names.append(path[:-3] + "mhcache")
+    return names
 
 def importObjFromFile(path, obj, use_obj=False):
     """
     check if binary file exists
+
+    fallback chain for OBJ files: compiled mhbin, binary cache with identical content hash
+    and at last ASCII (in this case cache is written)
     """
     if use_obj is False:
         if obj.filename.endswith(".mhbin"):
@@ -169,6 +194,35 @@ def importObjFromFile(path, obj, use_obj=False):
             if os.path.isfile(binfile):
                 return importObj3dBinary(binfile, obj)
 
+        if path.endswith(".obj") and os.path.isfile(path):
+            digest = contentHash(path)
+            cachefiles = cacheFileNames(path, digest, obj.env)
+            for cachefile in cachefiles:
+                if os.path.isfile(cachefile):
+                    try:
+                        with np.load(cachefile) as npzfile:
+                            if "hash" in npzfile and str(npzfile["hash"]) == digest:
+                                obj.env.logLine(8, "Read cache: " + cachefile)
+                                res, msg = importObjValues(npzfile, obj)
+
+                                # warnings of the ASCII load are kept
+                                #
+                                if res == 2 and "result" in npzfile and int(npzfile["result"]) == 1:
+                                    res, msg = 1, str(npzfile["message"])
+                                return res, msg
+                    except (OSError, ValueError):
+                        pass
+
+            obj.env.logLine(8, "Load: " + path)
+            res, msg = importWaveFront(path, obj)
+            if res > 0:
+                for cachefile in cachefiles:
+                    success, error = exportObj3dBinary(cachefile, obj, {"hash": np.array(digest),
+                        "result": np.array(res), "message": np.array(msg if msg is not None else "")})
+                    if success:
+                        break
+            return res, msg
+
     # only ASCII
     #
     obj.env.logLine(8, "Load: " + path)
@@ -5,11 +5,67 @@
     file operations, wavefront OBJ
 
     Functions:
+    * faceLists
     * importWaveFront
 """
 
 import numpy as np
-import math
+
+def faceLists(verts, sizes):
+    """
+    split flat vertex indices into a list of faces (lists), fast path for faces of identical size
+
+    :param verts: flat array of vertex indices
+    :param sizes: array of number of vertices per face
+    :return: list of lists
+    """
+    if len(sizes) == 0:
+        return []
+    if (sizes == sizes[0]).all():
+        return verts.reshape(-1, sizes[0]).tolist()
+    return [face.tolist() for face in np.split(verts, np.cumsum(sizes)[:-1])]
+
+def _parseFloats(lines, columns):
+    """
+    bulk parse v/vt lines (command already removed), only the first columns are used
+    """
+    if len(lines) == 0:
+        return np.zeros((0, columns), dtype=np.float32)
+    values = np.array(" ".join(lines).split(), dtype=np.float32)
+    if len(values) == len(lines) * columns:
+        return values.reshape(-1, columns)
+
+    # optional values (e.g. w or vertex colors), parse line by line
+    #
+    return np.array([line.split()[:columns] for line in lines], dtype=np.float32)
+
+def _parseCorners(corners, nverts, nuvs):
+    """
+    bulk parse face corners (a, a/b, a//c or a/b/c), index counts from 1, negative is relative
+
+    :return: vertex index array and uv index array (or None if no uv is given)
+    """
+    ncol = corners[0].count("/") + 1
+    text = " ".join(corners).replace("//", "/0/").replace("/", " ")
+    values = np.array(text.split(), dtype=np.int64)
+    if len(values) != len(corners) * ncol:
+        # mixed corner formats, do it per corner
+        #
+        vind = np.array([c.split("/")[0] for c in corners], dtype=np.int64)
+        uvtext = [c.split("/") for c in corners]
+        if all(len(c) > 1 and c[1] != "" for c in uvtext):
+            uvind = np.array([c[1] for c in uvtext], dtype=np.int64)
+        else:
+            uvind = None
+    else:
+        values = values.reshape(-1, ncol)
+        vind = values[:,0]
+        uvind = values[:,1] if ncol > 1 and "//" not in corners[0] else None
+
+    vind = np.where(vind < 0, vind + nverts, vind - 1)
+    if uvind is not None:
+        uvind = np.where(uvind < 0, uvind + nuvs, uvind - 1)
+    return vind, uvind
 
 def importWaveFront(path, obj):
     """
@@ -20,6 +76,8 @@ def importWaveFront(path, obj):
     vt = positions (texture)
     usemtl = material (skipped)
 
+    lines are only sorted by command in one pass, values are parsed in bulk afterwards
+
     returns: 2 okay, 1 warn, 0 error
     """
 
@@ -28,174 +86,137 @@ def importWaveFront(path, obj):
     except IOError:
         return (0, "Cannot open file " + path)
     else:
-
-        verts  = []
-        uvs    = []
-        groups = {}
-        groupnames = [] # to keep the group order
+        vlines = []
+        vtlines = []
+        flines  = []    # face lines without command
+        fgroup  = []    # group number per face
+        groupnames = ["mh_default"]  # to keep the group order
+        groupnum = {"mh_default": 0}
+        current = 0
         objname = None
-        prim = 0        # number of needed triangles
-        ln = 0          # line number
-        fcnt = 0        # face-counter
-        ucnt = 0        # UV-face counter
-
-        groupnames.append("mh_default")
-        g = groups["mh_default"] = {"v": [], "uv": [] }
-
-        for line in f:
-            ln += 1
-            words = line.split()
-
-            lwords = len(words) -1
-            if lwords <= 0:
-                continue
-
-            command = words[0]
-
-            # v and vt simply fill buffers (for UV-Map change coordinates)
-            #
-            if command == 'v':
-                verts.append((float(words[1]), float(words[2]), float(words[3])))
-
-            elif command == 'vt':
-                uvs.append((float(words[1]), 1 - float(words[2])))
-
-            # f, faces, this data is stored groupwise, index counts from 1
-            # a/b ... first one is vertex-index, second one UV
-            #
-            elif command == 'f':
-                vInd  = []
-                uvInd = []
-
-                prim += (lwords-2)  # count number of primitives
-
-                for elem in words[1:]:
-                    columns = elem.split('/')
-                    vindex = int(columns[0]) - 1
-                    vInd.append(vindex)
 
-                    if len(columns) > 1 and columns[1] != '':
-                        uc = int(columns[1])
-                        uvInd.append(uc - 1)
-
-                g["v"].append(vInd)
-                fcnt += 1
-
-                if len(uvInd) > 0:
-                    g["uv"].append(uvInd)
-                    ucnt += 1
-
-            elif command == 'g':
-                gname = words[1]
-                if gname not in groups:
-                    g = groups[gname] = {"v": [], "uv": [] }
-                    groupnames.append(gname)
-
-            elif command == 'o':
-                objname = words[1]
-
-            else:
-                # print ("Ignore: " + line)
-                pass
-        f.close()
+        with f:
+            for line in f:
+                if line.startswith("v "):
+                    vlines.append(line[2:])
+                elif line.startswith("vt "):
+                    vtlines.append(line[3:])
+                elif line.startswith("f "):
+                    flines.append(line[2:])
+                    fgroup.append(current)
+                else:
+                    words = line.split()
+                    if len(words) < 2:
+                        continue
+                    if words[0] == 'g':
+                        # like before: only a new group changes the current group
+                        #
+                        gname = words[1]
+                        if gname not in groupnum:
+                            groupnum[gname] = current = len(groupnames)
+                            groupnames.append(gname)
+                    elif words[0] == 'o':
+                        objname = words[1]
+                    elif words[0] == 'v':
+                        vlines.append(line.lstrip()[2:])
+                    elif words[0] == 'vt':
+                        vtlines.append(line.lstrip()[3:])
+                    elif words[0] == 'f':
+                        flines.append(line.lstrip()[2:])
+                        fgroup.append(current)
+
+    verts = _parseFloats(vlines, 3)
+    uvs = _parseFloats(vtlines, 2)
+    if len(uvs) > 0:
+        uvs[:,1] = 1.0 - uvs[:,1]
+    del vlines, vtlines
+
+    n_origverts = n_verts = len(verts)
+    n_uvs = len(uvs)
 
-    # delete empty groups
-    # must be done in two steps not to destroy iteration, first step can delete empty uvs
+    # faces as flat index arrays, faces are sorted by group (stable, so order inside group is kept)
     #
-    delete = []
-    for g in groups:
-        if len(groups[g]["v"]) == 0:
-            delete.append(g)
-            groupnames.remove(g)
-        if len(groups[g]["uv"]) == 0:
-            del groups[g]["uv"]
-
-    for d in delete:
-        del groups[d]
+    fsplit = [line.split() for line in flines]
+    sizes = np.array([len(c) for c in fsplit], dtype=np.int64)
+    fgroup = np.array(fgroup, dtype=np.int64)
+    corners = [c for face in fsplit for c in face]
+    del flines, fsplit
+
+    if len(corners) > 0:
+        vind, uvind = _parseCorners(corners, n_verts, n_uvs)
+    else:
+        vind, uvind = np.zeros(0, dtype=np.int64), None
+    del corners
+
+    order = np.argsort(fgroup, kind='stable')
+    cornerstart = np.concatenate(([0], np.cumsum(sizes)))
+    if len(order) > 0 and (np.diff(order) != 1).any():
+        cornerorder = np.concatenate([np.arange(cornerstart[i], cornerstart[i+1]) for i in order])
+        vind = vind[cornerorder]
+        if uvind is not None:
+            uvind = uvind[cornerorder]
+        sizes = sizes[order]
+        fgroup = fgroup[order]
+
+    fcnt = len(sizes)
+    prim = int((sizes - 2).sum())
+    ucnt = fcnt if uvind is not None else 0
 
     # let the UV coordinates use the same index as the faces, because
     # glDrawElements means one index for UV-Buffer, Normals and coordinates
-    # 
+    #
     # classically there are more UVS because of seams, so we need to duplicated coordinates
-    # we use a -1 filled vertex_uv-Buffer to be filled with correct indices
+    # the first usage of a vertex determines its uv, different uvs (difference > 0.001) create
+    # a new vertex at the end. They are put in the overflow-buffer (source, dest)
     #
-    # they should be in overflow-buffer
-    # after that we got new uvs, a few more coordinates, and partly a changed index
-    # the information about UV is changed to pure bool indicating the availability
-    # 
-    overflowbuf = {}
-
-    n_origverts = n_verts = len(verts) # number of vertices, start with the number we have, will increased in case we need new ones
-    n_uvs = len(uvs)
-    vertex_uv = np.full(n_verts, 0xffffffff, dtype=np.uint32)
-
-    uvsize = n_verts*4      # try to find a buffer sufficient for the uv-values
-    max_uv = n_uvs * 3 
-    if max_uv > uvsize:
-        uvsize = max_uv
-
-    uv_values = np.zeros (shape=(uvsize, 2), dtype=np.float32)  # should be sufficient for the longest possible buffer
-
-    for g in groups:
-        if "uv" in groups[g] and len(groups[g]["uv"]) > 0:
-            gi = groups[g]["v"]
-            guv = groups[g]["uv"]
-
-            for num, face in enumerate(gi):
-                uvface = guv[num]
-                for inum, vert in enumerate(face):
-                    uvert = uvface[inum]
-
-                    # if vertex_uv[vert] still is unused, set it to the value which is added, no changed
-                    #
-                    if vertex_uv[vert] == 0xffffffff:
-                        vertex_uv[vert] = uvert
-                        uv_values[vert] = uvs[uvert]
-
-                    # in case it is used but different, check if we have the combination already in overflow-buffer
-                    # sometimes meshes are not connected, but vertices are identical
-                    #
-                    elif vertex_uv[vert] != uvert:
-                        dx =  math.fabs(uv_values[vert][0] - uvs[uvert][0])
-                        dy =  math.fabs(uv_values[vert][1] - uvs[uvert][1])
-
-                        if dx > 0.001 or dy > 0.001:
-                            name = str(vert) + "_" + str(uvert)     # mathematically old makehuman uses sth like vert << 32 | uvert, would also work here
-
-                            if name in overflowbuf:
-                                # print (name + " allready in overflowbuf")
-                                gi[num][inum] = overflowbuf[name]   # we can use it from buffer
-                            else:
-                                # print ("new one needed:" + name)
-                                overflowbuf[name] = n_verts         # we creat a new entry
-                                verts.append(verts[vert])           # append identical coords to the end
-                                uv_values[n_verts] = uvs[uvert]     # place uv-values there
-                                gi[num][inum] = n_verts             # change the index to new appended element
-                                n_verts += 1                        # and increment number of elements
-
-            groups[g]["uv"] = True      # the information is now replaced by the bool we need
-        else:
-            groups[g]["uv"] = False
+    uv_values = np.zeros((n_verts, 2), dtype=np.float32)
+    overflowtable = np.empty((0, 2), dtype=np.uint32)
 
-    overflowtable = np.empty((len(overflowbuf), 2), dtype=np.uint32)
+    if uvind is not None and len(vind) > 0:
+        used, first = np.unique(vind, return_index=True)
+        vertex_uv = np.full(n_verts, -1, dtype=np.int64)
+        vertex_uv[used] = uvind[first]
+        uv_values[used] = uvs[uvind[first]]
 
-    i = 0
-    for key, value in overflowbuf.items():
-        (a,b) = key.split("_")
-        overflowtable[i] = (a, value)
-        i+=1
-    overflowtable.view('uint32,uint32').sort(order=['f0'], axis=0) # sort by first column in place
+        differ = vertex_uv[vind] != uvind
+        differ[differ] = (np.abs(uv_values[vind[differ]] - uvs[uvind[differ]]) > 0.001).any(axis=1)
 
-    # print (overflowtable)
-
-    uv_values.resize((n_verts, 2), refcheck=False)          # shorten buffer back to what we really needed.
-
-    del vertex_uv                                           # the helper is no longer necessary
+        if differ.any():
+            # new vertices are numbered in order of their first appearance
+            #
+            keys = vind[differ] * n_uvs + uvind[differ]
+            ukeys, kfirst, kinverse = np.unique(keys, return_index=True, return_inverse=True)
+            rank = np.empty(len(ukeys), dtype=np.int64)
+            rank[np.argsort(kfirst, kind='stable')] = np.arange(len(ukeys))
+            vind[differ] = n_verts + rank[kinverse.reshape(-1)]
+
+            appearance = ukeys[np.argsort(kfirst, kind='stable')]
+            source = appearance // n_uvs
+            verts = np.concatenate((verts, verts[source]))
+            uv_values = np.concatenate((uv_values, uvs[appearance % n_uvs]))
+
+            dest = np.arange(n_verts, n_verts + len(appearance))
+            sortorder = np.lexsort((dest, source))
+            overflowtable = np.stack((source[sortorder], dest[sortorder]), axis=1).astype(np.uint32)
+            n_verts += len(appearance)
+
+    # create groups (faces as lists), delete empty groups
+    #
+    groups = {}
+    names = []
+    facestart = np.concatenate(([0], np.cumsum(np.bincount(fgroup, minlength=len(groupnames)))))
+    vertstart = np.concatenate(([0], np.cumsum(sizes)))
+    for num, gname in enumerate(groupnames):
+        fs, fe = facestart[num], facestart[num+1]
+        if fe == fs:
+            continue
+        names.append(gname)
+        groups[gname] = {"v": faceLists(vind[vertstart[fs]:vertstart[fe]], sizes[fs:fe]), "uv": uvind is not None }
 
     # sanity test for finding vertices costs too much time
     #
     obj.setName(objname)
-    obj.setGroupNames(groupnames)
+    obj.setGroupNames(names)
     obj.createGLVertPos(verts, uv_values, overflowtable, n_origverts)          # TODO consider to recombine createGLVertPos and createGLFaces
 
     validGeom = obj.createGLFaces(fcnt, ucnt, prim, groups)
@@ -207,7 +228,4 @@ def importWaveFront(path, obj):
         msg = "Bad geometry, at least one normal vector of face with size 0 cannot be calculated. " + \
                 "This can result in artifacts in certain programs. Makehuman2 can deal with it."
 
-    del verts
-    del uvs
-
     return (res, msg)
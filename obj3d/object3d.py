@@ -11,6 +11,7 @@ import sys
 import numpy as np 
 
 from obj3d.fops_binary import exportObj3dBinary, importObjFromFile
+from obj3d.topology import Topology, topologyKey, sharedTopology
 
 # only import material when not used for mesh compiler
 #
@@ -26,6 +27,7 @@ class object3d:
         self.openGL   = None    # openGL pointer
         self.filename = None    # original file name
         self.name = None    # will contain object name derived from loaded file (identical to asset)
+        self.topology = None  # immutable data, shared with all objects loaded from the same file
         self.npGrpNames = []  # ordered list of groupnames numpy format
 
         self.prim    = 0    # will contain number primitives (tris)
@@ -46,11 +48,14 @@ class object3d:
         self.overflow = None # will contain a table for double used vertices [source, dest]
 
         self.gl_coord = []    # will contain flattened gl-Buffer (these are coordinates to be changed)
+        self.version = 0      # incremented when gl_coord is changed (used by caches e.g. measurements)
         self.gl_coord_o = []  # will contain a copy of unchanged positions (TODO base mesh only ?)
 
+        # working buffers are allocated when written (copy on write)
+        #
         self.gl_coord_w = []  # will contain a copy of unchanged positions (working mode with targets) & for posing
-        self.gl_coord_mn = []  # will contain buffer for work with macros containing all changes except the macros
-        self.gl_coord_mm = []  # will contain buffer for work with macros containing all changes of the macros
+        self.gl_coord_mn = None  # will contain buffer for work with macros containing all changes except the macros
+        self.gl_coord_mm = None  # will contain buffer for work with macros containing all changes of the macros
 
         self.gl_uvcoord = []  # will contain flattened gluv-Buffer
         self.gl_norm  = []    # will contain flattended normal buffer
@@ -89,11 +94,53 @@ class object3d:
         load a mesh either binary or per object
         """
         self.filename = path
-        (success, text) = importObjFromFile(path, self, use_obj)
+        (success, text) = self.loadShared(topologyKey(path, use_obj, self.visible), importObjFromFile, path, self, use_obj)
         if success > 0 and not ('MAKEHUMAN2TOOL' in os.environ and os.environ['MAKEHUMAN2TOOL'] == "True"):
             self.initMaterial()
         return success, text
 
+    def loadShared(self, key, loader, *args):
+        """
+        a file is only loaded once, following objects share the topology
+
+        :param key: key of topology (see topologyKey)
+        :param loader: function to load the mesh into this object, called with args
+        :return: code, message of loader
+        """
+        topology = sharedTopology(key)
+        if topology is not None:
+            self.env.logLine(8, "Use shared topology: " + key[0])
+            return topology.attach(self)
+        (success, text) = loader(*args)
+        if success > 0:
+            Topology(self, (success, text), key)
+        return success, text
+
+    def writableBuffer(self, buf):
+        """
+        copy on write: shared buffers (topology, original positions) get an own buffer before they are changed
+        """
+        if isinstance(buf, np.ndarray) and buf.flags.writeable and buf is not self.gl_coord_o and len(buf) == len(self.gl_coord):
+            return buf
+        return np.empty_like(self.gl_coord)
+
+    def releaseWorkBuffers(self):
+        """
+        free working buffers (e.g. for characters of a crowd which are not changed), not in pose mode
+        """
+        self.gl_coord_w = self.gl_coord_o if self.is_base else []
+        self.gl_coord_mn = None
+        self.gl_coord_mm = None
+
+    def memory(self):
+        """
+        memory in bytes of own buffers and of shared topology
+        """
+        own = sum([buf.nbytes for buf in (self.gl_coord, self.gl_coord_w, self.gl_coord_mn, self.gl_coord_mm, self.gl_hicoord)
+            if isinstance(buf, np.ndarray) and buf is not self.gl_coord_o])
+        shared = self.topology.memory() if self.topology is not None else 0
+        return own, shared
+
     def setZDepth(self, z_depth):
         self.z_depth = z_depth
 
@@ -350,22 +397,15 @@ class object3d:
         return highest + 1
 
     def unUsedVerts(self, faceind):
-        indlen = len(faceind)
         usedmax = len(self.gl_uvcoord) // 2
         ba = np.full((usedmax), 0)
-        for cnt in range(0, indlen):
-            ba[faceind[cnt]] = 1
+        ba[faceind] = 1
         return ba
 
     def shortenOverflow(self, mapping):
-        arr = []
         if len(self.overflow) > 0:
-            for i, (s,d) in enumerate(self.overflow):
-                source = mapping[s]
-                dest = mapping[d]
-                if source != -1 and dest != -1:
-                    arr.append([source, dest])
-            return np.array(arr, dtype=np.uint32)
+            pairs = mapping[np.asarray(self.overflow, dtype=np.int64)]
+            return pairs[(pairs != -1).all(axis=1)].astype(np.uint32)
         else:
             return None
 
@@ -389,32 +429,20 @@ class object3d:
         mx = self.fillFaceBuffers(vertsperface, faceverts, mask, helper)
         if mask is not None:
             mask = self.unUsedVerts(faceverts)
-            usedmax = len(mask)
             mapping, newcoord = self.createMapping(mask)
-            coord = np.zeros(newcoord*3,  dtype=np.float32)
-            norm = np.zeros(newcoord*3,  dtype=np.float32)
-            gl_uvcoord = np.zeros(newcoord*2,  dtype=np.float32)
-            for cnt in range(0, usedmax):
-                d = mapping[cnt]
-                if d != -1:
-                    s2 = cnt * 2
-                    s3 = cnt * 3
-                    d2 = d * 2
-                    d3 = d * 3
-
-                    coord[d3] = self.gl_coord[s3]
-                    coord[d3+1] = self.gl_coord[s3+1]
-                    coord[d3+2] = self.gl_coord[s3+2]
-
-                    norm[d3] = self.gl_norm[s3]
-                    norm[d3+1] = self.gl_norm[s3+1]
-                    norm[d3+2] = self.gl_norm[s3+2]
-
-                    gl_uvcoord[d2] = self.gl_uvcoord[s2]
-                    gl_uvcoord[d2+1] = self.gl_uvcoord[s2+1]
-
-            for i in range(0, len(faceverts)):
-                faceverts[i] = mapping[faceverts[i]]
+            used = np.flatnonzero(mapping != -1)
+            dest = mapping[used]
+            coord = np.zeros((newcoord, 3),  dtype=np.float32)
+            norm = np.zeros((newcoord, 3),  dtype=np.float32)
+            gl_uvcoord = np.zeros((newcoord, 2),  dtype=np.float32)
+            coord[dest] = self.gl_coord.reshape(-1, 3)[used]
+            norm[dest] = self.gl_norm.reshape(-1, 3)[used]
+            gl_uvcoord[dest] = self.gl_uvcoord.reshape(-1, 2)[used]
+            coord = coord.reshape(-1)
+            norm = norm.reshape(-1)
+            gl_uvcoord = gl_uvcoord.reshape(-1)
+
+            faceverts[:] = mapping[faceverts]
 
             overflow = self.shortenOverflow(mapping)
             if overflow is not None:
@@ -471,8 +499,9 @@ class object3d:
 
         self.gl_coord = self.coord.flatten()
         self.gl_coord_o = self.gl_coord.copy()  # create a copy for original values
+        self.version += 1
         if self.is_base:
-            self.gl_coord_w = self.gl_coord.copy()          # basemesh: create another one for working
+            self.gl_coord_w = self.gl_coord_o               # basemesh: working copy, shared until written
 
         # for no UV map, use an empty array
         #
@@ -506,12 +535,15 @@ class object3d:
 
     def resetMesh(self):
         self.gl_coord[:] = self.gl_coord_o[:] # get back the copy
+        self.version += 1
 
     def createWCopy(self):
+        self.gl_coord_w = self.writableBuffer(self.gl_coord_w)
         self.gl_coord_w[:] = self.gl_coord[:]
 
     def resetFromCopy(self):
         self.gl_coord[:] = self.gl_coord_w[:]
+        self.version += 1
 
     def hideVertices(self, verts):
         numind = len(self.gl_icoord) -2
@@ -565,12 +597,9 @@ class object3d:
         if self.gl_hicoord is None:
             return None
 
-        indlen = len(self.gl_hicoord)
-
         usedmax = len(self.gl_uvcoord) // 2
         ba = np.full((usedmax), 0)
-        for cnt in range(0, indlen):
-            ba[self.gl_hicoord[cnt]] = 1
+        ba[self.gl_hicoord] = 1
 
         # nothing deleted?
         if np.all(ba):
@@ -584,12 +613,9 @@ class object3d:
         """
         usedmax = len(mask)
         mapping = np.full(usedmax, -1, dtype=np.int32)
-        fill = 0
-        for cnt in range(0, usedmax):
-            if mask[cnt] == 1:
-                mapping[cnt] = fill
-                fill +=1
-        return mapping, fill
+        used = np.flatnonzero(mask == 1)
+        mapping[used] = np.arange(len(used), dtype=np.int32)
+        return mapping, len(used)
 
     def optimizeHiddenMesh(self, bweights):
         """
@@ -702,12 +728,12 @@ class object3d:
             if factor < 0.0:
                 if targetlower is None:
                     return
-                verts = targetlower.verts
-                data  = targetlower.data
+                verts = targetlower.indices()
+                data  = targetlower.vectors()
                 factor = -factor
             elif factor > 0.0:
-                verts = targetupper.verts
-                data  = targetupper.data
+                verts = targetupper.indices()
+                data  = targetupper.vectors()
             for i in range(0, len(verts)):
                 x = verts[i] * 3
                 self.gl_coord_w[x]   = self.gl_coord[x]   - factor * data[i][0]
@@ -721,6 +747,7 @@ class object3d:
         """
         updates the mesh when slider is moved
         """
+        self.version += 1
         if factor == 0.0:
             self.gl_coord[:] = self.gl_coord_w[:]
             return
@@ -728,12 +755,12 @@ class object3d:
         if factor < 0.0:
             if targetlower is None:
                 return
-            verts = targetlower.verts * 3
-            data  = targetlower.data.ravel()
+            verts = targetlower.indices() * 3
+            data  = targetlower.vectors().ravel()
             factor = -factor
         elif factor > 0.0:
-            verts = targetupper.verts * 3
-            data  = targetupper.data.ravel()
+            verts = targetupper.indices() * 3
+            data  = targetupper.vectors().ravel()
 
         srcVerts = np.s_[...]
         self.gl_coord[verts] = self.gl_coord_w[verts] + data[srcVerts][::3] * factor
@@ -749,17 +776,18 @@ class object3d:
         updates from file (all done on basemesh directly)
         no overflow correction
         """
+        self.version += 1
         if factor < 0.0:
             if targetlower is None:
                 return
-            verts = targetlower.verts * 3
-            data  = targetlower.data.ravel()
+            verts = targetlower.indices() * 3
+            data  = targetlower.vectors().ravel()
             factor = -factor
         elif factor > 0.0:
             if targetupper is None:
                 return
-            verts = targetupper.verts * 3
-            data  = targetupper.data.ravel()
+            verts = targetupper.indices() * 3
+            data  = targetupper.vectors().ravel()
 
         srcVerts = np.s_[...]
         self.gl_coord[verts] += data[srcVerts][::3] * factor
@@ -781,23 +809,27 @@ class object3d:
         # overflow vertices and copy to non-macrobuffer
         #
         self.overflowCorrection(self.gl_coord)
-        self.gl_coord_mn =  self.gl_coord.copy()
+        self.gl_coord_mn = self.writableBuffer(self.gl_coord_mn)
+        self.gl_coord_mn[:] = self.gl_coord
 
     def prepareMacroBuffer(self):
         """
         copy original mesh + add all changes of non-macrotargets
         """
         print ("+++ Prepare Buffer")
-        self.gl_coord_mn =  self.gl_coord.copy()
-        self.gl_coord_mm = np.zeros_like(self.gl_coord)
+        self.gl_coord_mn = self.writableBuffer(self.gl_coord_mn)
+        self.gl_coord_mn[:] = self.gl_coord
+        self.gl_coord_mm = None
 
 
     def addTargetToMacroBuffer(self, factor, target):
         """
         updates a special buffer for a macro target
         """
-        m = target.data.ravel()
-        verts = target.verts * 3
+        if self.gl_coord_mm is None:
+            self.gl_coord_mm = np.zeros_like(self.gl_coord)
+        m = target.vectors().ravel()
+        verts = target.indices() * 3
 
         srcVerts = np.s_[...]
         self.gl_coord_mm[verts] += m[srcVerts][::3] * factor
@@ -811,20 +843,25 @@ class object3d:
         make sure to write in same buffer (out will avoid to get a new one)
         """
         print ("+++ Add macro to character")
-        np.add(self.gl_coord_mm, self.gl_coord_mn, out=self.gl_coord)  
+        if self.gl_coord_mm is None:
+            self.gl_coord[:] = self.gl_coord_mn
+        else:
+            np.add(self.gl_coord_mm, self.gl_coord_mn, out=self.gl_coord)
+            self.gl_coord_mm.fill(0.0)
         self.overflowCorrection(self.gl_coord)
-        self.gl_coord_mm = np.zeros_like(self.gl_coord)
+        self.version += 1
 
     def approxToBasemesh(self, asset, base):
         """
         updates the mesh, barycentric approximation (assets)
         """
+        self.version += 1
 
         b = base.gl_coord
         w = asset.weights
         o = asset.offsets
 
-        verts = asset.ref_vIdxs * 3 # index (v0, v1, v2)
+        verts = asset.ref_vIdxs.astype(np.int64) * 3 # index (v0, v1, v2)
 
         """
         i = 0
@@ -857,7 +894,7 @@ class object3d:
     def precalculateApproxInRestPose(self, asset, base):
         self.debug("precalculate asset for restpose " + asset.name)
         self.approxToBasemesh(asset, base)
-        self.gl_coord_w =  self.gl_coord.copy()
+        self.createWCopy()
 
     def _getMinMaxValues(self, coord):
         """
@@ -915,21 +952,8 @@ class object3d:
         """
         create a measurement, results in an array of vertices for presentation and the result (length)
         """
-        lx = len(vindex)
-        mcoords = np.zeros((lx, 3), dtype=np.float32)
-        c = 0
-        for i in vindex:
-            x = i *3
-            mcoords[c] = [self.gl_coord[x], self.gl_coord[x+1], self.gl_coord[x+2] ]
-            c += 1
-
-        measure = 0
-        ox = 0
-        for n in range(1, lx):
-            d = mcoords[ox] - mcoords[n]
-            measure += np.sqrt(d.dot(d))
-            ox = n
-
+        mcoords = self.gl_coord.reshape(-1, 3)[vindex]
+        measure = np.linalg.norm(mcoords[1:] - mcoords[:-1], axis=1).sum()
         return measure, mcoords
 
     def calculateAttachedGeom(self, faces):
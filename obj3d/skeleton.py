@@ -9,6 +9,7 @@
 import numpy as np
 from PySide6.QtGui import QVector3D
 from obj3d.bone import cBone, boneWeights
+from obj3d.animation import blendTensor
 import core.math as mquat
 
 class skeleton:
@@ -233,9 +234,21 @@ class skeleton:
     def skinBasemesh(self):
         self.skinMesh(self.mesh, self.bWeights)
 
-    def skinMesh(self, mesh, bWeights):
+    def skinMesh(self, mesh, bWeights, bones=None):
+        """
+        skin mesh with pose of the bones, when bones are given only vertices influenced by these bones
+        are calculated again (rest of the mesh must already be skinned with the current pose)
+        """
         vmapping = bWeights.bWeights
 
+        if bones is not None:
+            used = np.zeros(mesh.n_origverts, dtype=bool)
+            for bname in bones:
+                if bname in vmapping:
+                    used[vmapping[bname][0]] = True
+            if not used.any():
+                return
+
         coords = np.zeros((mesh.n_origverts,3), float)        # own vector
         l = len(mesh.gl_coord) // 3
 
@@ -246,13 +259,23 @@ class skeleton:
             bone = self.bones[bname]
 
             verts, weights = vmapping[bname]
+            if bones is not None:
+                sel = used[verts]
+                if not sel.any():
+                    continue
+                verts = verts[sel]
+                weights = weights[sel]
             vec = np.dot(bone.matPoseVerts, meshCoords[verts].transpose())
             vec *= weights
             coords[verts] += vec.transpose()[:,:3]
 
-        m = coords.flatten()
-        mesh.gl_coord[:mesh.n_origverts*3] = m[:]
+        if bones is not None:
+            mesh.gl_coord[:mesh.n_origverts*3].reshape(-1, 3)[used] = coords[used]
+        else:
+            m = coords.flatten()
+            mesh.gl_coord[:mesh.n_origverts*3] = m[:]
         mesh.overflowCorrection(mesh.gl_coord)
+        mesh.version += 1
 
 
     def restPose(self, bones_only=False):
@@ -352,6 +375,50 @@ class skeleton:
             bone.poseBone()
 
 
+    def poseFrames(self, joints: dict, frames, reference=False):
+        """
+        calculate the pose matrices of all bones for a number of frames at once (stacked arrays),
+        same as pose (bones only) or poseByReference, but the skeleton itself is not changed
+
+        :param joints: BVHJoint dictionary
+        :param frames: number of frames
+        :param reference: True to pose by reference of another skeleton
+        :return: dictionary bone: (matrices relative to parent, global matrices), arrays (frames, 4, 4)
+        """
+        result = {}
+        for elem, bone in self.bones.items():
+            local = None
+            if reference and len(bone.reference) > 0:
+
+                # multiply rotations of referenced joints, if root is referenced do not multiply other matrices
+                #
+                m1 = None
+                for ref in bone.reference:
+                    if ref in joints:
+                        m = joints[ref].finalPoses[:frames]
+                        if joints[ref].parent is None:
+                            m1 = m
+                            break
+                        if m1 is None:
+                            m1 = m.copy()
+                        else:
+                            m1[:,:3,:3] = np.matmul(m[:,:3,:3], m1[:,:3,:3])
+                if m1 is not None:
+                    local = bone.calcLocalPoseMats(m1)
+
+            elif elem in joints:
+                local = bone.calcLocalPoseMats(joints[elem].finalPoses[:frames])
+
+            if local is None:
+                local = np.broadcast_to(bone.matPoseLocal, (frames, 4, 4))
+
+            relative = np.matmul(bone.matRestLocal, local)
+            if bone.parent is not None:
+                result[elem] = (relative, np.matmul(result[bone.parent.name][1], relative))
+            else:
+                result[elem] = (relative, relative)
+        return result
+
     def rootLowestDistance(self, joints, fromframe=0, toframe=-1):
         """
         get difference between root-bone and floor to calculate distance from ground
@@ -380,51 +447,62 @@ class skeleton:
                 mdiff = diff
         return mdiff
 
-    def posebyBlends(self, blends, mask, bones_only=False):
+    def posebyBlends(self, blends, mask, bones_only=False, units=None):
         """
         function used for expressions, with mask set all unchanged bones will be set to rest position
+        and only bones of the mask (and their children) are posed and skinned again
+
+        :param blends: list of [posemat, value]
+        :param mask: list of bones or None
+        :param bones_only: if True, no skinning
+        :param units: PosePrims with precompiled rotations or None
         """
         changed = []
 
         if len(blends) == 0:
             return changed
 
-        # check bonewise if blend is used, then use quaternionsSlerpFromMatrix with ratio to pose
-        # in case the bone is posed by more than one posemat, multiply quaternion matrices
+        # slerp all bones of all blends from rest with ratio, in case the bone is posed by more than one
+        # blend, multiply quaternions in order of blends (bones not used by a blend are at rest)
         #
-        found = {}
+        bones, quats, used, fractions = blendTensor(blends, units)
+        quats = mquat.quaternionsSlerpFromRest(quats, fractions[:, None])
+        q1 = quats[0]
+        for q2 in quats[1:]:
+            q1 = mquat.quaternionsMult(q1, q2)
+        mats = mquat.quaternionsToRotMatrices(q1)
+
+        index = {bone: i for i, bone in enumerate(bones)}
+        found = used.any(axis=0)
         for bone, elem in self.bones.items():
-            modbone = False
-            for blend in blends:
-                posemat = blend[0]
-                ratio = blend[1] / 100
-                if bone in posemat:
-                    found[bone] = True
-                    if modbone is True:
-                        q2 = mquat.quaternionSlerpFromMatrix(posemat[bone], ratio)
-                        q1 = mquat.quaternionMult(q1, q2)
-                    else:
-                        q1 = mquat.quaternionSlerpFromMatrix(posemat[bone], ratio)
-                    modbone = True
-
-            if modbone is True:
-                mat = mquat.quaternionToRotMatrix(q1)
-                elem.calcLocalPoseMat(mat)
+            i = index.get(bone)
+            if i is not None and found[i]:
+                elem.calcLocalPoseMat(mats[i])
                 changed.append(bone)
 
-            elem.calcGlobalPoseMat()
-            elem.poseBone()
-
         if mask is not None:
             for bone in mask:
-                if bone not in found:
+                i = index.get(bone)
+                if i is None or not found[i]:
                     self.bones[bone].restPose()
-                    self.bones[bone].calcGlobalPoseMat()
-                    self.bones[bone].poseBone()
+
+            # pose changed bones and their children
+            #
+            posed = set(mask) | set(changed)
+            for bone, elem in self.bones.items():
+                if bone in posed or (elem.parent is not None and elem.parent.name in posed):
+                    posed.add(bone)
+                    elem.calcGlobalPoseMat()
+                    elem.poseBone()
+        else:
+            posed = None
+            for elem in self.bones.values():
+                elem.calcGlobalPoseMat()
+                elem.poseBone()
 
         if not bones_only:
-            self.skinBasemesh()
-            self.glob.baseClass.poseAttachedAssets()
+            self.skinMesh(self.mesh, self.bWeights, posed)
+            self.glob.baseClass.poseAttachedAssets(posed)
 
         return changed
 
@@ -0,0 +1,86 @@
+"""
+    License information: data/licenses/makehuman_license.txt
+    Author: black-punkduck
+
+    Classes:
+    * Topology
+
+    Functions:
+    * topologyKey
+    * sharedTopology
+"""
+
+import os
+import weakref
+import numpy as np
+
+# all topologies in use, they disappear when the last object3d using them is deleted
+#
+_shared = weakref.WeakValueDictionary()
+
+def topologyKey(path, use_obj=False, visible=None):
+    """
+    key of a loaded mesh, file changes result in a new key
+
+    :param str path: name of the file
+    :param bool use_obj: ASCII is used
+    :param visible: visible groups (base mesh only)
+    """
+    path = os.path.abspath(path)
+    mtime = os.path.getmtime(path) if os.path.isfile(path) else 0.0
+    return (path, mtime, bool(use_obj), tuple(sorted(visible)) if visible else None)
+
+def sharedTopology(key):
+    """
+    :return: topology or None, if not loaded
+    """
+    return _shared.get(key)
+
+class Topology():
+    """
+    immutable mesh data of a loaded base mesh or asset, shared by all object3d instances loaded from the same file.
+
+    Arrays are write protected, an object3d only owns its coordinates (gl_coord). Working buffers are copied on write
+    (see object3d.writableBuffer), normals are replaced and not changed in place.
+
+    :param obj: loaded object3d
+    :param result: result of loader (code, message), returned again for all following objects
+    :param key: key for sharing, None = not shared
+    """
+    arrays = ("coord", "uvs", "fverts", "group", "overflow", "npGrpNames", "gl_icoord", "gl_uvcoord", "gl_coord_o", "gl_norm")
+    values = ("name", "prim", "n_origverts", "n_verts", "n_uvs", "n_faces", "n_fuvs", "n_fverts", "n_groups", "n_glnorm",
+            "loadedgroups")
+
+    def __init__(self, obj, result, key=None):
+        self.result = result
+        for name in self.arrays:
+            arr = getattr(obj, name)
+            if isinstance(arr, np.ndarray):
+                arr.flags.writeable = False
+            setattr(self, name, arr)
+        for name in self.values:
+            setattr(self, name, getattr(obj, name, None))
+        obj.topology = self
+        if key is not None:
+            _shared[key] = self
+
+    def attach(self, obj):
+        """
+        use topology for a new object3d, only the coordinates are copied
+
+        :return: result of loader (code, message)
+        """
+        for name in self.arrays + self.values:
+            setattr(obj, name, getattr(self, name))
+        obj.topology = self
+        obj.gl_coord = self.gl_coord_o.copy()
+        obj.version += 1
+        if obj.is_base:
+            obj.gl_coord_w = self.gl_coord_o
+        return self.result
+
+    def memory(self):
+        """
+        memory in bytes of the shared arrays
+        """
+        return sum([getattr(self, name).nbytes for name in self.arrays if isinstance(getattr(self, name), np.ndarray)])
@@ -156,6 +156,7 @@ class RenderedObject:
         (which is either basemesh or proxy)
         """
         self.material = material
+        self.material.prefetchTextures()
         self.texture = self.material.loadDiffuse(modify, self.proxy)
         self.material.colorate()
 
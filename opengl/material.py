@@ -9,7 +9,7 @@
 import os
 import numpy
 from core.debug import dumper
-from opengl.texture import MH_Texture, ImageEdit
+from opengl.texture import MH_Texture
 from PySide6.QtGui import QColor
 
 class Material:
@@ -432,6 +432,17 @@ backfaceCull {self.backfaceCull}
                         materialfiles.remove(item)
         return materialfiles
 
+    def prefetchTextures(self):
+        """
+        start decoding all texture maps of the material in background
+        """
+        paths = []
+        for attrib in ["diffuseTexture", "normalmapTexture", "aomapTexture", "metallicRoughnessTexture",
+                "emissiveTexture", "sp_litsphereTexture"]:
+            if hasattr(self, attrib):
+                paths.append(getattr(self, attrib))
+        self.glob.textureRepo.prefetch(paths)
+
     def colorate(self):
         if not hasattr(self, "diffuseTexture"):
             return
@@ -440,15 +451,14 @@ backfaceCull {self.backfaceCull}
             return
         if self.colorationColor == self.colorationOldColor and self.colorationMethod == self.colorationOldMethod:
             return
-        self.tex_diffuse.refresh() # reset
-        image = self.tex_diffuse.getImage()
-        ie = ImageEdit(self.glob)
-        if self.colorationMethod == 1:
-            ie.multColor(image, *self.colorationColor)
-            self.tex_diffuse.refresh_image()
-        elif self.colorationMethod ==2:
-            ie.greyToColor(image, *self.colorationColor)
-            self.tex_diffuse.refresh_image()
+        if self.colorationMethod in [1, 2]:
+            # colorized copies of the original image are memoized by the image editor
+            #
+            image = self.glob.textureRepo.images.get(self.tex_diffuse.getName())
+            ie = self.glob.textureRepo.imageEdit
+            self.tex_diffuse.refresh_image(ie.colorize(image, self.colorationMethod, *self.colorationColor))
+        else:
+            self.tex_diffuse.refresh() # reset
 
         self.colorationOldColor = self.colorationColor.copy()
         self.colorationOldMethod= self.colorationMethod
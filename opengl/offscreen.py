@@ -2,8 +2,14 @@
     License information: data/licenses/makehuman_license.txt
     Author: black-punkduck
 
+    Functions:
+    * alphaView
+
     Classes:
     * OffScreenRender
+    * PixelBuffer
+    * RenderJob
+    * RenderQueue
 """
 
 from PySide6.QtGui import QSurfaceFormat, QOffscreenSurface, QOpenGLContext, QImage
@@ -11,26 +17,52 @@ from PySide6.QtOpenGL import QOpenGLFramebufferObjectFormat, QOpenGLFramebufferO
 
 from OpenGL import GL as gl
 import numpy as np
+import ctypes
+import threading
+import queue
+import time
+
+def alphaView(image, ptr):
+    """
+    zero-copy view on alpha channel of a 32 bit image (byte 3 of each pixel)
+
+    :param QImage image: image
+    :param ptr: image.bits() or image.constBits()
+    :return: numpy array (height, width)
+    """
+    height = image.height()
+    rows = np.ndarray((height, image.bytesPerLine()), buffer=ptr, dtype=np.uint8)
+    return rows[:, :image.width() * 4].reshape(height, image.width(), 4)[:, :, 3]
 
 class OffScreenRender:
+    """
+    renders the scene into a framebuffer object, context and surface can be kept
+    for several renderings (used by RenderQueue)
+    """
     def __init__(self, glob, view, transparent=False):
         self.glob = glob
+        self.env = glob.env
         self.view = view
         self.transparent = transparent
         self.framebuffer = None
+        self.resolvebuffer = None
         self.alphamask = None
+        self.alphaimage = None
         self.width = 0
         self.height = 0
         self.oldheight = self.view.window_height
         self.oldwidth = self.view.window_width
         self.context = None
+        self.surface = None
+        self.ogl = None
 
     def renderObject(self, obj, proj_view_matrix, campos):
         obj.draw(proj_view_matrix, campos, self.view.light)
 
-    def getBuffer(self, width, height):
-        self.width = width
-        self.height = height
+    def createContext(self):
+        """
+        create offscreen context and surface sharing the context of the view
+        """
         self.oldheight = self.view.window_height
         self.oldwidth = self.view.window_width
 
@@ -55,16 +87,40 @@ class OffScreenRender:
 
         if not self.context.create():
             self.env.logLine(1, "OffScreenRender: Failed to create OpenGL context")
-            return
+            return False
         self.context.makeCurrent(self.surface)
-        ogl = self.context.functions()
+        self.ogl = self.context.functions()
+        return True
+
+    def resizeBuffer(self, width, height):
+        """
+        (re)create framebuffer when size changed, a multisampled buffer needs a second buffer to resolve
+        """
+        if self.framebuffer is not None:
+            if width == self.width and height == self.height:
+                self.framebuffer.bind()
+                return
+            self.framebuffer.release()
+            self.framebuffer = None
+            self.resolvebuffer = None
 
+        self.width = width
+        self.height = height
         self.framebuffer = QOpenGLFramebufferObject(width, height, self.bufformat)
+        if self.bufformat.samples() > 0:
+            self.resolvebuffer = QOpenGLFramebufferObject(width, height)
         self.framebuffer.bind()
 
-        self.view.camera.resizeViewPort(width, height)
+    def renderScene(self, alphabuffer=None):
+        """
+        render scene, in transparent mode alpha of body is stored
+
+        :param PixelBuffer alphabuffer: if given, alpha of body is read asynchronously into this buffer
+        """
+        ogl = self.ogl
+        self.view.camera.resizeViewPort(self.width, self.height)
         proj_view_matrix = self.view.camera.calculateProjMatrix()
-        ogl.glViewport(0, 0, width, height)
+        ogl.glViewport(0, 0, self.width, self.height)
 
         c = self.view.light.glclearcolor
         if self.transparent:
@@ -84,37 +140,54 @@ class OffScreenRender:
         self.renderObject(self.view.objects[start], proj_view_matrix, campos)
 
         if self.transparent:
-            alphamask =  self.framebuffer.toImage()
-            ptr = alphamask.constBits()
-            mlen = self.height* self.width
-            self.alphamask = np.array(ptr).reshape(mlen*4)[3::4]  # Copies only the alpha value
-            self.framebuffer.bind()                               # needs to be rebound
+            if alphabuffer is not None:
+                self.readPixels(alphabuffer)
+            else:
+                self.alphaimage =  self.framebuffer.toImage()         # keep image, alphamask is only a view
+                self.alphamask = alphaView(self.alphaimage, self.alphaimage.constBits())
+                self.framebuffer.bind()                               # needs to be rebound
         start +=1
 
         for obj in self.view.objects[start:]:
             self.renderObject(obj, proj_view_matrix, campos)
 
+    def readPixels(self, pixelbuffer):
+        """
+        start asynchronous readback of the framebuffer
+        """
+        if self.resolvebuffer is not None:
+            QOpenGLFramebufferObject.blitFramebuffer(self.resolvebuffer, self.framebuffer)
+            self.resolvebuffer.bind()
+            pixelbuffer.read(self.width, self.height)
+            self.framebuffer.bind()
+        else:
+            pixelbuffer.read(self.width, self.height)
+
+    def getBuffer(self, width, height):
+        if not self.createContext():
+            return
+        self.resizeBuffer(width, height)
+        self.renderScene()
+
     def bufferToImage(self):
+        # toImage already delivers a new image, so no extra copy is needed
+        #
+        img =  self.framebuffer.toImage()
         if self.glob.env.noalphacover is False:
-            img =  self.framebuffer.toImage().copy()
 
             # to avoid artifacts, we need to copy the image once
             #
-            img = QImage(img.constBits(), img.width(), img.height(), QImage.Format_ARGB32).copy()
-        else:
-            img =  self.framebuffer.toImage().copy()
+            img = QImage(img.constBits(), img.width(), img.height(), img.bytesPerLine(), QImage.Format_ARGB32).copy()
         self.glob.openGLBlock = False
 
         # now add alpha of body again, otherwise the character is transparent also, when wearing
         # transparent clothes
 
         if self.alphamask is not None:
-            ptr = img.bits()
-            mlen = self.height* self.width
-            alphadest = np.array(ptr).reshape(mlen*4)[3::4]  #  Copies only the alpha value
-            for x in range(0, self.height* self.width):
-                if alphadest[x] < self.alphamask[x]:
-                    ptr[x*4+3] = self.alphamask[x]
+            alphadest = alphaView(img, img.bits())
+            np.maximum(alphadest, self.alphamask, out=alphadest)
+            self.alphamask = None
+            self.alphaimage = None
 
         imgmode = QImage.Format_RGBA8888 if self.transparent else QImage.Format_RGB888
         img =  img.convertToFormat(imgmode)
@@ -124,6 +197,200 @@ class OffScreenRender:
 
     def releaseBuffer(self):
         self.view.resizeGL(self.oldwidth, self.oldheight)
-        self.framebuffer.release()
+        if self.framebuffer is not None:
+            self.framebuffer.release()
         self.surface.destroy()
 
+
+class PixelBuffer():
+    """
+    pixel pack buffer for asynchronous readback of BGRA pixels
+    """
+    def __init__(self):
+        self.pbo = gl.glGenBuffers(1)
+        self.size = 0
+        self.width = 0
+        self.height = 0
+
+    def read(self, width, height):
+        """
+        start transfer of the bound read buffer, returns immediately
+        """
+        size = width * height * 4
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, self.pbo)
+        if size != self.size:
+            gl.glBufferData(gl.GL_PIXEL_PACK_BUFFER, size, None, gl.GL_STREAM_READ)
+            self.size = size
+        gl.glPixelStorei(gl.GL_PACK_ALIGNMENT, 4)
+        gl.glReadPixels(0, 0, width, height, gl.GL_BGRA, gl.GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+        self.width = width
+        self.height = height
+
+    def get(self):
+        """
+        get pixels (waits until transfer is done), openGL delivers bottom-up rows
+
+        :return: numpy array (height, width, 4) in BGRA order
+        """
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, self.pbo)
+        data = gl.glGetBufferSubData(gl.GL_PIXEL_PACK_BUFFER, 0, self.size)
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+        pixels = np.frombuffer(data, dtype=np.uint8).reshape(self.height, self.width, 4)
+        return np.ascontiguousarray(pixels[::-1])
+
+    def delete(self):
+        gl.glDeleteBuffers(1, [self.pbo])
+
+
+class RenderJob():
+    """
+    one image of a render queue
+
+    :param str filename: output filename (PNG)
+    :param int width: width of image
+    :param int height: height of image
+    :param float angle: y-rotation of the scene
+    :param int frame: animation frame or None
+    :param str model: mhm file to load before rendering or None
+    """
+    def __init__(self, filename, width, height, angle=0.0, frame=None, model=None):
+        self.filename = filename
+        self.width = width
+        self.height = height
+        self.angle = angle
+        self.frame = frame
+        self.model = model
+        self.error = None
+        self.time = 0.0
+
+    def __str__(self):
+        return "RenderJob " + self.filename + " " + str(self.width) + "x" + str(self.height)
+
+
+class RenderQueue():
+    """
+    renders a list of jobs (turntables, frames of an animation, several characters) using one
+    offscreen context and framebuffer. Readback of image n is done while image n+1 is rendered
+    (two pixel buffers), images are written by a background thread.
+
+    :param glob: global objects
+    :param view: OpenGLView
+    :param bool transparent: transparent background
+    :param prepare: function called with job before rendering (set model, frame and angle)
+    :param progress: function called with number of rendered images and job
+    """
+    def __init__(self, glob, view, transparent=False, prepare=None, progress=None):
+        self.glob = glob
+        self.env = glob.env
+        self.view = view
+        self.transparent = transparent
+        self.prepare = prepare
+        self.progress = progress
+        self.writequeue = queue.Queue(maxsize=4)
+        self.written = 0
+        self.failed = []
+
+    def writer(self):
+        """
+        background thread, converts pixels to images and saves them
+        """
+        informat = QImage.Format_ARGB32_Premultiplied if self.env.noalphacover else QImage.Format_ARGB32
+        while True:
+            elem = self.writequeue.get()
+            if elem is None:
+                break
+            pixels, alpha, job = elem
+            if alpha is not None:
+                np.maximum(pixels[:, :, 3], alpha[:, :, 3], out=pixels[:, :, 3])
+            elif not self.transparent:
+                pixels[:, :, 3] = 255
+
+            # like bufferToImage: without alpha to coverage the pixels are taken as premultiplied
+            #
+            img = QImage(pixels.data, job.width, job.height, job.width * 4, informat)
+            imgmode = QImage.Format_RGBA8888 if self.transparent else QImage.Format_RGB888
+            if img.convertToFormat(imgmode).save(job.filename, "PNG", -1):
+                self.written += 1
+            else:
+                job.error = "cannot write " + job.filename
+                self.failed.append(job)
+
+    def finishJob(self, pending):
+        buffers, job = pending
+        pixels = buffers[0].get()
+        alpha = buffers[1].get() if self.transparent else None
+        self.writequeue.put((pixels, alpha, job))
+
+    def run(self, jobs):
+        """
+        render all jobs
+
+        :param list jobs: list of RenderJob
+        :return: number of images written
+        """
+        self.written = 0
+        self.failed = []
+        offscreen = OffScreenRender(self.glob, self.view, self.transparent)
+        if not offscreen.createContext():
+            return 0
+        self.glob.openGLBlock = True
+
+        # two sets of pixel buffers (color and alpha) used alternately
+        #
+        buffers = [[PixelBuffer(), PixelBuffer()], [PixelBuffer(), PixelBuffer()]]
+
+        thread = threading.Thread(target=self.writer, daemon=True)
+        thread.start()
+
+        pending = None
+        index = 0       # set of pixel buffers for next frame, changed only when a frame is rendered
+        for num, job in enumerate(jobs):
+            start = time.time()
+            if self.prepare is not None:
+                try:
+                    self.prepare(job)
+                except Exception as err:
+                    job.error = str(err)
+                    self.failed.append(job)
+                    continue
+
+                # prepare might change current context
+                #
+                offscreen.context.makeCurrent(offscreen.surface)
+                for glbuffer in self.view.buffers:
+                    glbuffer.Tweak()
+
+            # pixel buffers can only be reused with the same size
+            #
+            if pending is not None and (job.width != offscreen.width or job.height != offscreen.height):
+                self.finishJob(pending)
+                pending = None
+
+            offscreen.resizeBuffer(job.width, job.height)
+            current = buffers[index]
+            index = 1 - index
+            offscreen.renderScene(current[1] if self.transparent else None)
+            offscreen.readPixels(current[0])
+
+            if pending is not None:
+                self.finishJob(pending)
+            pending = [current, job]
+            job.time = time.time() - start
+            if self.progress is not None:
+                self.progress(num + 1, job)
+
+        if pending is not None:
+            self.finishJob(pending)
+
+        self.writequeue.put(None)
+        thread.join()
+
+        for pair in buffers:
+            for elem in pair:
+                elem.delete()
+        self.glob.openGLBlock = False
+        offscreen.context.doneCurrent()
+        QOpenGLFramebufferObject.bindDefault()
+        offscreen.releaseBuffer()
+        return self.written
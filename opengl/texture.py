@@ -3,6 +3,7 @@
     Author: black-punkduck
 
     Classes:
+    * ImageCache
     * TextureRepo
     * ImageEdit
     * MH_Texture
@@ -14,22 +15,141 @@ from PySide6.QtGui import QImage, QColor
 from PySide6.QtCore import QSize, Qt
 import numpy as np
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from math import floor
 
+class ImageCache():
+    """
+    cache for decoded images, key is the filename, values are: [ QImage, filedate, bytes ]
+    images are decoded by worker threads (prefetch), least recently used images are
+    removed when budget (in bytes) is exceeded
+    """
+    def __init__(self, budget, workers=4):
+        self.budget = budget
+        self.workers = workers
+        self.images = OrderedDict()
+        self.pending = {}
+        self.used = 0
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def _timestamp(self, path):
+        return int(os.stat(path).st_mtime) if os.path.isfile(path) else None
+
+    def _remove(self, path):
+        self.used -= self.images[path][2]
+        del self.images[path]
+
+    def _put(self, path, image, timestamp):
+        if image.isNull():
+            return
+        with self.lock:
+            if path in self.images:
+                self._remove(path)
+            size = image.sizeInBytes()
+            self.images[path] = [image, timestamp, size]
+            self.used += size
+            while self.used > self.budget and len(self.images) > 1:
+                self._remove(next(iter(self.images)))
+
+    def prefetch(self, path):
+        """
+        start decoding an image in background, if not already cached
+        """
+        timestamp = self._timestamp(path)
+        if timestamp is None:
+            return
+        with self.lock:
+            if path in self.images and self.images[path][1] == timestamp:
+                return
+            if path in self.pending and self.pending[path][1] == timestamp:
+                return
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="mh_decode")
+            self.pending[path] = [self.executor.submit(QImage, path), timestamp]
+
+    def get(self, path):
+        """
+        get decoded image, waits for a running decode job or decodes it directly
+
+        :param str path: image path
+        :return: new QImage handle sharing the data of the cached one, Qt detaches it on write access,
+            so the cached original is not changed
+        """
+        timestamp = self._timestamp(path)
+        with self.lock:
+            if path in self.images:
+                if self.images[path][1] == timestamp:
+                    self.images.move_to_end(path)
+                    return QImage(self.images[path][0])
+                self._remove(path)
+            job = self.pending.pop(path, None)
+
+        if job is not None and job[1] == timestamp:
+            image = job[0].result()
+        else:
+            image = QImage(path)
+        if timestamp is not None:
+            self._put(path, image, timestamp)
+        return QImage(image)
+
+    def memoryUsage(self):
+        return self.used
+
+    def cleanup(self):
+        with self.lock:
+            for job in self.pending.values():
+                job[0].cancel()
+            self.pending = {}
+            self.images = OrderedDict()
+            self.used = 0
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+
 class TextureRepo():
     """
     texture repo contains information about loaded textures
-    key is the filename, values are: [ openGL texture, usage, filedate, mhtex ]
+    key is the filename, values are: [ openGL texture, usage, filedate, mhtex, objects, gpu-bytes ]
     if filedate is "0" it is a generated texture
+
+    textures with usage 0 are kept in self.unused (LRU order) and only destroyed
+    when the GPU budget is exceeded, decoded images are kept in an ImageCache.
+    Colorized textures (self.colorized) are changed in place, so they are destroyed at usage 0.
     """
     def __init__(self, glob):
         self.glob = glob
         self.textures = {}
         self.systextures = {}
+        self.unused = OrderedDict()
+        self.colorized = set()
+        self.gpu_used = 0
+        conf = glob.env.config
+        self.budget = (conf["texture_budget"] if "texture_budget" in conf else 1024) * 1048576
+        imagebudget = (conf["image_cache_budget"] if "image_cache_budget" in conf else 512) * 1048576
+        self.images = ImageCache(imagebudget, min(4, os.cpu_count() or 1))
+        self.imageEdit = ImageEdit(glob, threads=min(4, os.cpu_count() or 1))
 
     def getTextures(self):
         return self.textures
 
+    def memoryUsage(self):
+        """
+        :return: estimated GPU memory and host memory (decoded images) in bytes
+        """
+        return self.gpu_used, self.images.memoryUsage()
+
+    def prefetch(self, paths):
+        """
+        decode images in background which are not yet loaded as a texture
+        """
+        for path in paths:
+            if path not in self.textures:
+                self.images.prefetch(path)
+
     def show(self):
         for k, l in self.textures.items():
             s = ""
@@ -46,22 +166,56 @@ class TextureRepo():
 
     def add_user(self, path, texture, timestamp, mhtex, obj):
         if path not in self.textures:
-            self.textures[path] = [texture, 1, timestamp, mhtex, [obj]]
+            size = texture.width() * texture.height() * 4
+            self.textures[path] = [texture, 1, timestamp, mhtex, [obj], size]
+            self.gpu_used += size
+            self.evict()
 
     def exists(self, path):
         if path in self.textures:
             return self.textures[path][0], self.textures[path][3]
         return None, None
 
+    def unreferenced(self, path):
+        return path in self.unused
+
+    def setColorized(self, path, colorized):
+        """
+        mark texture as changed by coloration (or reset to original image)
+        """
+        if path in self.textures:
+            if colorized:
+                self.colorized.add(path)
+            else:
+                self.colorized.discard(path)
+
     def inc(self, path, obj):
         if path in self.textures:
             self.textures[path][1] += 1
             self.textures[path][4].append(obj)
+            self.unused.pop(path, None)
+
+    def evict(self):
+        """
+        destroy least recently used unreferenced textures until budget is reached
+        """
+        while self.gpu_used > self.budget and len(self.unused) > 0:
+            path, dummy = self.unused.popitem(last=False)
+            self._destroy(path)
+
+    def _destroy(self, path):
+        m = self.textures[path]
+        m[0].destroy()
+        self.gpu_used -= m[5]
+        self.unused.pop(path, None)
+        self.colorized.discard(path)
+        del self.textures[path]
 
     def delete(self, texture, obj):
         """
         find texture path and check if obj is assigned
         if so, delete it and decrement counter
+        unreferenced textures are kept until budget is exceeded, colorized ones are destroyed
         """
         t = self.textures
         for elem in t:
@@ -71,24 +225,37 @@ class TextureRepo():
                     m[1] -= 1
                     m[4].remove(obj)
                 if m[1] == 0:
-                    m[0].destroy()
-                    del t[elem]
+                    if elem in self.colorized:
+                        self._destroy(elem)
+                        return
+                    self.unused[elem] = True
+                    self.unused.move_to_end(elem)
+                    self.evict()
                 return
 
     def refresh(self):
         """
         refresh all textures (to load e.g. a skin under construction
         """
-        for name, v in self.textures.items():
+        for name, v in list(self.textures.items()):
             # do not work with filedate 0 (means generated map)
             if v[2] != 0:
                 if os.path.isfile(name):
                     timestamp = int(os.stat(name).st_mtime)
                     if timestamp > v[2]:
+                        # unreferenced textures are simply dropped
+                        if name in self.unused:
+                            self._destroy(name)
+                            continue
                         v[0] = v[3].refresh(name)
                         v[2] = timestamp
+                        self.colorized.discard(name)
+                        self.gpu_used -= v[5]
+                        v[5] = v[0].width() * v[0].height() * 4
+                        self.gpu_used += v[5]
                 else:
                     self.glob.env.logLine(1, name + " does not exist, no reload.")
+        self.evict()
 
     def cleanup(self, textype="user"):
         """
@@ -100,67 +267,99 @@ class TextureRepo():
             t[elem][0].destroy()
 
         self.textures = {}
+        self.unused = OrderedDict()
+        self.colorized = set()
+        self.gpu_used = 0
 
         if textype == "system":
             t = self.systextures
             for elem in t:
                 t[elem][0].destroy()
+            self.images.cleanup()
+            self.imageEdit.cleanup()
 
 
 
 
 class ImageEdit():
-    def __init__(self, glob):
+    """
+    colorization of 32 bit images (BGRA byte order), images are processed in place
+    in tiles (optionally by several threads), colorized copies are memoized
+    """
+    def __init__(self, glob, maxresults=4, threads=1, tilesize=65536):
         self.glob = glob
+        self.maxresults = maxresults
+        self.threads = threads
+        self.tilesize = tilesize
+        self.results = OrderedDict()
 
-    def modifyToConstantHue(self, image, r, g, b):
+    def _pixels(self, image):
         ptr = image.bits()
         mlen = image.width() * image.height()
-        myarray = np.ndarray((mlen, 4), buffer=ptr, dtype=np.uint8)
+        return np.ndarray((mlen, 4), buffer=ptr, dtype=np.uint8)
 
-        qcol = QColor()
-        qcol.setRgbF(r,g,b)
-        hue = qcol.getHsv()[0]   # get "h" from given color in degrees
+    def _tiled(self, myarray, func, *params):
+        """
+        run func on tiles of the pixel array, numpy releases GIL, so threads work in parallel
+        """
+        tiles = [myarray[i:i+self.tilesize] for i in range(0, len(myarray), self.tilesize)]
+        if self.threads > 1 and len(tiles) > 1:
+            with ThreadPoolExecutor(max_workers=self.threads) as executor:
+                for dummy in executor.map(lambda tile: func(tile, *params), tiles):
+                    pass
+        else:
+            for tile in tiles:
+                func(tile, *params)
 
-        nrgb = myarray[:,:3].astype('float') / 256
+    def _lut(self, r, g, b):
+        """
+        lookup tables for channel multiplication in BGR order
+        """
+        values = np.arange(256, dtype=np.float32)
+        return [np.clip(values * m, 0, 255).astype(np.uint8) for m in (b, g, r)]
 
-        # keep value and saturation
+    def _hueTile(self, tile, factors):
+        # hsv to rgb with constant value and saturation:
+        # p = value - delta, q = value - hue_diff * delta, t = value - (1 - hue_diff) * delta
         #
-        value = np.max(nrgb,1)
-        ndelta = value - np.min(nrgb,1)
+        nrgb = tile[:, :3]
+        value = nrgb.max(1).astype(np.float32)
+        delta = value - nrgb.min(1)
+        for c in range(3):
+            if factors[c] == 0.0:
+                nrgb[:, c] = value
+            else:
+                nrgb[:, c] = value - factors[c] * delta
+
+    def _multTile(self, tile, lut):
+        for c in range(3):
+            np.take(lut[c], tile[:, c], out=tile[:, c])
+
+    def _greyMultTile(self, tile, lut):
+        value = tile[:, :3].max(1)
+        for c in range(3):
+            np.take(lut[c], value, out=tile[:, c])
 
+    def modifyToConstantHue(self, image, r, g, b):
+        myarray = self._pixels(image)
+
+        qcol = QColor()
+        qcol.setRgbF(r,g,b)
+        hue = qcol.getHsv()[0]   # get "h" from given color in degrees
+
+        # factors of delta (value - min) to subtract per channel (B, G, R)
         # hue is -1 if r, g, b are identical
         #
         if hue == -1:
-            sat = np.zeros(mlen)
-            hue_index = 0
-            p = value
-            q = value
-            t = value
+            factors = (0.0, 0.0, 0.0)
         else:
-            np.seterr(all='ignore')
-            sat = np.where(value == 0.0, 0.0, ndelta / value)
-            np.seterr(all='print')
             hue60 = hue / 60.0
             hue_index = floor(hue60) % 6
-            hue_diff = hue60 - np.floor(hue60)
-            p = value * (1.0 - sat)
-            q = value * (1.0 - (hue_diff * sat))
-            t = value * (1.0 - ((1.0 - hue_diff) * sat))
-
-        if hue_index == 0:
-            rgb = np.dstack((p, t, value))
-        elif hue_index == 1:
-            rgb = np.dstack((p, value, q))
-        elif hue_index == 2:
-            rgb = np.dstack((t, value, p))
-        elif hue_index == 3:
-            rgb = np.dstack((value, q, p))
-        elif hue_index == 4:
-            rgb = np.dstack((value, p, t))
-        else:
-            rgb = np.dstack((q, p, value))
-        myarray[:,:3] = rgb * 256
+            hue_diff = hue60 - floor(hue60)
+            p, q, t = 1.0, hue_diff, 1.0 - hue_diff
+            factors = [(p, t, 0.0), (p, 0.0, q), (t, 0.0, p), (0.0, q, p), (0.0, p, t), (q, p, 0.0)][hue_index]
+
+        self._tiled(myarray, self._hueTile, factors)
 
 
     def noColor(self, image):
@@ -168,17 +367,43 @@ class ImageEdit():
 
 
     def multColor(self, image, r, g, b):
-        ptr = image.bits()
-        mult = np.array([b, g, r, 1], dtype=np.float32)
-        mlen = image.width() * image.height()
-        myarray = np.ndarray((mlen, 4), buffer=ptr, dtype=np.uint8)
-        myarray2 = myarray.astype(np.float32, copy=True)
-        myarray2 *= mult
-        myarray[:] = myarray2.astype(np.uint8)[:]
+        self._tiled(self._pixels(image), self._multTile, self._lut(r, g, b))
 
     def greyToColor(self, image, r, g, b):
-        self.noColor(image)
-        self.multColor(image, r, g, b)
+        # desaturation (value of hsv) and multiplication in one step
+        #
+        self._tiled(self._pixels(image), self._greyMultTile, self._lut(r, g, b))
+
+    def colorize(self, image, method, r, g, b):
+        """
+        returns a colorized copy of an image, the last results are memoized
+
+        :param QImage image: original image (not changed)
+        :param int method: 1 = multiply color, 2 = desaturate + multiply color
+        :return: QImage
+        """
+        key = (image.cacheKey(), method, r, g, b)
+        if key in self.results:
+            self.results.move_to_end(key)
+            return self.results[key]
+
+        if image.depth() == 32:
+            result = image.copy()
+        else:
+            result = image.convertToFormat(QImage.Format_ARGB32)
+
+        if method == 1:
+            self.multColor(result, r, g, b)
+        elif method == 2:
+            self.greyToColor(result, r, g, b)
+
+        self.results[key] = result
+        while len(self.results) > self.maxresults:
+            self.results.popitem(last=False)
+        return result
+
+    def cleanup(self):
+        self.results = OrderedDict()
 
 class MH_Texture():
     def __init__(self, glob, textype="user", obj=None):
@@ -247,7 +472,7 @@ class MH_Texture():
         if textype == "user":
             ogl_texture, mhtex = self.repo.exists(path)
             if ogl_texture is not None:
-                if modify:
+                if modify or self.repo.unreferenced(path):
                     self.repo.inc(path, self.obj)
                 self.texture = ogl_texture
                 self.image = mhtex.getImage()
@@ -258,7 +483,7 @@ class MH_Texture():
             return None
 
         timestamp = int(os.stat(path).st_mtime)
-        self.image = QImage(path)
+        self.image = self.repo.images.get(path)
         self.glob.env.logLine(8, "Load: " + path + " " + str(self.image.format()))
         self.create(self.image)
         if textype == "system":
@@ -281,16 +506,25 @@ class MH_Texture():
         self.image.save(outname, "PNG", -1)
         return outname
 
-    def refresh_image(self):
+    def refresh_image(self, image=None):
         # print ("refresh: ", path)
+        if image is not None:
+            self.image = image
+            if self.textype == "user":
+                self.repo.setColorized(self.name, True)
         self.destroy()
         self.create(self.image)
         return self.texture
 
     def refresh(self, path=None):
+        """
+        recreate texture from original image, decoded images are taken from the image cache
+        """
         name = self.name if path is None else path
         self.destroy()
-        self.image = QImage(name)
+        self.image = self.repo.images.get(name)
+        if self.textype == "user":
+            self.repo.setColorized(name, False)
         self.create(self.image)
         return self.texture
 
@@ -0,0 +1,519 @@
+"""
+    License information: data/licenses/makehuman_license.txt
+    Author: black-punkduck
+
+    compares the array kernels of core.math element by element with reference implementations (the original
+    scalar code, copied below as orig* functions) and with properties of rotations, edge cases of slerp and
+    Euler angles are tested separately. Keyframe reduction and the bounded least squares solver are compared
+    with a plain recursive version and with a search over all active sets.
+
+    run: python -m pytest tests/test_math.py
+    timing: python tests/test_math.py
+"""
+import itertools
+import math
+import os
+import sys
+import time
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.math import (eulerMatrices, eulerMatrix, eulerMatricesToRadians, eulerMatrixToRadians,
+        quaternionsFromMatrices, quaternionFromMatrix, quaternionsMult, quaternionMult, quaternionsSlerp,
+        quaternionSlerp, quaternionsSlerpFromRest, quaternionSlerpFromMatrix, quaternionsToRotMatrices,
+        quaternionToRotMatrix, rotMatrices, rotMatrix, linearKeyframes, boundedLeastSquares)
+
+ORDERS = ["xyz", "xzy", "yzx", "yxz", "zxy", "zyx"]
+INDICES = [(0, 1, 2), (1, 2, 0), (2, 0, 1)]
+COUNT = 200
+
+_EPS = np.finfo(float).eps * 4.0
+
+# reference implementations: scalar code of core.math before the array kernels were introduced
+#
+def origEulerMatrixXYZ(ri, rj, rk, i, j, k):
+    M = np.identity(4)
+    si, sj, sk = math.sin(ri), math.sin(rj), math.sin(rk)
+    ci, cj, ck = math.cos(ri), math.cos(rj), math.cos(rk)
+    cc, cs = ci*ck, ci*sk
+    sc, ss = si*ck, si*sk
+
+    M[i, i] = cj*ck
+    M[i, j] = sj*sc-cs
+    M[i, k] = sj*cc+ss
+    M[j, i] = cj*sk
+    M[j, j] = sj*ss+cc
+    M[j, k] = sj*cs-sc
+    M[k, i] = -sj
+    M[k, j] = cj*si
+    M[k, k] = cj*ci
+    return(M)
+
+def origEulerMatrix(x, y, z, s="xyz"):
+    if s == "xyz":
+        return origEulerMatrixXYZ(x, y, z, 0, 1, 2)
+    elif s == "xzy":
+        return origEulerMatrixXYZ(-x, -y, -z, 0, 2, 1)
+    elif s == "yzx":
+        return origEulerMatrixXYZ(x, y, z, 1, 2, 0)
+    elif s == "yxz":
+        return origEulerMatrixXYZ(-x, -y, -z, 1, 0, 2)
+    elif s == "zxy":
+        return origEulerMatrixXYZ(x, y, z, 2, 0, 1)
+    return origEulerMatrixXYZ(-x, -y, -z, 2, 1, 0)
+
+def origEulerMatrixToRadians(m, i, j, k):
+    cy = math.sqrt(m[i, i] *m[i, i] + m[j, i]*m[j, i])
+    if cy > _EPS:
+        ax = math.atan2( m[k, j],  m[k, k])
+        ay = math.atan2(-m[k, i],  cy)
+        az = math.atan2( m[j, i],  m[i, i])
+    else:
+        ax = math.atan2(-m[j, k],  m[j, j])
+        ay = math.atan2(-m[k, i],  cy)
+        az = 0.0
+    return ax, ay, az
+
+def origQuaternionToRotMatrix(quaternion):
+    q = np.array(quaternion, dtype=np.float64, copy=True)
+    n = np.dot(q, q)
+    if n < _EPS:
+        return np.identity(4)
+    q *= math.sqrt(2.0 / n)
+    q = np.outer(q, q)
+    return np.array([
+        [1.0-q[2, 2]-q[3, 3],     q[1, 2]-q[3, 0],     q[1, 3]+q[2, 0], 0.0],
+        [    q[1, 2]+q[3, 0], 1.0-q[1, 1]-q[3, 3],     q[2, 3]-q[1, 0], 0.0],
+        [    q[1, 3]-q[2, 0],     q[2, 3]+q[1, 0], 1.0-q[1, 1]-q[2, 2], 0.0],
+        [                0.0,                 0.0,                 0.0, 1.0]])
+
+def origQuaternionFromMatrix(m):
+    tr = m[0][0] + m[1][1] + m[2][2]
+
+    if tr > 0:
+        S = math.sqrt(tr+1.0) * 2
+        qw = 0.25 * S
+        qx = (m[2][1] - m[1][2]) / S
+        qy = (m[0][2] - m[2][0]) / S
+        qz = (m[1][0] - m[0][1]) / S
+    elif (m[0][0] > m[1][1]) and (m[0][0] > m[2][2]):
+        S = math.sqrt(1.0 + m[0][0] - m[1][1] -  m[2][2]) * 2
+        qw = (m[2][1] - m[1][2]) / S
+        qx = 0.25 * S
+        qy = (m[0][1] + m[1][0]) / S
+        qz = (m[0][2] + m[2][0]) / S
+    elif m[1][1] > m[2][2]:
+        S = math.sqrt(1.0 + m[1][1] - m[0][0] - m[2][2]) * 2
+        qw = (m[0][2] - m[2][0]) / S
+        qx = (m[0][1] + m[1][0]) / S
+        qy = 0.25 * S
+        qz = (m[1][2] + m[2][1]) / S
+    else:
+        S = math.sqrt(1.0 +  m[2][2] - m[0][0] - m[1][1]) * 2
+        qw = (m[1][0] - m[0][1]) / S
+        qx = (m[0][2] + m[2][0]) / S
+        qy = (m[1][2] + m[2][1]) / S
+        qz = 0.25 * S
+
+    return np.asarray([qw, qx, qy, qz], dtype=np.float32)
+
+def origQuaternionMult(quaternion1, quaternion0):
+    w0, x0, y0, z0 = quaternion0
+    w1, x1, y1, z1 = quaternion1
+    return np.array([-x1*x0 - y1*y0 - z1*z0 + w1*w0,
+                         x1*w0 + y1*z0 - z1*y0 + w1*x0,
+                        -x1*z0 + y1*w0 + z1*x0 + w1*y0,
+                         x1*y0 - y1*x0 + z1*w0 + w1*z0], dtype=np.float64)
+
+def origQuaternionSlerp(quat0, quat1, fraction, shortestpath=True):
+    q0 = np.array(quat0[:4], dtype=np.float64, copy=True)
+    q1 = np.array(quat1[:4], dtype=np.float64, copy=True)
+    if fraction == 0.0:
+        return q0
+    elif fraction == 1.0:
+        return q1
+
+    d = np.dot(q0, q1)
+    if abs(abs(d) - 1.0) < _EPS:
+        return q0
+
+    if shortestpath and d < 0.0:
+        d = -d
+        np.negative(q1, q1)
+
+    angle = math.acos(d)
+    if abs(angle) < _EPS:
+        return q0
+
+    isin = 1.0 / math.sin(angle)
+    q0 *= math.sin((1.0 - fraction) * angle) * isin
+    q1 *= math.sin(fraction * angle) * isin
+    q0 += q1
+    return q0
+
+def origQuaternionSlerpFromMatrix(mat, fraction, shortestpath=True):
+    m = np.identity(4, dtype=np.float32)
+    m[:3, :3] = mat
+    quat0 = np.asarray([1,0,0,0], dtype=np.float32)
+    quat1 = origQuaternionFromMatrix(m)
+    return (origQuaternionSlerp(quat0, quat1, fraction, shortestpath))
+
+def origRotMatrix(angle, direction):
+    sina = math.sin(angle)
+    cosa = math.cos(angle)
+    direction = np.array (direction[:3],  dtype=np.float32)
+    direction /= math.sqrt(np.dot(direction, direction))
+
+    R = np.diag([cosa, cosa, cosa])
+    R += np.outer(direction, direction) * (1.0 - cosa)
+    direction *= sina
+    R += np.array([[ 0.0,         -direction[2],  direction[1]],
+                      [ direction[2], 0.0,          -direction[0]],
+                      [-direction[1], direction[0],  0.0]])
+    M = np.identity(4)
+    M[:3, :3] = R
+    return (M)
+
+def origLinearKeyframes(values, tolerance):
+    """
+    recursive Ramer-Douglas-Peucker with loops over frames and components
+    """
+    keep = {0, len(values) - 1}
+
+    def segment(a, b):
+        best, dev = None, tolerance
+        for f in range(a + 1, b):
+            t = (f - a) / (b - a)
+            d = max([abs(values[f][c] - (values[a][c] + t * (values[b][c] - values[a][c]))) for c in range(len(values[f]))])
+            if d > dev:
+                best, dev = f, d
+        if best is not None:
+            keep.add(best)
+            segment(a, best)
+            segment(best, b)
+
+    if len(values) > 2:
+        segment(0, len(values) - 1)
+    return sorted(keep)[:len(values)]
+
+def origBoundedLeastSquares(A, b, lower, upper, x0, damping):
+    """
+    solution of the strictly convex problem by trying all combinations of free and fixed variables
+    """
+    n = A.shape[1]
+    H = A.T @ A + damping * np.identity(n)
+    g = A.T @ b + damping * x0
+
+    def cost(x):
+        return np.sum((A @ x - b) ** 2) + damping * np.sum((x - x0) ** 2)
+
+    best, bestcost = None, np.inf
+    for states in itertools.product((0, 1, 2), repeat=n):
+        x = np.where(np.array(states) == 1, lower, upper).astype(np.float64)
+        idx = np.flatnonzero(np.array(states) == 0)
+        if len(idx) > 0:
+            fixed = np.array(states) != 0
+            x[idx] = np.linalg.solve(H[np.ix_(idx, idx)], g[idx] - H[np.ix_(idx, fixed)] @ x[fixed])
+        if np.all(x >= lower - 1e-12) and np.all(x <= upper + 1e-12) and cost(x) < bestcost:
+            best, bestcost = x, cost(x)
+    return best
+
+def randomAngles(rng, count=COUNT):
+    return rng.uniform(-np.pi, np.pi, (3, count))
+
+def randomQuaternions(rng, count=COUNT):
+    q = rng.normal(size=(count, 4))
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+def sameRotation(q0, q1, atol=1e-5):
+    """
+    q and -q are the same rotation
+    """
+    return np.allclose(q0, q1, atol=atol) or np.allclose(q0, -q1, atol=atol)
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(42)
+
+@pytest.mark.parametrize("order", ORDERS)
+def test_eulerMatrices_stack(rng, order):
+    x, y, z = randomAngles(rng)
+    stack = eulerMatrices(x, y, z, order)
+    assert stack.shape == (COUNT, 4, 4)
+    for n in range(COUNT):
+        np.testing.assert_allclose(stack[n], origEulerMatrix(x[n], y[n], z[n], order), atol=1e-12)
+        np.testing.assert_array_equal(eulerMatrix(x[n], y[n], z[n], order), origEulerMatrix(x[n], y[n], z[n], order))
+
+    r = stack[:, :3, :3]
+    np.testing.assert_allclose(r @ r.transpose(0, 2, 1), np.broadcast_to(np.identity(3), r.shape), atol=1e-12)
+    np.testing.assert_allclose(np.linalg.det(r), 1.0, atol=1e-12)
+
+def test_eulerMatrices_axes(rng):
+    x, y, z = randomAngles(rng)
+    axes = np.identity(3)
+    expect = rotMatrices(z, axes[2]) @ rotMatrices(y, axes[1]) @ rotMatrices(x, axes[0])
+    np.testing.assert_allclose(eulerMatrices(x, y, z, "xyz"), expect, atol=1e-6)
+
+@pytest.mark.parametrize("ijk", INDICES)
+def test_eulerMatricesToRadians_stack(rng, ijk):
+    i, j, k = ijk
+    x, y, z = randomAngles(rng)
+    y = y / 2.0
+    m = eulerMatrices(x, y, z, "xyz"[i] + "xyz"[j] + "xyz"[k])
+    ax, ay, az = eulerMatricesToRadians(m, i, j, k)
+    for n in range(COUNT):
+        expect = origEulerMatrixToRadians(m[n], i, j, k)
+        np.testing.assert_allclose((ax[n], ay[n], az[n]), expect, atol=1e-12)
+        assert eulerMatrixToRadians(m[n], i, j, k) == expect
+
+    # angles reproduce the matrices
+    #
+    np.testing.assert_allclose(eulerMatrices(ax, ay, az, "xyz"[i] + "xyz"[j] + "xyz"[k]), m, atol=1e-9)
+
+@pytest.mark.parametrize("ijk", INDICES)
+def test_eulerMatricesToRadians_gimbal(rng, ijk):
+    i, j, k = ijk
+    order = "xyz"[i] + "xyz"[j] + "xyz"[k]
+    x = rng.uniform(-np.pi, np.pi, 20)
+    z = rng.uniform(-np.pi, np.pi, 20)
+    for pitch in (np.pi / 2, -np.pi / 2):
+        m = eulerMatrices(x, np.full(20, pitch), z, order)
+        ax, ay, az = eulerMatricesToRadians(m, i, j, k)
+        assert np.all(np.isfinite(ax)) and np.all(np.isfinite(ay))
+        np.testing.assert_allclose(az, 0.0)
+        np.testing.assert_allclose(ay, pitch, atol=1e-6)
+        np.testing.assert_allclose(eulerMatrices(ax, ay, az, order), m, atol=1e-6)
+        for n in range(20):
+            np.testing.assert_allclose((ax[n], ay[n], az[n]), origEulerMatrixToRadians(m[n], i, j, k), atol=1e-12)
+
+def test_quaternionsToRotMatrices_stack(rng):
+    q = randomQuaternions(rng)
+    stack = quaternionsToRotMatrices(q)
+    for n in range(COUNT):
+        np.testing.assert_allclose(stack[n], origQuaternionToRotMatrix(q[n]), atol=1e-12)
+        np.testing.assert_array_equal(quaternionToRotMatrix(q[n]), origQuaternionToRotMatrix(q[n]))
+
+    # not normalized quaternions give the same rotation
+    #
+    np.testing.assert_allclose(quaternionsToRotMatrices(q * 3.0), stack, atol=1e-12)
+    r = stack[:, :3, :3]
+    np.testing.assert_allclose(np.linalg.det(r), 1.0, atol=1e-12)
+
+def test_quaternionsToRotMatrices_zero():
+    q = np.array([[0.0, 0.0, 0.0, 0.0], [1.0, 0.0, 0.0, 0.0]])
+    np.testing.assert_array_equal(quaternionsToRotMatrices(q), np.broadcast_to(np.identity(4), (2, 4, 4)))
+    np.testing.assert_array_equal(quaternionToRotMatrix(q[0]), origQuaternionToRotMatrix(q[0]))
+
+def test_quaternionsFromMatrices_stack(rng):
+    q = randomQuaternions(rng)
+    m = quaternionsToRotMatrices(q)
+    stack = quaternionsFromMatrices(m)
+    assert stack.shape == (COUNT, 4)
+    for n in range(COUNT):
+        np.testing.assert_allclose(stack[n], origQuaternionFromMatrix(m[n]), atol=1e-7)
+        np.testing.assert_array_equal(quaternionFromMatrix(m[n]), origQuaternionFromMatrix(m[n]))
+        assert sameRotation(stack[n], q[n])
+
+    # 3x3 matrices are accepted as well
+    #
+    np.testing.assert_allclose(quaternionsFromMatrices(m[:, :3, :3]), stack)
+
+def test_quaternionsFromMatrices_cases():
+    """
+    each branch: positive trace and largest diagonal element x, y or z (rotations by pi)
+    """
+    for q in ([1.0, 0.0, 0.0, 0.0], [0.0, 1.0, 0.0, 0.0], [0.0, 0.0, 1.0, 0.0], [0.0, 0.0, 0.0, 1.0]):
+        q = np.array(q)
+        m = origQuaternionToRotMatrix(q)
+        np.testing.assert_allclose(quaternionsFromMatrices(m[None])[0], origQuaternionFromMatrix(m), atol=1e-7)
+        assert sameRotation(quaternionsFromMatrices(m[None])[0], q)
+
+def test_quaternionsMult_stack(rng):
+    q0 = randomQuaternions(rng)
+    q1 = randomQuaternions(rng)
+    stack = quaternionsMult(q1, q0)
+    assert stack.shape == (COUNT, 4)
+    for n in range(COUNT):
+        np.testing.assert_allclose(stack[n], origQuaternionMult(q1[n], q0[n]), atol=1e-12)
+        np.testing.assert_array_equal(quaternionMult(q1[n], q0[n]), origQuaternionMult(q1[n], q0[n]))
+
+    # product of quaternions is the product of the rotation matrices, one factor can be broadcast
+    #
+    np.testing.assert_allclose(quaternionsToRotMatrices(stack),
+            quaternionsToRotMatrices(q1) @ quaternionsToRotMatrices(q0), atol=1e-12)
+    np.testing.assert_allclose(quaternionsMult(q1[0], q0), [origQuaternionMult(q1[0], q) for q in q0], atol=1e-12)
+
+def test_quaternionsSlerp_stack(rng):
+    q0 = randomQuaternions(rng)
+    q1 = randomQuaternions(rng)
+    f = rng.uniform(0.0, 1.0, COUNT)
+    for shortest in (True, False):
+        stack = quaternionsSlerp(q0, q1, f, shortest)
+        for n in range(COUNT):
+            np.testing.assert_allclose(stack[n], origQuaternionSlerp(q0[n], q1[n], f[n], shortest), atol=1e-12)
+            np.testing.assert_array_equal(quaternionSlerp(q0[n], q1[n], f[n], shortest),
+                    origQuaternionSlerp(q0[n], q1[n], f[n], shortest))
+        np.testing.assert_allclose(np.linalg.norm(stack, axis=1), 1.0, atol=1e-9)
+
+    # angle to both ends is proportional to fraction
+    #
+    stack = quaternionsSlerp(q0, q1, f)
+    d = np.abs(np.einsum("ij,ij->i", q0, q1))
+    total = np.arccos(np.clip(d, -1.0, 1.0))
+    part = np.arccos(np.clip(np.abs(np.einsum("ij,ij->i", q0, stack)), -1.0, 1.0))
+    np.testing.assert_allclose(part, f * total, atol=1e-6)
+
+def test_quaternionsSlerp_edges(rng):
+    q0 = randomQuaternions(rng, 10)
+    q1 = randomQuaternions(rng, 10)
+
+    # fraction 0 and 1
+    #
+    np.testing.assert_array_equal(quaternionsSlerp(q0, q1, 0.0), q0)
+    np.testing.assert_array_equal(quaternionsSlerp(q0, q1, 1.0), q1)
+
+    # identical and antipodal quaternions
+    #
+    for other in (q0, -q0):
+        for f in (0.25, 0.5, 0.75):
+            result = quaternionsSlerp(q0, other, f)
+            assert np.all(np.isfinite(result))
+            for n in range(10):
+                assert sameRotation(result[n], q0[n], atol=1e-7)
+                np.testing.assert_array_equal(result[n], origQuaternionSlerp(q0[n], other[n], f))
+
+def test_quaternionsSlerp_broadcast(rng):
+    q = randomQuaternions(rng, 10)
+    f = np.linspace(0.0, 1.0, 10)
+    rest = np.array([1.0, 0.0, 0.0, 0.0])
+    stack = quaternionsSlerp(rest, q, f)
+    for n in range(10):
+        np.testing.assert_allclose(stack[n], origQuaternionSlerp(rest, q[n], f[n]), atol=1e-12)
+
+def test_quaternionsSlerpFromRest_stack(rng):
+    q = randomQuaternions(rng)
+    f = rng.uniform(0.0, 1.0, COUNT)
+    f[:3] = [0.0, 1.0, 0.5]
+    q[3] = [1.0, 0.0, 0.0, 0.0]
+    q[4] = [-1.0, 0.0, 0.0, 0.0]
+    rest = np.array([1.0, 0.0, 0.0, 0.0])
+    for shortest in (True, False):
+        stack = quaternionsSlerpFromRest(q, f, shortest)
+        for n in range(COUNT):
+            np.testing.assert_allclose(stack[n], origQuaternionSlerp(rest, q[n], f[n], shortest), atol=1e-12)
+
+    # stacked (bones, units) fractions as used for face units, result is the slerp from the rest matrix
+    #
+    f2 = rng.uniform(0.0, 1.0, (COUNT, 3))
+    stack = quaternionsSlerpFromRest(np.repeat(q[:, None, :], 3, axis=1), f2)
+    m = quaternionsToRotMatrices(q)
+    for n in range(0, COUNT, 10):
+        for u in range(3):
+            np.testing.assert_allclose(stack[n, u], origQuaternionSlerpFromMatrix(m[n, :3, :3], f2[n, u]), atol=1e-6)
+            np.testing.assert_array_equal(quaternionSlerpFromMatrix(m[n, :3, :3], f2[n, u]),
+                    origQuaternionSlerpFromMatrix(m[n, :3, :3], f2[n, u]))
+
+def test_rotMatrices_stack(rng):
+    angles = rng.uniform(-np.pi, np.pi, COUNT)
+    directions = rng.normal(size=(COUNT, 3))
+    stack = rotMatrices(angles, directions)
+    for n in range(COUNT):
+        np.testing.assert_allclose(stack[n], origRotMatrix(angles[n], directions[n]), atol=1e-6)
+        np.testing.assert_array_equal(rotMatrix(angles[n], directions[n]), origRotMatrix(angles[n], directions[n]))
+
+    # direction is the rotation axis, angle 0 is identity
+    #
+    unit = (directions / np.linalg.norm(directions, axis=1, keepdims=True)).astype(np.float32)
+    np.testing.assert_allclose(np.einsum("nij,nj->ni", stack[:, :3, :3], unit), unit, atol=1e-6)
+    np.testing.assert_allclose(rotMatrices(np.zeros(COUNT), directions), np.broadcast_to(np.identity(4), (COUNT, 4, 4)),
+            atol=1e-12)
+
+@pytest.mark.parametrize("tolerance", [0.0, 0.01, 0.1, 1.0])
+def test_linearKeyframes(rng, tolerance):
+    t = np.linspace(0.0, 4.0, 120)
+    values = np.stack([np.sin(t), np.cos(2.0 * t), np.where(t > 2.0, 1.0, 0.0), t * 0.3], axis=1)
+    values += rng.normal(scale=0.002, size=values.shape)
+    keys = linearKeyframes(values, tolerance)
+    np.testing.assert_array_equal(keys, origLinearKeyframes(values.tolist(), tolerance))
+
+    # interpolation between keyframes reproduces all values within tolerance
+    #
+    interpolated = np.stack([np.interp(np.arange(len(values)), keys, values[keys, c]) for c in range(values.shape[1])], axis=1)
+    assert np.abs(interpolated - values).max() <= tolerance + 1e-12
+
+def test_linearKeyframes_edges():
+    np.testing.assert_array_equal(linearKeyframes(np.zeros((0, 3)), 0.1), [])
+    np.testing.assert_array_equal(linearKeyframes(np.zeros((2, 3)), 0.1), [0, 1])
+
+    # constant and linear motion need only first and last frame
+    #
+    values = np.outer(np.arange(50.0), [1.0, -2.0, 0.0])
+    np.testing.assert_array_equal(linearKeyframes(values, 1e-9), [0, 49])
+
+@pytest.mark.parametrize("damping", [0.0, 0.1, 1.0])
+def test_boundedLeastSquares(rng, damping):
+    for n in range(20):
+        A = rng.normal(size=(8, 4))
+        b = rng.normal(size=8) * 3.0
+        lower = rng.uniform(-1.0, 0.0, 4)
+        upper = rng.uniform(0.0, 1.0, 4)
+        upper[3] = lower[3]                 # fixed variable
+        x0 = np.clip(rng.normal(size=4) * 0.2, lower, upper)
+        x = boundedLeastSquares(A, b, lower, upper, x0, damping)
+        assert np.all(x >= lower) and np.all(x <= upper)
+        np.testing.assert_allclose(x, origBoundedLeastSquares(A, b, lower, upper, x0, damping), atol=1e-9)
+
+def test_boundedLeastSquares_underdetermined(rng):
+    """
+    more variables than equations: damping makes the solution unique
+    """
+    A = rng.normal(size=(2, 5))
+    b = rng.normal(size=2)
+    lower = np.full(5, -0.5)
+    upper = np.full(5, 0.5)
+    x0 = np.zeros(5)
+    x = boundedLeastSquares(A, b, lower, upper, x0, 0.01)
+    np.testing.assert_allclose(x, origBoundedLeastSquares(A, b, lower, upper, x0, 0.01), atol=1e-9)
+
+    # without bounds hit, result is the damped least squares solution
+    #
+    x = boundedLeastSquares(A, b * 0.01, np.full(5, -10.0), np.full(5, 10.0), x0, 0.01)
+    np.testing.assert_allclose(x, np.linalg.solve(A.T @ A + 0.01 * np.identity(5), A.T @ b * 0.01), atol=1e-12)
+
+def timing(count=100000, repeat=200):
+    """
+    compare array kernels with calling the original scalar implementations in a loop
+    """
+    rng = np.random.default_rng(1)
+    x, y, z = randomAngles(rng, count)
+    q0 = randomQuaternions(rng, count)
+    q1 = randomQuaternions(rng, count)
+    f = rng.uniform(0.0, 1.0, count)
+    m = quaternionsToRotMatrices(q0)
+    d = rng.normal(size=(count, 3))
+    rest = np.array([1.0, 0.0, 0.0, 0.0])
+    tests = [
+        ("eulerMatrices", lambda: eulerMatrices(x, y, z, "yzx"), lambda n: origEulerMatrix(x[n], y[n], z[n], "yzx")),
+        ("eulerMatricesToRadians", lambda: eulerMatricesToRadians(m, 1, 2, 0), lambda n: origEulerMatrixToRadians(m[n], 1, 2, 0)),
+        ("quaternionsFromMatrices", lambda: quaternionsFromMatrices(m), lambda n: origQuaternionFromMatrix(m[n])),
+        ("quaternionsMult", lambda: quaternionsMult(q0, q1), lambda n: origQuaternionMult(q0[n], q1[n])),
+        ("quaternionsSlerp", lambda: quaternionsSlerp(q0, q1, f), lambda n: origQuaternionSlerp(q0[n], q1[n], f[n])),
+        ("quaternionsSlerpFromRest", lambda: quaternionsSlerpFromRest(q1, f), lambda n: origQuaternionSlerp(rest, q1[n], f[n])),
+        ("quaternionsToRotMatrices", lambda: quaternionsToRotMatrices(q0), lambda n: origQuaternionToRotMatrix(q0[n])),
+        ("rotMatrices", lambda: rotMatrices(x, d), lambda n: origRotMatrix(x[n], d[n]))]
+
+    print ("%-26s %12s %12s %8s" % ("function", "array (us)", "orig (us)", "speedup"))
+    for name, array, scalar in tests:
+        start = time.perf_counter()
+        array()
+        tarray = (time.perf_counter() - start) / count
+        start = time.perf_counter()
+        for n in range(repeat):
+            scalar(n)
+        tscalar = (time.perf_counter() - start) / repeat
+        print ("%-26s %12.3f %12.3f %8.0f" % (name, tarray * 1e6, tscalar * 1e6, tscalar / tarray))
+
+if __name__ == '__main__':
+    timing()